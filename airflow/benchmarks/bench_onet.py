@@ -0,0 +1,96 @@
+"""
+Per-call latency of get_careers_for_skill: the previous path (new Supabase client + RPC per call)
+versus the local O*NET index and its memoized lookup.
+
+Generates an O*NET-shaped release (~93k ability rows) unless --data-dir points to the real files.
+The RPC paths need SUPABASE_PROJECT_URL/SUPABASE_SECRET_KEY and --rpc, otherwise only the client
+construction of the previous path is measured.
+
+    python -m benchmarks.bench_onet
+    python -m benchmarks.bench_onet --data-dir include/onet --rpc
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from supabase import create_client
+
+from include import onet
+from include.onet import OnetIndex
+
+ABILITIES_HEADER = "O*NET-SOC Code\tElement ID\tElement Name\tScale ID\tData Value\tN\tStandard Error\tLower CI Bound\tUpper CI Bound\tRecommend Suppress\tNot Relevant\tDate\tDomain Source"
+
+
+def write_release(path: Path, abilities: int = 52, occupations: int = 900, seed: int = 42) -> list[str]:
+    rng = random.Random(seed)
+    codes = [f"{rng.randrange(11, 54)}-{i:04d}.00" for i in range(occupations)]
+    names = [f"Ability {i}" for i in range(abilities)]
+
+    with open(path / onet.OCCUPATIONS_FILE, "w", encoding="utf-8") as f:
+        f.write("O*NET-SOC Code\tTitle\tDescription\n")
+        for i, code in enumerate(codes):
+            f.write(f"{code}\tOccupation {i}\tDescription of occupation {i}.\n")
+
+    with open(path / onet.ABILITIES_FILE, "w", encoding="utf-8") as f:
+        f.write(ABILITIES_HEADER + "\n")
+        for code in codes:
+            for i, name in enumerate(names):
+                for scale, value in (("IM", rng.uniform(1, 5)), ("LV", rng.uniform(0, 7))):
+                    f.write(f"{code}\t1.A.{i}\t{name}\t{scale}\t{value:.2f}\t8\t0.2\t0\t0\tN\tN\t08/2023\tAnalyst\n")
+    return names
+
+
+def measure(name: str, call, skills: list[str], repeat: int) -> None:
+    samples = []
+    for i in range(repeat):
+        skill = skills[i % len(skills)]
+        start = time.perf_counter()
+        call(skill)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    print(f"{name:<34} p50 {statistics.median(samples) * 1e6:10.1f} us  p99 {p99 * 1e6:10.1f} us  ({repeat} calls)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", type=Path, help="Directory with Abilities.txt and Occupation Data.txt")
+    parser.add_argument("--rpc", action="store_true", help="Also measure the RPC against Supabase")
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    url = os.getenv("SUPABASE_PROJECT_URL", "https://example.supabase.co")
+    key = os.getenv("SUPABASE_SECRET_KEY", "secret")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or Path(tmp)
+        skills = None if args.data_dir else write_release(data_dir)
+
+        start = time.perf_counter()
+        index = OnetIndex.from_files(data_dir / onet.ABILITIES_FILE, data_dir / onet.OCCUPATIONS_FILE)
+        print(f"{'index load (once per process)':<34} {(time.perf_counter() - start) * 1000:10.1f} ms  ({len(index)} abilities)")
+        skills = skills or sorted(index._careers)
+
+        measure("previous: create_client only", lambda skill: create_client(url, key), skills, min(args.repeat, 200))
+        if args.rpc:
+            def rpc_per_call(skill):
+                create_client(url, key).rpc("get_careers_for_skill", {"skill_name": skill}).execute()
+
+            client = create_client(url, key)
+            measure("previous: create_client + RPC", rpc_per_call, skills, min(args.repeat, 50))
+            measure("fallback: cached client + RPC", lambda skill: client.rpc("get_careers_for_skill", {"skill_name": skill}).execute(), skills, min(args.repeat, 50))
+
+        measure("index lookup", index.careers, skills, args.repeat)
+
+        onet.ONET_DATA_DIR = data_dir
+        onet.load_index.cache_clear()
+        onet._careers_for_skill.cache_clear()
+        onet.get_careers_for_skill(skills[0])  # loads the index outside of the measurement
+        measure("get_careers_for_skill (memoized)", onet.get_careers_for_skill, skills, args.repeat)
+
+if __name__ == "__main__":
+    main()
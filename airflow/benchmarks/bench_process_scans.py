@@ -0,0 +1,358 @@
+"""
+Offline benchmark of `process_scans`: N synthetic scans through the full agent chain, per execution mode.
+
+The agents are the real ones from `include/agents.py` (instructions, output types, tools), but
+`PydanticAIHook` is swapped for `benchmarks.fakes.FakeHook`, whose deterministic model answers
+after a configured latency. Supabase is replaced by an in-memory client with a simulated round
+trip. The agent work of the batched and pipelined modes runs through `include/pipeline.py`
+unchanged. Airflow itself isn't started: task instances are simulated with their
+`max_active_tis_per_dag` limits, the worker slots, a fixed overhead per task instance for
+scheduling, queueing and worker startup, and the retries of the Dag. Each task instance gets its
+own adaptive concurrency limiter, like a task process. With --quota, the fake model rejects calls
+beyond that many concurrent ones with a 429. With --analysis-tiering, the batched and pipelined
+modes run the analysis on the fast model first (`include/tiering.py`), the mapped mode doesn't.
+
+Times are given in simulated seconds and scaled down by --scale while running, the report
+scales them back up. CPU time of pydantic-ai is scaled up along with them, keep --scale moderate.
+
+    python -m benchmarks.bench_process_scans --scans 50
+    python -m benchmarks.bench_process_scans --scans 50 --mode batched --max-active-tis process_scan_batch=4
+    python -m benchmarks.bench_process_scans --scans 20 --runs 4 --max-active-runs 2 --ti-overhead 2
+    python -m benchmarks.bench_process_scans --scans 50 --mode batched --quota 12 --static-limit 10
+    python -m benchmarks.bench_process_scans --scans 50 --mode batched --analysis-tiering --toys 5 --toys-max 40
+"""
+import argparse
+import asyncio
+import logging
+import math
+import statistics
+import time
+from contextvars import ContextVar
+from io import BytesIO
+
+from PIL import Image
+
+from benchmarks.fakes import FakeModelSettings, FakeSupabase, fake_hook_class
+from include import agents as agents_module
+from include import pipeline
+from include.concurrency import AGENT_THROTTLE_BACKOFF_SECONDS, AdaptiveLimiter
+from include.pipeline import inventory_prompt, roadmap_prompt
+from include.results import build_results
+from include.tiering import get_tier_stats
+
+MODES = ("mapped", "pipelined", "batched")
+
+# max_active_tis_per_dag of the tasks in dags/playroom_diet.py
+DAG_MAX_ACTIVE_TIS = {
+    "analyze_image": 2,
+    "generate_play_quest": 2,
+    "analyze_playroom": 2,
+    "safety_check": 2,
+    "save_result": 2,
+    "process_scan": 4,
+    "process_scan_batch": 2,
+}
+
+# retries and retry_delay of the Dag's default_args
+DAG_RETRIES = 2
+DAG_RETRY_DELAY = 30.0
+
+_run_scan = pipeline.run_scan
+
+# The limiter of the simulated task instance, replaces the one per task process
+_task_limiter: ContextVar[AdaptiveLimiter] = ContextVar("task_limiter")
+
+# Typical model latencies in seconds
+DEFAULT_LATENCY = {
+    "analyze_image": 15.0,
+    "analyze_playroom": 25.0,
+    "analyze_playroom_fast": 10.0,
+    "generate_play_quest": 8.0,
+    "safety_check": 10.0,
+}
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+class SimulatedScheduler:
+    """Runs task instances under per-task limits and the worker slots, each paying a fixed overhead."""
+
+    def __init__(self, ti_overhead: float, worker_slots: int, max_active_tis: dict[str, int], retry_delay: float,
+                 new_limiter):
+        self.ti_overhead = ti_overhead
+        self.retry_delay = retry_delay
+        self.new_limiter = new_limiter
+        self.limiters: list[AdaptiveLimiter] = []
+        self.retried = 0
+        self.slots = asyncio.Semaphore(worker_slots)
+        self.max_active_tis = max_active_tis
+        self.task_limits: dict[str, asyncio.Semaphore] = {}
+        self.task_instances = 0
+        self.overhead_seconds = 0.0
+        self.work_seconds = 0.0
+        self.task_durations: dict[str, list[float]] = {}
+
+    async def run(self, task_id: str, work):
+        for attempt in range(DAG_RETRIES + 1):
+            try:
+                return await self._run_once(task_id, work)
+            except Exception:
+                if attempt == DAG_RETRIES:
+                    raise
+                # The task instance gives up its slot and is queued again after the retry delay
+                self.retried += 1
+                await asyncio.sleep(self.retry_delay)
+
+    async def _run_once(self, task_id: str, work):
+        limit = self.task_limits.setdefault(task_id, asyncio.Semaphore(self.max_active_tis.get(task_id, 1024)))
+        async with limit, self.slots:
+            self.task_instances += 1
+            await asyncio.sleep(self.ti_overhead)
+            self.overhead_seconds += self.ti_overhead
+            limiter = self.new_limiter()
+            self.limiters.append(limiter)
+            token = _task_limiter.set(limiter)
+            start = time.monotonic()
+            try:
+                return await work()
+            finally:
+                _task_limiter.reset(token)
+                duration = time.monotonic() - start
+                self.work_seconds += duration
+                self.task_durations.setdefault(task_id, []).append(duration)
+
+
+class Benchmark:
+
+    def __init__(self, args):
+        self.args = args
+        self.scale = args.scale
+        self.supabase = FakeSupabase(latency=args.db_latency * self.scale)
+        self.scheduler = SimulatedScheduler(
+            args.ti_overhead * self.scale, args.worker_slots, {**DAG_MAX_ACTIVE_TIS, **args.max_active_tis},
+            DAG_RETRY_DELAY * self.scale, self.new_limiter
+        )
+        self.settings = None
+        self.stage_durations: dict[str, list[float]] = {}
+        self.scan_latencies: list[float] = []
+        self.start = 0.0
+
+        buffer = BytesIO()
+        Image.new("RGB", (args.image_edge, args.image_edge * 3 // 4), "white").save(buffer, "JPEG")
+        self.image_bytes = buffer.getvalue()
+
+    def new_limiter(self) -> AdaptiveLimiter:
+        backoff_seconds = AGENT_THROTTLE_BACKOFF_SECONDS * self.scale
+        if self.args.static_limit:
+            limit = self.args.static_limit
+            return AdaptiveLimiter(initial=limit, minimum=limit, maximum=limit, backoff_seconds=backoff_seconds)
+        return AdaptiveLimiter(backoff_seconds=backoff_seconds)
+
+    def install(self) -> None:
+        self.settings = FakeModelSettings(
+            latency={stage: seconds * self.scale for stage, seconds in self.args.latency.items()},
+            jitter=self.args.jitter,
+            toys=self.args.toys,
+            distinct_inventories=self.args.distinct_inventories,
+            quota=self.args.quota,
+            toys_max=self.args.toys_max,
+            fast_invalid_rate=self.args.fast_invalid_rate,
+        )
+        agents_module.PydanticAIHook = fake_hook_class(self.settings)
+        agents_module.ANALYSIS_TIERING = self.args.analysis_tiering
+        pipeline.ANALYSIS_TIER_MAX_TOYS = self.args.tier_max_toys
+        get_tier_stats.cache_clear()
+
+        async def acreate_client(url, key):
+            return self.supabase
+
+        def mark_progress(scan_id, run_id, stage, state, results=None):
+            time.sleep(self.supabase.latency)
+
+        async def timed_run_scan(*args, **kwargs):
+            timings = await _run_scan(*args, **kwargs)
+            for stage in pipeline.AGENT_STAGES:
+                self.stage_durations.setdefault(stage, []).append(timings[stage])
+            self.scan_latencies.append(time.monotonic() - self.start)
+            return timings
+
+        pipeline.acreate_client = acreate_client
+        pipeline.get_image_bytes = lambda image_path: self.image_bytes
+        pipeline.get_agent_limiter = _task_limiter.get
+        pipeline.mark_progress = mark_progress
+        pipeline.run_scan = timed_run_scan
+
+    def create_scans(self) -> None:
+        self.supabase.tables["scans"] = [
+            {"id": f"scan-{i:05d}", "image_path": f"scans/scan-{i:05d}.jpg", "child_age": 2 + i % 8, "status": "processing"}
+            for i in range(self.args.scans)
+        ]
+
+    async def claim(self, count: int, run_id: str) -> list[tuple]:
+        await asyncio.sleep(self.supabase.latency)
+        return self.supabase.claim(count, run_id)
+
+    async def run_dag(self, claim_count: int, run_id: str) -> None:
+        records = await self.scheduler.run("get_new_scans", lambda: self.claim(claim_count, run_id))
+        await getattr(self, f"run_{self.args.mode}")(records, run_id)
+
+    async def run_batched(self, records: list[tuple], run_id: str) -> None:
+        size = self.args.batch_size
+
+        async def chunk():
+            return [records[i:i + size] for i in range(0, len(records), size)]
+
+        chunks = await self.scheduler.run("chunk_scans", chunk)
+        await asyncio.gather(*(
+            self.scheduler.run("process_scan_batch", lambda c=c: pipeline.process_batch(c, self.args.batch_concurrency, run_id))
+            for c in chunks
+        ))
+
+    async def run_pipelined(self, records: list[tuple], run_id: str) -> None:
+        await asyncio.gather(*(
+            self.scheduler.run("process_scan", lambda r=r: pipeline.process_batch([r], concurrency=1, run_id=run_id))
+            for r in records
+        ))
+
+    async def run_mapped(self, records: list[tuple], run_id: str) -> None:
+        agents = agents_module.create_scan_agents()
+
+        async def agent_task(stage: str, run) -> dict:
+            # on_execute_callback and on_success_callback each write the progress
+            await asyncio.sleep(self.supabase.latency)
+            start = time.monotonic()
+            output = await run()
+            self.stage_durations.setdefault(stage, []).append(time.monotonic() - start)
+            await asyncio.sleep(self.supabase.latency)
+            return output
+
+        async def agent_output(agent, prompt) -> dict:
+            return (await agent.run(prompt)).output.model_dump()
+
+        def expand(task_id: str, work, *inputs) -> asyncio.Future:
+            # A mapped task expands once all instances of its upstream tasks have finished
+            return asyncio.gather(*(self.scheduler.run(task_id, lambda args=args: work(*args)) for args in zip(*inputs)))
+
+        inventories = await expand("analyze_image", lambda record: agent_task("analyze_image", lambda: pipeline.detect_toys(
+            agents.vision, self.image_bytes, "image/jpeg"
+        )), records)
+        quests = asyncio.ensure_future(expand("generate_play_quest", lambda inventory, record: agent_task(
+            "generate_play_quest", lambda: agent_output(agents.play_quest, inventory_prompt(inventory, record[2]))
+        ), inventories, records))
+        analyses = await expand("analyze_playroom", lambda inventory, record: agent_task(
+            "analyze_playroom", lambda: agent_output(agents.analysis, inventory_prompt(inventory, record[2]))
+        ), inventories, records)
+        recommendations = await expand("safety_check", lambda analysis, record: agent_task(
+            "safety_check", lambda: agent_output(agents.safety, roadmap_prompt(analysis, record[2]))
+        ), analyses, records)
+
+        async def print_result(*outputs):
+            pass
+
+        printed = expand("print_result", print_result, inventories, analyses, recommendations)
+        quests = await quests
+
+        async def save_result(inventory, quest, analysis, recommendation, record):
+            await self.supabase.table("scans").update({
+                "status": "done", "results_json": build_results(inventory, quest, analysis, recommendation)
+            }).eq("id", record[0]).eq("dag_run_id", run_id).execute()
+            self.scan_latencies.append(time.monotonic() - self.start)
+
+        await asyncio.gather(printed, expand("save_result", save_result, inventories, quests, analyses, recommendations, records))
+
+    async def run(self) -> float:
+        self.install()
+        self.create_scans()
+        runs = asyncio.Semaphore(self.args.max_active_runs)
+        per_run = math.ceil(self.args.scans / self.args.runs)
+
+        async def dag_run(run_id: str):
+            async with runs:
+                await self.run_dag(per_run, run_id)
+
+        self.start = time.monotonic()
+        await asyncio.gather(*(dag_run(f"run-{i}") for i in range(self.args.runs)))
+        return time.monotonic() - self.start
+
+    def report(self, wall: float) -> None:
+        args, scheduler, scale = self.args, self.scheduler, self.scale
+        done = sum(1 for row in self.supabase.tables["scans"] if row["status"] == "done")
+        ti_time = scheduler.overhead_seconds + scheduler.work_seconds
+
+        print(f"mode {args.mode}: {args.scans} scans, {args.runs} run(s) (max {args.max_active_runs} active), "
+              f"{args.ti_overhead:.1f} s overhead per task instance, {args.worker_slots} worker slots")
+        print(f"wall time:       {wall / scale:.1f} s for {done} done scans")
+        print(f"throughput:      {done / (wall / scale) * 60:.1f} scans/minute")
+        print(f"task instances:  {scheduler.task_instances}, {scheduler.overhead_seconds / scale:.0f} s of scheduling overhead "
+              f"({scheduler.overhead_seconds / ti_time * 100:.0f} % of task instance time)")
+        print(f"scan latency:    p50 {percentile(self.scan_latencies, 0.5) / scale:.1f} s, "
+              f"p95 {percentile(self.scan_latencies, 0.95) / scale:.1f} s (trigger to saved)")
+        print(f"db requests:     {self.supabase.requests}")
+        limiters = scheduler.limiters
+        print(f"model calls:     {self.settings.calls}, {self.settings.rejected} rejected with 429, "
+              f"{scheduler.retried} task instance retries")
+        if any(limiter.calls for limiter in limiters):
+            print(f"agent limit:     {min(limiter.lowest_limit for limiter in limiters)}-{max(limiter.highest_limit for limiter in limiters)}"
+                  f" per task instance, peak {max(limiter.peak_in_flight for limiter in limiters)} in flight")
+        print(f"{'stage':<22} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7}")
+        for stage, samples in self.stage_durations.items():
+            print(f"{stage:<22} {statistics.median(samples) / scale:>7.1f} {percentile(samples, 0.95) / scale:>7.1f} {percentile(samples, 0.99) / scale:>7.1f}")
+        print(f"{'task instance':<22} {'p50 s':>7} {'p95 s':>7} {'count':>7}")
+        for task_id, samples in scheduler.task_durations.items():
+            samples = [s + scheduler.ti_overhead for s in samples]
+            print(f"{task_id:<22} {statistics.median(samples) / scale:>7.1f} {percentile(samples, 0.95) / scale:>7.1f} {len(samples):>7}")
+        served = get_tier_stats().served
+        if served:
+            total = sum(len(samples) for samples in served.values())
+            escalated = sum(len(samples) for (_, escalation), samples in served.items() if escalation)
+            print(f"analysis tiers:  {escalated / total * 100:.0f} % of {total} analyses escalated to Pro")
+            print(f"{'tier (escalation)':<22} {'p50 s':>7} {'p95 s':>7} {'count':>7}")
+            for (tier, escalation), samples in sorted(served.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+                print(f"{tier + (f' ({escalation})' if escalation else ''):<22} {statistics.median(samples) / scale:>7.1f} "
+                      f"{percentile(samples, 0.95) / scale:>7.1f} {len(samples):>7}")
+
+
+def key_values(value: str, cast=float) -> dict:
+    return {key: cast(v) for key, v in (item.split("=") for item in value.split(",") if item)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=MODES + ("all",), default="all")
+    parser.add_argument("--scans", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=1, help="Dag runs sharing the scans")
+    parser.add_argument("--max-active-runs", type=int, default=2)
+    parser.add_argument("--max-active-tis", type=lambda v: key_values(v, int), default={}, help="e.g. analyze_image=4,save_result=8")
+    parser.add_argument("--worker-slots", type=int, default=16, help="Concurrent task instances of all workers")
+    parser.add_argument("--ti-overhead", type=float, default=2.0, help="Seconds of scheduling, queueing and startup per task instance")
+    parser.add_argument("--latency", type=key_values, default=DEFAULT_LATENCY, help="Model seconds per stage, e.g. analyze_image=15")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relative deviation of the model latency")
+    parser.add_argument("--db-latency", type=float, default=0.05, help="Seconds per database request")
+    parser.add_argument("--toys", type=int, default=30, help="Toys per synthetic inventory")
+    parser.add_argument("--toys-max", type=int, default=None, help="Vary the toys per inventory between --toys and this")
+    parser.add_argument("--distinct-inventories", type=int, default=None, help="Share inventories between scans")
+    parser.add_argument("--image-edge", type=int, default=2048)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--batch-concurrency", type=int, default=10)
+    parser.add_argument("--quota", type=int, default=None, help="Concurrent model calls before the model answers 429")
+    parser.add_argument("--static-limit", type=int, default=None, help="Fixed instead of adaptive agent concurrency limit")
+    parser.add_argument("--analysis-tiering", action="store_true", help="Run the analysis on the fast model first")
+    parser.add_argument("--tier-max-toys", type=int, default=25, help="ANALYSIS_TIER_MAX_TOYS")
+    parser.add_argument("--fast-invalid-rate", type=float, default=0.1, help="Share of invalid answers of the fast analysis model")
+    parser.add_argument("--scale", type=float, default=0.02, help="Real seconds per simulated second")
+    args = parser.parse_args()
+    args.latency = {**DEFAULT_LATENCY, **args.latency}
+    logging.basicConfig(level=logging.WARNING)
+
+    for mode in MODES if args.mode == "all" else (args.mode,):
+        args.mode = mode
+        benchmark = Benchmark(args)
+        benchmark.report(asyncio.run(benchmark.run()))
+        print()
+
+
+if __name__ == "__main__":
+    main()
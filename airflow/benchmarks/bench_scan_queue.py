@@ -0,0 +1,207 @@
+"""
+Queue simulator for `get_new_scans`: how long scans wait under bursty uploads, per claim policy.
+
+A discrete-event simulation in simulated seconds, nothing is slept. Light clients upload single
+scans at random (Poisson) times, a heavy client uploads bursts of many scans at once. The backend
+triggers runs like its `TriggerCoalescer`, runs start within `max_active_runs`, and in batched
+mode the claimed scans are processed in chunks by `process_scan_batch` task instances that all
+runs share via `max_active_tis_per_dag`.
+
+Policies:
+- `all`: the former claim of every open scan by one run
+- `oldest`: bounded batches, oldest first, a run that leaves a backlog triggers the next one
+- `fair`: like `oldest`, in rounds of `--per-client` scans per client (`include/scan_queue.py`)
+
+    python -m benchmarks.bench_scan_queue
+    python -m benchmarks.bench_scan_queue --rate 6 --burst-size 200 --claim-batch-size 30
+"""
+import argparse
+import heapq
+import itertools
+import math
+import random
+from collections import deque
+
+from include.scan_queue import SCAN_CLAIM_BATCH_SIZE, SCAN_CLAIM_PER_CLIENT, claim_order
+
+POLICIES = ("all", "oldest", "fair")
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))] if ordered else float("nan")
+
+
+def arrivals(args) -> list[dict]:
+    rng = random.Random(args.seed)
+    scans = []
+    t = rng.expovariate(args.rate / 60)
+    while t < args.duration:
+        scans.append({"client_id": f"client-{rng.randrange(args.clients)}", "created_at": t})
+        t += rng.expovariate(args.rate / 60)
+    for burst in range(args.bursts):
+        start = args.burst_at + burst * args.burst_every
+        # An upload script, a few scans per second
+        scans.extend({"client_id": "heavy", "created_at": start + i * 0.3} for i in range(args.burst_size))
+    scans.sort(key=lambda scan: scan["created_at"])
+    for i, scan in enumerate(scans):
+        scan.update(id=f"scan-{i:05d}", priority=0, claimed_at=None, started_at=None, done_at=None)
+    return scans
+
+
+class QueueSimulation:
+
+    def __init__(self, args, policy: str):
+        self.args = args
+        self.policy = policy
+        self.scans = arrivals(args)
+        self.open: list[dict] = []
+        self.events: list = []
+        self.sequence = itertools.count()
+        self.now = 0.0
+
+        self.window_start = -math.inf
+        self.flush_scheduled = False
+        self.queued_runs: deque[int] = deque()
+        self.active_runs = 0
+        self.runs = 0
+        self.chunks: deque[tuple[int, list[dict]]] = deque()
+        self.free_tis = args.max_active_tis
+        self.run_chunks: dict[int, int] = {}
+        self.peak_backlog = 0
+
+    def at(self, time: float, handler, *payload) -> None:
+        heapq.heappush(self.events, (time, next(self.sequence), handler, payload))
+
+    def run(self) -> None:
+        for scan in self.scans:
+            self.at(scan["created_at"], self.upload, scan)
+        while self.events:
+            self.now, _, handler, payload = heapq.heappop(self.events)
+            handler(*payload)
+
+    # Backend: TriggerCoalescer
+    def upload(self, scan: dict) -> None:
+        self.open.append(scan)
+        self.peak_backlog = max(self.peak_backlog, len(self.open))
+        if self.queued_runs:
+            return
+        if self.now < self.window_start + self.args.coalesce_window:
+            if not self.flush_scheduled:
+                self.flush_scheduled = True
+                self.at(self.window_start + self.args.coalesce_window, self.flush)
+            return
+        self.window_start = self.now
+        self.trigger()
+
+    def flush(self) -> None:
+        self.flush_scheduled = False
+        self.window_start = self.now
+        if not self.queued_runs:
+            self.trigger()
+
+    # Airflow: runs within max_active_runs, task instances within max_active_tis_per_dag
+    def trigger(self) -> None:
+        self.runs += 1
+        self.queued_runs.append(self.runs)
+        self.start_runs()
+
+    def start_runs(self) -> None:
+        while self.queued_runs and self.active_runs < self.args.max_active_runs:
+            self.active_runs += 1
+            self.at(self.now + self.args.ti_overhead, self.claim, self.queued_runs.popleft())
+
+    def claim(self, run_id: int) -> None:
+        if self.policy == "all":
+            claimed = sorted(self.open, key=lambda scan: scan["created_at"])
+        else:
+            per_client = self.args.per_client if self.policy == "fair" else len(self.scans)
+            claimed = claim_order(self.open, self.args.claim_batch_size, per_client)
+        claimed_ids = {scan["id"] for scan in claimed}
+        self.open = [scan for scan in self.open if scan["id"] not in claimed_ids]
+        for scan in claimed:
+            scan["claimed_at"] = self.now
+
+        # has_backlog and trigger_next_run run next to the processing tasks
+        if self.policy != "all" and self.open:
+            self.at(self.now + self.args.ti_overhead, self.trigger)
+
+        size = self.args.chunk_size
+        chunks = [claimed[i:i + size] for i in range(0, len(claimed), size)]
+        if not chunks:
+            self.finish_run()
+            return
+        self.run_chunks[run_id] = len(chunks)
+        self.chunks.extend((run_id, chunk) for chunk in chunks)
+        self.start_chunks()
+
+    def start_chunks(self) -> None:
+        while self.chunks and self.free_tis > 0:
+            self.free_tis -= 1
+            run_id, chunk = self.chunks.popleft()
+            start = self.now + self.args.ti_overhead
+            for scan in chunk:
+                scan["started_at"] = start
+            self.at(start + self.args.scan_seconds, self.finish_chunk, run_id, chunk)
+
+    def finish_chunk(self, run_id: int, chunk: list[dict]) -> None:
+        for scan in chunk:
+            scan["done_at"] = self.now
+        self.free_tis += 1
+        self.run_chunks[run_id] -= 1
+        if self.run_chunks[run_id] == 0:
+            self.finish_run()
+        self.start_chunks()
+
+    def finish_run(self) -> None:
+        self.active_runs -= 1
+        self.start_runs()
+
+    def report(self) -> list[tuple]:
+        rows = []
+        for group, scans in (("light", [s for s in self.scans if s["client_id"] != "heavy"]),
+                             ("heavy", [s for s in self.scans if s["client_id"] == "heavy"])):
+            waits = [scan["started_at"] - scan["created_at"] for scan in scans]
+            latencies = [scan["done_at"] - scan["created_at"] for scan in scans]
+            rows.append((self.policy, group, len(scans), percentile(waits, 0.5), percentile(waits, 0.95), percentile(waits, 0.99),
+                         percentile(latencies, 0.5), percentile(latencies, 0.95)))
+        return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--policy", choices=POLICIES + ("all-policies",), default="all-policies")
+    parser.add_argument("--duration", type=float, default=1800, help="Seconds of uploads")
+    parser.add_argument("--rate", type=float, default=4, help="Scans per minute of the light clients")
+    parser.add_argument("--clients", type=int, default=200, help="Light clients")
+    parser.add_argument("--bursts", type=int, default=2, help="Bursts of the heavy client")
+    parser.add_argument("--burst-size", type=int, default=100)
+    parser.add_argument("--burst-at", type=float, default=300, help="Second of the first burst")
+    parser.add_argument("--burst-every", type=float, default=900)
+    parser.add_argument("--claim-batch-size", type=int, default=SCAN_CLAIM_BATCH_SIZE)
+    parser.add_argument("--per-client", type=int, default=SCAN_CLAIM_PER_CLIENT)
+    parser.add_argument("--chunk-size", type=int, default=10, help="SCAN_BATCH_SIZE")
+    parser.add_argument("--max-active-runs", type=int, default=2)
+    parser.add_argument("--max-active-tis", type=int, default=2, help="max_active_tis_per_dag of process_scan_batch")
+    parser.add_argument("--ti-overhead", type=float, default=2.0, help="Seconds of scheduling and startup per task instance")
+    parser.add_argument("--scan-seconds", type=float, default=65, help="Seconds a chunk of concurrent scans takes")
+    parser.add_argument("--coalesce-window", type=float, default=5, help="TRIGGER_COALESCE_SECONDS of the backend")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.duration:.0f} s of uploads: {args.rate:g} scans/minute from {args.clients} light clients, "
+          f"{args.bursts} bursts of {args.burst_size} scans from one heavy client")
+    print(f"claim batch {args.claim_batch_size}, {args.per_client} per client and round, chunks of {args.chunk_size}, "
+          f"{args.max_active_runs} active runs, {args.max_active_tis} batch task instances")
+    print(f"{'policy':<8} {'clients':<8} {'scans':>6} {'wait p50':>9} {'p95':>7} {'p99':>7} {'done p50':>9} {'p95':>7} {'runs':>5} {'backlog':>8}")
+    for policy in POLICIES if args.policy == "all-policies" else (args.policy,):
+        simulation = QueueSimulation(args, policy)
+        simulation.run()
+        for policy_name, group, count, *times in simulation.report():
+            wait50, wait95, wait99, done50, done95 = times
+            print(f"{policy_name:<8} {group:<8} {count:>6} {wait50:>8.0f}s {wait95:>6.0f}s {wait99:>6.0f}s {done50:>8.0f}s {done95:>6.0f}s "
+                  f"{simulation.runs:>5} {simulation.peak_backlog:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Metadata database bytes per scan in `mapped` mode: the inventory passed through XCom (before, and
+without `RESULT_STORE_URL`) versus a reference into the result store (`include/result_store.py`).
+
+Airflow stores the return value of every task instance as XCom, and the rendered templated
+fields of every task instance in `rendered_task_instance_fields`. For `@task`, that's the
+`op_kwargs`, so each zipped input holding the inventory copies it once more per consumer, cut
+at `max_templated_field_length` characters. Outputs are synthetic, like in `bench_process_scans`.
+The prompts of the agents hold the inventory either way and are not counted.
+
+    python -m benchmarks.bench_xcom_bytes
+    python -m benchmarks.bench_xcom_bytes --toys 10 50 200 --max-templated-field-length 4096
+"""
+import argparse
+import json
+import random
+import uuid
+
+from benchmarks.fakes import synthetic_output
+from include.models import AnalysisResult, PlayQuest, ToyInventory, ToyRecommendation
+
+MODES = ("xcom", "reference")
+
+
+def _size(value) -> int:
+    return len(json.dumps(value)) if value is not None else 0
+
+
+def task_values(toys: int, mode: str, seed: int = 42) -> dict[str, tuple[dict, object]]:
+    """Rendered `op_kwargs` and return value of every mapped task instance of one scan."""
+    rng = random.Random(seed)
+    scan_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    scan_record = [scan_id, f"scans/{scan_id}.jpg", 4]
+    inventory = synthetic_output(ToyInventory, rng, toys)
+    analysis = synthetic_output(AnalysisResult, rng, toys)
+    recommendation = synthetic_output(ToyRecommendation, rng, toys)
+    quest = synthetic_output(PlayQuest, rng, toys)
+    run_id = "scheduled__2026-10-17T08:00:00+00:00"
+    inventory_value = inventory if mode == "xcom" else f"{run_id}/{scan_id}.analyze_image"
+
+    values = {
+        "analyze_image": ({"scan_record": scan_record}, inventory_value),
+        "generate_play_quest": ({"zipped_input": [inventory_value, scan_record]}, quest),
+        "analyze_playroom": ({"zipped_input": [inventory_value, scan_record]}, analysis),
+        "safety_check": ({"zipped_input": [analysis, scan_record]}, recommendation),
+        "print_result": ({"zipped_input": [inventory_value, analysis, recommendation]}, None),
+        "save_result": ({"zipped_input": [inventory_value, quest, analysis, recommendation, scan_record]}, None),
+    }
+    if mode == "reference":
+        # One task for all scans of the run, its share per scan is one reference in the list
+        values["delete_stored_results"] = ({"inventory_refs": [inventory_value]}, None)
+    return values
+
+
+def measure(toys: int, mode: str, max_field_length: int) -> tuple[int, int]:
+    """XCom and rendered field bytes of one scan."""
+    xcom = rendered = 0
+    for op_kwargs, output in task_values(toys, mode).values():
+        xcom += _size(output)
+        rendered += sum(min(_size(value), max_field_length) for value in op_kwargs.values())
+    return xcom, rendered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--toys", type=int, nargs="+", default=[10, 50, 200], help="Toys per inventory")
+    parser.add_argument("--max-templated-field-length", type=int, default=4096, help="[core] max_templated_field_length")
+    args = parser.parse_args()
+
+    print(f"{'toys':>5} {'mode':<10} {'xcom':>8} {'rendered':>9} {'total':>8} {'saved':>6}")
+    for toys in args.toys:
+        totals = {}
+        for mode in MODES:
+            xcom, rendered = measure(toys, mode, args.max_templated_field_length)
+            totals[mode] = xcom + rendered
+            saved = f"{1 - totals[mode] / totals['xcom']:.0%}"
+            print(f"{toys:>5} {mode:<10} {xcom:>8,} {rendered:>9,} {totals[mode]:>8,} {saved:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+Local stand-ins for the model provider and Supabase, so the agent chain runs without a network.
+
+`FakeHook` replaces `PydanticAIHook`: its agents are real pydantic-ai agents with the real
+instructions, output types and tools, backed by a deterministic `FunctionModel` that sleeps for
+a configured latency and answers with a synthetic output of a configured size. The analysis agent
+on the fast model of `ANALYSIS_TIERING` is the stage `analyze_playroom_fast`, with its own
+latency and a share of invalid answers.
+"""
+import asyncio
+import hashlib
+import random
+from types import SimpleNamespace
+
+from pydantic_ai import Agent
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from include.agents import ANALYSIS_FAST_MODEL_ID
+from include.models import AnalysisResult, PlayQuest, ToyInventory, ToyRecommendation
+
+# Stage of each output type, the latency and size settings are given per stage
+STAGES = {
+    ToyInventory: "analyze_image",
+    AnalysisResult: "analyze_playroom",
+    ToyRecommendation: "safety_check",
+    PlayQuest: "generate_play_quest",
+}
+
+CATEGORIES = ["Vehicle", "Construction", "Doll", "Puzzle", "Art", "Active", "Plush", "Book", "Musical"]
+PLAY_MODES = ["Passive", "Constructive", "Pretend Play", "Gross Motor", "Fine Motor"]
+TIMEFRAMES = ["now", "3_months", "6_months"]
+
+
+def _prompt_seed(messages) -> int:
+    # Same prompt, same output: reruns of a benchmark are comparable
+    return int(hashlib.sha256(repr(messages[-1].parts).encode()).hexdigest()[:8], 16)
+
+
+def synthetic_output(output_type: type, rng: random.Random, toys: int, distinct_inventories: int | None = None) -> dict:
+    if output_type is ToyInventory:
+        # With few distinct inventories, many scans share one, like real playrooms often do
+        inventory_rng = random.Random(rng.randrange(distinct_inventories)) if distinct_inventories else rng
+        return {"items": [
+            {
+                "category": inventory_rng.choice(CATEGORIES),
+                "item_name": f"{inventory_rng.choice(['Red', 'Wooden', 'Soft', 'Magnetic'])} toy {i}",
+                "play_mode": inventory_rng.choice(PLAY_MODES),
+                "count": inventory_rng.choice([1, 1, 1, 3]),
+                "bbox": {"x": round(inventory_rng.random() * 0.9, 3), "y": round(inventory_rng.random() * 0.9, 3), "w": 0.05, "h": 0.05},
+            }
+            for i in range(toys)
+        ]}
+    if output_type is AnalysisResult:
+        return {
+            "status_quo": "Mostly constructive play. " * 10,
+            "skill_scores": {k: rng.randrange(101) for k in ("cognitive", "motor_fine", "motor_gross", "social_emotional", "creative", "language")},
+            "roadmap": [
+                {
+                    "timeframe": timeframe, "priority": priority, "missing_skill": "Oral Expression", "skill_id": "1.A.1.a.3",
+                    "skill_category": "language", "recommended_toy": f"Story cubes {rng.randrange(100)}",
+                    "reasoning": "Storytelling builds vocabulary. " * 20,
+                }
+                for priority, timeframe in enumerate(TIMEFRAMES, start=1)
+            ],
+        }
+    if output_type is ToyRecommendation:
+        return {"items": [
+            {"timeframe": timeframe, "decision": "APPROVED", "recommended_toy": "Story cubes",
+             "safety_context": "No small parts. " * 5, "amazon_search": "story cubes kids"}
+            for timeframe in TIMEFRAMES
+        ]}
+    if output_type is PlayQuest:
+        return {
+            "title": "The Tower Challenge", "target_skill": "Visualization", "skill_id": "1.A.1.f.2", "duration_minutes": 20,
+            "toys_needed": ["Blocks", "Car"], "setup": "Clear the floor. " * 5, "instructions": ["Build a tower."] * 4,
+            "parent_tip": "Ask what happens next.",
+        }
+    raise ValueError(f"No synthetic output for {output_type}")
+
+
+class FakeModelSettings(SimpleNamespace):
+    """
+    Latency in seconds and jitter per stage, inventory size and number of distinct inventories.
+
+    With `toys_max`, each inventory gets between `toys` and `toys_max` toys. With a
+    `fast_invalid_rate`, that share of the answers of the fast analysis model has a roadmap of
+    2 items instead of 3. Both are drawn from one seeded generator, as every scan shares the image.
+
+    With a `quota`, calls beyond that many concurrent ones are rejected with a 429, like a
+    provider's rate limit shared by all workers. `calls`, `in_flight` and `rejected` are counted across
+    all fake models of the settings.
+    """
+
+    def __init__(self, quota: int | None = None, toys_max: int | None = None, fast_invalid_rate: float = 0.0, seed: int = 42,
+                 **settings):
+        super().__init__(quota=quota, toys_max=toys_max, fast_invalid_rate=fast_invalid_rate, rng=random.Random(seed),
+                         calls=0, in_flight=0, rejected=0, **settings)
+
+
+def fake_model(output_type: type, settings: FakeModelSettings, model_id: str | None = None) -> FunctionModel:
+    stage = STAGES[output_type]
+    if output_type is AnalysisResult and model_id == ANALYSIS_FAST_MODEL_ID:
+        stage = "analyze_playroom_fast"
+
+    async def respond(messages, info: AgentInfo) -> ModelResponse:
+        rng = random.Random(_prompt_seed(messages))
+        latency = settings.latency[stage]
+        settings.calls += 1
+        settings.in_flight += 1
+        try:
+            if settings.quota is not None and settings.in_flight > settings.quota:
+                settings.rejected += 1
+                raise ModelHTTPError(429, f"fake-{stage}", {"error": {"status": "RESOURCE_EXHAUSTED"}})
+            await asyncio.sleep(latency * (1 + settings.jitter * (rng.random() * 2 - 1)))
+        finally:
+            settings.in_flight -= 1
+        toys = settings.rng.randint(settings.toys, settings.toys_max) if settings.toys_max else settings.toys
+        output = synthetic_output(output_type, rng, toys, settings.distinct_inventories)
+        if stage == "analyze_playroom_fast" and settings.rng.random() < settings.fast_invalid_rate:
+            output["roadmap"].pop()
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, output)])
+
+    return FunctionModel(respond, model_name=f"fake-{stage}")
+
+
+def fake_hook_class(settings: FakeModelSettings) -> type:
+    class FakeHook:
+        """Drop-in for `PydanticAIHook`, ignores the connection and all model ids but the fast analysis model."""
+
+        def __init__(self, llm_conn_id: str, model_id: str | None = None):
+            self.model_id = model_id
+
+        def create_agent(self, output_type: type, instructions: str, **agent_params) -> Agent:
+            return Agent(fake_model(output_type, settings, self.model_id), output_type=output_type, instructions=instructions, **agent_params)
+
+    return FakeHook
+
+
+class FakeQuery:
+
+    def __init__(self, client: "FakeSupabase", table: str):
+        self.client, self.table = client, table
+        self.action, self.payload, self.filters = "select", None, []
+
+    def select(self, *columns) -> "FakeQuery":
+        return self
+
+    def update(self, payload: dict) -> "FakeQuery":
+        self.action, self.payload = "update", payload
+        return self
+
+    def upsert(self, payload: dict, on_conflict: str = "id") -> "FakeQuery":
+        self.action, self.payload = "upsert", payload
+        keys = on_conflict.split(",")
+        self.filters.append(lambda row: all(row.get(key) == payload.get(key) for key in keys))
+        return self
+
+    def delete(self) -> "FakeQuery":
+        self.action = "delete"
+        return self
+
+    def eq(self, column: str, value) -> "FakeQuery":
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column: str, values: list) -> "FakeQuery":
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def gt(self, column: str, value) -> "FakeQuery":
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def lt(self, column: str, value) -> "FakeQuery":
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) < value)
+        return self
+
+    async def execute(self) -> SimpleNamespace:
+        await asyncio.sleep(self.client.latency)
+        self.client.requests += 1
+        rows = self.client.tables.setdefault(self.table, [])
+        matched = [row for row in rows if all(f(row) for f in self.filters)]
+        if self.action == "update":
+            for row in matched:
+                row.update(self.payload)
+        elif self.action == "upsert":
+            if matched:
+                matched[0].update(self.payload)
+            else:
+                rows.append(dict(self.payload))
+        elif self.action == "delete":
+            self.client.tables[self.table] = [row for row in rows if row not in matched]
+        return SimpleNamespace(data=[dict(row) for row in matched])
+
+
+class FakeSupabase:
+    """In-memory stand-in for the async Supabase client, with a simulated round trip per request."""
+
+    def __init__(self, latency: float = 0.0):
+        self.tables: dict[str, list[dict]] = {}
+        self.latency = latency
+        self.requests = 0
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def claim(self, count: int, run_id: str) -> list[tuple]:
+        """Stand-in for the get_new_scans claim query: marks open scans in_flight and returns their records."""
+        claimed = [row for row in self.tables.get("scans", []) if row["status"] == "processing"][:count]
+        for row in claimed:
+            row.update(status="in_flight", dag_run_id=run_id)
+        return [(row["id"], row["image_path"], row["child_age"]) for row in claimed]
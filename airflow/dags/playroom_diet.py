@@ -1,92 +1,57 @@
+import asyncio
 import json
 import os
+import time
+from datetime import datetime, timezone
 from airflow.configuration import AIRFLOW_HOME
-from airflow.providers.common.sql.operators.sql import SQLExecuteQueryOperator
+from airflow.providers.standard.operators.trigger_dagrun import TriggerDagRunOperator
 from airflow.sdk import dag, task
-from airflow.providers.common.ai.hooks.pydantic_ai import PydanticAIHook
-from pydantic import BaseModel
-import httpx
 from supabase import create_client
-from pydantic_ai import BinaryContent
-from pydantic_ai.models.google import GoogleModelSettings
-from pydantic_ai.common_tools.duckduckgo import duckduckgo_search_tool
 from pendulum import duration
 
-from include.onet import get_careers_for_skill
-
-_POSTGRES_CONN_ID = "postgres_playroom_diet"
+from include.agents import (
+    ANALYSIS_AGENT_PARAMS,
+    ANALYSIS_INSTRUCTIONS,
+    ANALYSIS_MODEL_ID,
+    LLM_CONN_ID,
+    PLAY_QUEST_AGENT_PARAMS,
+    PLAY_QUEST_INSTRUCTIONS,
+    SAFETY_AGENT_PARAMS,
+    SAFETY_INSTRUCTIONS,
+    create_vision_agent,
+)
+from include.models import AnalysisResult, PlayQuest, ToyRecommendation
+from include.pipeline import (
+    detect_toys,
+    get_image_bytes,
+    image_media_type,
+    inventory_prompt,
+    process_batch,
+    roadmap_prompt,
+)
+from include.metrics import new_stage_metrics
+from include.result_store import get_result_store, load_output, store_output
+from include.results import build_results
+from include.scans import (
+    claim_scans,
+    on_agent_success,
+    on_scan_failure,
+    on_stage_start,
+    on_stage_success,
+    record_metrics,
+    should_trigger_process_scans,
+)
 
+# "mapped" runs every agent as its own mapped task per scan, "pipelined" runs the whole agent chain
+# of a scan inside one mapped task, "batched" does the same for chunks of scans
+PROCESS_SCANS_MODE = os.getenv("PROCESS_SCANS_MODE", "mapped")
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "10"))
+SCAN_BATCH_CONCURRENCY = int(os.getenv("SCAN_BATCH_CONCURRENCY", "10"))
 
 supabase_project_url = os.getenv("SUPABASE_PROJECT_URL")
 supabase_secret_key = os.getenv("SUPABASE_SECRET_KEY")
 
 
-class BoundingBox(BaseModel):
-    x: float  # 0-1 normalized, left edge
-    y: float  # 0-1 normalized, top edge
-    w: float  # 0-1 normalized, width
-    h: float  # 0-1 normalized, height
-
-class Toy(BaseModel):
-    category: str
-    item_name: str
-    play_mode: str
-    count: int = 1  # 1 for individuals; >1 only for tight clusters of similar items under one bbox
-    bbox: BoundingBox  # Normalized 0-1 coordinates; hugs the toy, or the whole cluster for cluster entries
-
-class ToyInventory(BaseModel):
-    items: list[Toy]
-
-class SkillScores(BaseModel):
-    cognitive: int  # 0-100: problem solving, reasoning, memory
-    motor_fine: int  # 0-100: finger dexterity, precision
-    motor_gross: int  # 0-100: coordination, balance, strength
-    social_emotional: int  # 0-100: empathy, cooperation, expression
-    creative: int  # 0-100: imagination, artistic, open-ended play
-    language: int  # 0-100: communication, vocabulary, storytelling
-
-class RoadmapItem(BaseModel):
-    timeframe: str  # "now", "3_months", "6_months"
-    priority: int  # 1, 2, or 3
-    missing_skill: str  # O*NET ability name
-    skill_id: str  # O*NET ID like "1.A.1.f.2"
-    skill_category: str  # One of: cognitive, motor_fine, motor_gross, social_emotional, creative, language
-    recommended_toy: str
-    reasoning: str
-
-class AnalysisResult(BaseModel):
-    status_quo: str
-    skill_scores: SkillScores
-    roadmap: list[RoadmapItem]  # Exactly 3 items
-
-class ToyRecommendationItem(BaseModel):
-    timeframe: str
-    decision: str  # "APPROVED" or "SUBSTITUTED"
-    recommended_toy: str
-    safety_context: str
-    amazon_search: str
-
-class ToyRecommendation(BaseModel):
-    items: list[ToyRecommendationItem]
-
-class PlayQuest(BaseModel):
-    title: str
-    target_skill: str
-    skill_id: str
-    duration_minutes: int
-    toys_needed: list[str]
-    setup: str
-    instructions: list[str]
-    parent_tip: str
-
-def get_image_bytes(image_path: str) -> bytes:
-    image_url = f"{supabase_project_url}/storage/v1/object/public/playroom-images/{image_path}"
-    with httpx.Client() as client:
-        response = client.get(image_url)
-        response.raise_for_status()
-        return response.content
-
-
 @dag(
     max_active_runs=2,  # Parallel runs are fine, race conditions handled on DB level
     default_args={
@@ -98,230 +63,131 @@ def process_scans():
 
     # Atomically claim scans by setting status to 'in_flight'
     # Uses FOR UPDATE SKIP LOCKED to prevent race conditions between parallel Dag runs
-    # Each run claims all open scans, allowing concurrent processing
-    _get_new_scans = SQLExecuteQueryOperator(
-        task_id="get_new_scans",
-        conn_id=_POSTGRES_CONN_ID,
-        sql="""
-            UPDATE public.scans
-            SET status = 'in_flight'
-            WHERE id IN (
-                SELECT id FROM public.scans
-                WHERE status = 'processing'
-                FOR UPDATE SKIP LOCKED
-            )
-            RETURNING id, image_path, child_age;
-        """,
-    )
+    # Each run leases a bounded, fair-share batch of open scans, see include/scan_queue.py
+    @task
+    def get_new_scans(run_id=None) -> list:
+        return claim_scans(run_id)
+
+    _get_new_scans = get_new_scans()
+
+    # Scans left behind by the bounded claim get a run of their own. With max_active_runs=2 it
+    # starts right away next to this one or waits queued, and claims the next batch when it starts.
+    # While a run is queued already, it will claim them, so no further run is triggered.
+    @task.short_circuit
+    def has_backlog(ti=None) -> bool:
+        return should_trigger_process_scans(ti)
+
+    _get_new_scans >> has_backlog() >> TriggerDagRunOperator(task_id="trigger_next_run", trigger_dag_id="process_scans")
+
+    if PROCESS_SCANS_MODE == "batched":
+        @task
+        def chunk_scans(scan_records: list) -> list[list]:
+            return [scan_records[i:i + SCAN_BATCH_SIZE] for i in range(0, len(scan_records), SCAN_BATCH_SIZE)]
+
+        # One task instance per chunk instead of one per scan and agent, the agents of a chunk run
+        # concurrently via asyncio. Progress is written per scan and stage like in the mapped mode.
+        @task(max_active_tis_per_dag=2, on_failure_callback=on_scan_failure)
+        def process_scan_batch(scan_records: list, run_id=None):
+            asyncio.run(process_batch(scan_records, SCAN_BATCH_CONCURRENCY, run_id))
+
+        process_scan_batch.expand(scan_records=chunk_scans(_get_new_scans))
+        return
+
+    if PROCESS_SCANS_MODE == "pipelined":
+        # One task instance per scan, the agents start as soon as their inputs are ready instead of
+        # waiting for the scheduler between stages. Up to 2 agents of a scan run at once.
+        @task(max_active_tis_per_dag=4, on_failure_callback=on_scan_failure)
+        def process_scan(scan_record: tuple, run_id=None):
+            asyncio.run(process_batch([scan_record], concurrency=1, run_id=run_id))
+
+        process_scan.expand(scan_record=_get_new_scans)
+        return
 
     # @task.agent requires the callable to return a non-empty string, which
     # doesn't fit a multimodal vision call. We build the agent manually via
     # PydanticAIHook so we can pass an image alongside the text prompt.
-    @task(max_active_tis_per_dag=2)
-    def analyze_image(scan_record: tuple) -> dict:
-        hook = PydanticAIHook(
-            llm_conn_id="pydanticai_default",
-            model_id="google-gla:gemini-3-flash-preview",
-        )
-        agent = hook.create_agent(
-            output_type=ToyInventory,
-            instructions="""
-                You are an expert Toy Detection AI for a child development app.
-
-                Your goal is to identify the toys visible in the playroom so a parent can see exactly what they own, item by item.
-
-                **Default mode: INDIVIDUAL detection (count = 1)**
-                - Treat each visible toy as a SEPARATE entry with its own tight bounding box and `count: 1`.
-                - Three visually distinct toy cars must produce three entries, not one. Two stuffed animals side by side stay individual.
-                - Detect at fine granularity: one stuffed animal, one specific puzzle, one specific book, one single building block when clearly separable.
-                - Err strongly on the side of MORE entries. If you can see it as a distinct object, list it individually.
-
-                **Clustering exception (use sparingly, only when clearly warranted)**
-                Use ONE entry with `count > 1` and one bbox enclosing the whole pile ONLY in these cases:
-                - A container, bin, or basket holding many (5+) visually similar items (e.g., a tub of Duplos, a bin of identical balls, a box of crayons).
-                - A dense heap or stack of 5+ near-identical items where drawing individual outlines would only add visual clutter.
-                The cluster's `item_name` should describe the group (e.g., "Duplo Block Pile", "Crayon Set", "Toy Car Bin").
-                Set `count` to your honest estimate of the number of items in the cluster.
-
-                **Never cluster these:**
-                - Visually distinct toys that just happen to sit near each other.
-                - Small groups of 2-4 similar toys. These stay individual.
-                - Anything just because the room is busy.
-
-                **For each entry:**
-                1. "category": Broad type (e.g., Vehicle, Construction, Doll, Puzzle, Art, Active, Plush, Book, Musical).
-                2. "item_name": Specific description (e.g., "Red Hot Wheels Car", "Brown Teddy Bear", "Duplo Block Pile").
-                3. "play_mode": Primary interaction (e.g., "Passive", "Constructive", "Pretend Play", "Gross Motor", "Fine Motor").
-                4. "count": 1 for individual items; honest estimate for clusters.
-                5. "bbox": Tight bounding box in NORMALIZED coordinates (0-1 range):
-                - "x": Left edge (0 = left, 1 = right)
-                - "y": Top edge (0 = top, 1 = bottom)
-                - "w": Width (0-1)
-                - "h": Height (0-1)
-                The bbox must hug the toy (or the whole cluster, for cluster entries).
-
-                You can define your own categories and play modes based on what you see.
-                If the image is not a playroom or no toys are visible, respond with an empty "items" list.
-            """,
-            model_settings=GoogleModelSettings(
-                google_video_resolution="MEDIA_RESOLUTION_HIGH",
-                google_thinking_config={"thinking_level": "high"}
-            ),
-        )
+    @task(
+        max_active_tis_per_dag=2,
+        on_execute_callback=on_stage_start,
+        on_success_callback=on_stage_success,
+        on_failure_callback=on_scan_failure
+    )
+    def analyze_image(scan_record: tuple, run_id=None) -> dict | str:
+        agent = create_vision_agent()
 
         image_path = scan_record[1]
         image_bytes = get_image_bytes(image_path)
 
-        result = agent.run_sync([
-            "Analyze the playroom image provided, which contains a collection of children's toys.",
-            BinaryContent(data=image_bytes, media_type='image/jpeg'),
-        ])
-        return result.output.model_dump()
+        # Whole image in one call, or tiles of large images with VISION_TILE_GRID > 1
+        metrics = new_stage_metrics()
+        start = time.monotonic()
+        toy_inventory = asyncio.run(detect_toys(agent, image_bytes, image_media_type(image_path), metrics))
+        metrics["seconds"] = time.monotonic() - start
+        try:
+            record_metrics(str(scan_record[0]), run_id, "analyze_image", metrics)
+        except Exception as e:
+            print(f"Failed to record metrics: {e}")
+        # With a result store, downstream tasks get a reference and the inventory with all its boxes stays out of XCom
+        return store_output(run_id, str(scan_record[0]), "analyze_image", toy_inventory)
 
-    toy_inventories = analyze_image.expand(scan_record=_get_new_scans.output)
+    inventory_refs = analyze_image.expand(scan_record=_get_new_scans)
 
     @task.agent(
-        llm_conn_id="pydanticai_default",
+        llm_conn_id=LLM_CONN_ID,
         output_type=PlayQuest,
-        system_prompt="""
-            You are a creative Play Coach who designs fun, engaging activities for children using their existing toys.
-
-            **Your task:**
-            Create ONE "Play Quest" - a structured play activity that:
-            1. Uses 2-4 toys from the provided inventory (no new purchases needed)
-            2. Targets a specific O*NET cognitive or physical ability
-            3. Is age-appropriate, fun, and takes 10-30 minutes
-            4. Includes clear instructions parents can follow
-
-            **Output format:**
-            - title: A fun, adventure-style name (e.g., "The Tower Challenge", "Treasure Hunt Adventure")
-            - target_skill: The O*NET ability name being developed
-            - skill_id: The O*NET ID (e.g., "1.A.1.f.2")
-            - duration_minutes: Estimated time (10-30)
-            - toys_needed: List of 2-4 toys from the inventory to use
-            - setup: One paragraph on how to prepare the activity
-            - instructions: 3-5 clear steps for the activity
-            - parent_tip: One sentence on how to make it more engaging or educational
-        """,
-        agent_params={
-            "model_settings": GoogleModelSettings(
-                google_thinking_config={"thinking_level": "medium"}
-            )
-        },
-        max_active_tis_per_dag=2
+        system_prompt=PLAY_QUEST_INSTRUCTIONS,
+        agent_params=PLAY_QUEST_AGENT_PARAMS,
+        max_active_tis_per_dag=2,
+        on_execute_callback=on_stage_start,
+        on_success_callback=on_agent_success,
+        on_failure_callback=on_scan_failure
     )
     def generate_play_quest(zipped_input: tuple):
-        toy_inventory, scan_record = zipped_input
-        child_age = scan_record[2]
-        return json.dumps({"toys": toy_inventory.get("items", []), "child_age": child_age})
+        inventory_ref, scan_record = zipped_input
+        return inventory_prompt(load_output(inventory_ref), scan_record[2])
 
-    zipped_quest_input = toy_inventories.zip(_get_new_scans.output)
+    zipped_quest_input = inventory_refs.zip(_get_new_scans)
     play_quests = generate_play_quest.expand(zipped_input=zipped_quest_input)
 
     @task.agent(
-        llm_conn_id="pydanticai_default",
-        model_id="google-gla:gemini-3.1-pro-preview",
+        llm_conn_id=LLM_CONN_ID,
+        model_id=ANALYSIS_MODEL_ID,
         output_type=AnalysisResult,
-        system_prompt="""
-            You are an expert Child Development Specialist who uses the US Dept of Labor's O*NET database to scientifically validate play.
-
-            **The core logic:**
-            You treat "play" as the child's "job". Your goal is to map toy interactions to official O*NET abilities.
-            - Example: "Stacking Blocks" = "Visualization (1.A.1.f.2)" and "Finger Dexterity (1.A.2.a.2)".
-            - Example: "Riding a Bike" = "Gross Body Coordination (1.A.3.c.3)".
-
-            **Your task:**
-            1. **Audit:** Analyze the provided inventory and assess current skill development.
-            2. **Score:** Rate the child's current development in 6 categories (0-100 scale):
-            - cognitive: problem solving, reasoning, memory
-            - motor_fine: finger dexterity, precision, hand-eye coordination
-            - motor_gross: body coordination, balance, strength
-            - social_emotional: empathy, cooperation, emotional expression
-            - creative: imagination, artistic expression, open-ended play
-            - language: communication, vocabulary, storytelling
-            3. **Roadmap:** Create a 3-item development roadmap with priorities:
-            - Priority 1 (timeframe: "now"): Most critical gap to address immediately
-            - Priority 2 (timeframe: "3_months"): Second priority for near-term
-            - Priority 3 (timeframe: "6_months"): Third priority for longer-term growth
-
-            **Age-appropriate recommendations:**
-            The input includes the child's age. Recommend toys that children of that age typically enjoy.
-            Use the age as a guide, not a strict limit - a range of ±1-2 years is acceptable.
-            Avoid recommending toddler toys for school-age children or complex toys for toddlers.
-
-            **Requirements:**
-            - In status_quo, summarize the dominant O*NET Ability clusters present.
-            - In skill_scores, provide realistic scores based on the toy inventory analysis.
-            - In roadmap, provide exactly 3 items. Each must include:
-            - The specific O*NET Ability Name in missing_skill
-            - The O*NET ID Code in skill_id (e.g., "1.A.1.f.2")
-            - Which of the 6 categories it maps to in skill_category
-            - A specific toy recommendation in recommended_toy that is age-appropriate
-            - Scientific reasoning citing the O*NET ability
-            - Use the `get_careers_for_skill` tool to mention 1-2 future professions that rely on this skill
-            - Add a career forecasting to the reasoning of the roadmap items, based on the O*NET data
-        """,
-        agent_params={
-            "tools": [get_careers_for_skill],
-            "model_settings": GoogleModelSettings(
-                google_thinking_config={"thinking_level": "high"}
-            )
-        },
-        max_active_tis_per_dag=2
+        system_prompt=ANALYSIS_INSTRUCTIONS,
+        agent_params=ANALYSIS_AGENT_PARAMS,
+        max_active_tis_per_dag=2,
+        on_execute_callback=on_stage_start,
+        on_success_callback=on_agent_success,
+        on_failure_callback=on_scan_failure
     )
     def analyze_playroom(zipped_input: tuple):
-        toy_inventory, scan_record = zipped_input
-        child_age = scan_record[2]
-        return json.dumps({"toys": toy_inventory.get("items", []), "child_age": child_age})
+        inventory_ref, scan_record = zipped_input
+        return inventory_prompt(load_output(inventory_ref), scan_record[2])
 
-    zipped_analysis_input = toy_inventories.zip(_get_new_scans.output)
+    zipped_analysis_input = inventory_refs.zip(_get_new_scans)
     analysis_results = analyze_playroom.expand(zipped_input=zipped_analysis_input)
 
     @task.agent(
-        llm_conn_id="pydanticai_default",
+        llm_conn_id=LLM_CONN_ID,
         output_type=ToyRecommendation,
-        system_prompt="""
-            You are a dual-role agent: CPSC Safety Auditor and Personal Shopper.
-
-            **Input:** A development roadmap with 3 recommended toys and the child's age.
-
-            **For EACH of the 3 toys in the roadmap:**
-
-            **Step 1: Safety Audit**
-            Check the toy against CPSC guidelines for the child's age.
-            - If safe: Keep the recommendation (decision: "APPROVED").
-            - If unsafe: Select a safer alternative that achieves the same developmental goal (decision: "SUBSTITUTED").
-
-            **Step 2: Shopping Prep**
-            Generate a specific 'amazon_search' for the FINAL toy.
-            - Include brand names if they matter for safety.
-            - Exclude generic terms that lead to low-quality knock-offs.
-
-            **Requirements:**
-            - Return exactly 3 items, one for each roadmap entry.
-            - Preserve the timeframe ("now", "3_months", "6_months") from the input.
-            - Decision must be "APPROVED" or "SUBSTITUTED".
-            - Provide a clear 'safety_context' explaining your decision for each toy.
-        """,
-        agent_params={
-            "tools": [duckduckgo_search_tool()],
-            "model_settings": GoogleModelSettings(
-                google_thinking_config={"thinking_level": "low"}
-            )
-        },
-        max_active_tis_per_dag=2
+        system_prompt=SAFETY_INSTRUCTIONS,
+        agent_params=SAFETY_AGENT_PARAMS,
+        max_active_tis_per_dag=2,
+        on_execute_callback=on_stage_start,
+        on_success_callback=on_agent_success,
+        on_failure_callback=on_scan_failure
     )
     def safety_check(zipped_input: tuple):
         analysis_result, scan_record = zipped_input
-        child_age = scan_record[2]
-        return json.dumps({"roadmap": analysis_result.get("roadmap", []), "child_age": child_age})
+        return roadmap_prompt(analysis_result, scan_record[2])
 
-    zipped_input_safety = analysis_results.zip(_get_new_scans.output)
+    zipped_input_safety = analysis_results.zip(_get_new_scans)
     recommendations = safety_check.expand(zipped_input=zipped_input_safety)
 
     @task
     def print_result(zipped_input: tuple):
-        toy_inventory, analysis_result, toy_recommendation = zipped_input
+        inventory_ref, analysis_result, toy_recommendation = zipped_input
+        toy_inventory = load_output(inventory_ref)
         print("=" * 50)
         print("TOY INVENTORY:")
         print(json.dumps(toy_inventory, indent=2))
@@ -337,42 +203,42 @@ def process_scans():
         for item in toy_recommendation.get("items", []):
             print(f"  [{item.get('timeframe')}] {item.get('decision')}: {item.get('recommended_toy')}")
 
-    zipped_input_print = toy_inventories.zip(analysis_results, recommendations)
-    print_result.expand(zipped_input=zipped_input_print)
+    zipped_input_print = inventory_refs.zip(analysis_results, recommendations)
+    printed_results = print_result.expand(zipped_input=zipped_input_print)
 
-    @task(max_active_tis_per_dag=2)
-    def save_result(zipped_input: tuple):
-        toy_inventory, play_quest, analysis_result, toy_recommendation, scan_record = zipped_input
+    @task(max_active_tis_per_dag=2, on_failure_callback=on_scan_failure)
+    def save_result(zipped_input: tuple, run_id=None):
+        inventory_ref, play_quest, analysis_result, toy_recommendation, scan_record = zipped_input
         scan_id = str(scan_record[0])
-        roadmap_items = analysis_result.get("roadmap", [])
-        safety_items = toy_recommendation.get("items", [])
-
-        merged_roadmap = []
-        for i, roadmap_item in enumerate(roadmap_items):
-            safety_item = safety_items[i] if i < len(safety_items) else {}
-            merged_roadmap.append({
-                **roadmap_item,
-                "decision": safety_item.get("decision", "APPROVED"),
-                "final_toy": safety_item.get("recommended_toy", roadmap_item.get("recommended_toy")),
-                "safety_context": safety_item.get("safety_context", ""),
-                "amazon_search": safety_item.get("amazon_search", "")
-            })
-
-        payload = {
-            "status_quo": analysis_result.get("status_quo", ""),
-            "skill_scores": analysis_result.get("skill_scores", {}),
-            "roadmap": merged_roadmap,
-            "toy_inventory": toy_inventory.get("items", []),
-            "play_quest": play_quest
-        }
+        payload = build_results(load_output(inventory_ref), play_quest, analysis_result, toy_recommendation)
         supabase = create_client(supabase_project_url, supabase_secret_key)
 
-        supabase.table("scans").update({
+        # Only while this run holds the claim, a scan reaped and claimed by another run is theirs now
+        response = supabase.table("scans").update({
             "status": "done",
-            "results_json": payload
-        }).eq("id", scan_id).execute()
-
-    zipped_input_save = toy_inventories.zip(play_quests, analysis_results, recommendations, _get_new_scans.output)
-    save_result.expand(zipped_input=zipped_input_save)
+            "results_json": payload,
+            "completed_at": datetime.now(timezone.utc).isoformat(),
+            "lease_expires_at": None,
+            "error": None
+        }).eq("id", scan_id).eq("dag_run_id", run_id).execute()
+        if not response.data:
+            print(f"Scan {scan_id} was claimed by another run in the meantime, dropped the result")
+
+    zipped_input_save = inventory_refs.zip(play_quests, analysis_results, recommendations, _get_new_scans)
+    saved_results = save_result.expand(zipped_input=zipped_input_save)
+
+    # Once both readers are done, whether they succeeded or not. As a teardown it doesn't decide
+    # the state of the run, failed scans still fail it. A claim retrying them stores them again.
+    @task
+    def delete_stored_results(inventory_refs: list):
+        result_store = get_result_store()
+        if result_store is None:
+            return
+        for inventory_ref in inventory_refs:
+            # None for scans whose analyze_image failed
+            if isinstance(inventory_ref, str):
+                result_store.delete(inventory_ref)
+
+    [printed_results, saved_results] >> delete_stored_results(inventory_refs).as_teardown()
 
 process_scans()
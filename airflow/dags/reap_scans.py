@@ -0,0 +1,31 @@
+from airflow.providers.standard.operators.trigger_dagrun import TriggerDagRunOperator
+from airflow.sdk import dag, task
+from pendulum import datetime, duration
+
+from include.scans import reap_expired_leases, should_trigger_process_scans
+
+
+@dag(
+    schedule="*/5 * * * *",
+    start_date=datetime(2026, 1, 1),
+    catchup=False,
+    max_active_runs=1,
+    default_args={
+        "retries": 2,
+        "retry_delay": duration(seconds=30)
+    }
+)
+def reap_scans():
+
+    # Scans whose worker died mid-scan stay `in_flight` until their lease expires. The reaper
+    # puts them back to `processing`, or `failed` after SCAN_MAX_ATTEMPTS claims, and starts
+    # `process_scans` for them, since no upload will. Scans of runs that are still active are left
+    # to their run, and no run is started while one is queued.
+    @task.short_circuit
+    def reap_expired(ti=None) -> bool:
+        reap_expired_leases(ti)
+        return should_trigger_process_scans(ti)
+
+    reap_expired() >> TriggerDagRunOperator(task_id="trigger_process_scans", trigger_dag_id="process_scans")
+
+reap_scans()
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from functools import cache
+from typing import Awaitable, Callable, TypeVar
+
+from pydantic_ai.exceptions import ModelHTTPError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Concurrent model calls per task process: the limit starts at the initial value and adapts
+# between the minimum and maximum. The initial 10 are the concurrent agents of a default batch.
+AGENT_CONCURRENCY_INITIAL = int(os.getenv("AGENT_CONCURRENCY_INITIAL", "10"))
+AGENT_CONCURRENCY_MIN = int(os.getenv("AGENT_CONCURRENCY_MIN", "1"))
+AGENT_CONCURRENCY_MAX = int(os.getenv("AGENT_CONCURRENCY_MAX", "32"))
+# Congestion when the recent latency of a stage exceeds this multiple of its long-term average
+AGENT_LATENCY_TOLERANCE = float(os.getenv("AGENT_LATENCY_TOLERANCE", "2.0"))
+# Throttled calls are retried with exponential backoff and jitter before the error is raised
+AGENT_THROTTLE_RETRIES = int(os.getenv("AGENT_THROTTLE_RETRIES", "4"))
+AGENT_THROTTLE_BACKOFF_SECONDS = float(os.getenv("AGENT_THROTTLE_BACKOFF_SECONDS", "2.0"))
+
+# Gemini answers 429 when the quota is exhausted and 503 when the model is overloaded
+THROTTLE_STATUS_CODES = {429, 503}
+
+# Gentler than halving, like TCP CUBIC: limiters of parallel tasks sharing a quota keep more of it in use
+THROTTLE_DECREASE = 0.7
+LATENCY_DECREASE = 0.9
+# Weights of the latest call in the recent and the long-term moving average of a stage's latency.
+# Model latency varies a lot with the size of the answer, single slow calls are smoothed out.
+RECENT_LATENCY_WEIGHT = 0.2
+LONG_TERM_LATENCY_WEIGHT = 0.01
+
+
+def is_throttled(error: BaseException) -> bool:
+    return isinstance(error, ModelHTTPError) and error.status_code in THROTTLE_STATUS_CODES
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on the concurrent model calls of a task process, shared by all its agents.
+
+    While calls use up the limit and the recent latency of their stage stays within
+    `latency_tolerance` times its long-term average, the limit grows by one per round of
+    `limit` calls (additive increase). A throttled call cuts it by 30%, a congested call by
+    10% (multiplicative decrease). Calls started before the last decrease don't decrease it
+    again, so a burst of 429s of calls that were in flight together counts as one signal.
+    Independent limiters of parallel tasks converge to a fair share of the quota, like TCP
+    connections sharing a link.
+    """
+
+    def __init__(self, initial: int = AGENT_CONCURRENCY_INITIAL, minimum: int = AGENT_CONCURRENCY_MIN,
+                 maximum: int = AGENT_CONCURRENCY_MAX, latency_tolerance: float = AGENT_LATENCY_TOLERANCE,
+                 retries: int = AGENT_THROTTLE_RETRIES, backoff_seconds: float = AGENT_THROTTLE_BACKOFF_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.clock = clock
+
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._latencies: dict[str, tuple[float, float]] = {}
+        # Incremented by each decrease, a call only decreases the limit if none happened since it started
+        self._epoch = 0
+
+        self.calls = 0
+        self.throttled = 0
+        self.congested = 0
+        self.peak_in_flight = 0
+        self.lowest_limit = self.highest_limit = int(self.limit)
+
+    async def run(self, stage: str, call: Callable[[], Awaitable[T]], on_throttle: Callable[[], None] | None = None) -> T:
+        """Runs `call` within the limit, retrying it while the model endpoint throttles."""
+        for attempt in range(self.retries + 1):
+            await self._acquire()
+            epoch, saturated, start = self._epoch, self.in_flight >= int(self.limit), self.clock()
+            try:
+                result = await call()
+            except Exception as e:
+                if not is_throttled(e):
+                    raise
+                self.throttled += 1
+                if on_throttle is not None:
+                    on_throttle()
+                self._decrease(epoch, THROTTLE_DECREASE, f"{stage} throttled ({e.status_code})")
+                if attempt == self.retries:
+                    raise
+            else:
+                self.calls += 1
+                self._on_success(stage, self.clock() - start, epoch, saturated)
+                return result
+            finally:
+                self._release()
+            # Outside the limit, the slot is free for other calls while this one backs off
+            await asyncio.sleep(self.backoff_seconds * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    async def _acquire(self) -> None:
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    # Woken, but cancelled before taking the slot: pass it on
+                    self._wake()
+                raise
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        # Woken waiters check the limit again, so waking one too many is harmless
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done() and not waiter.get_loop().is_closed():
+                waiter.set_result(None)
+                free -= 1
+
+    def _on_success(self, stage: str, latency: float, epoch: int, saturated: bool) -> None:
+        recent, long_term = self._latencies.get(stage, (latency, latency))
+        recent += RECENT_LATENCY_WEIGHT * (latency - recent)
+        long_term += LONG_TERM_LATENCY_WEIGHT * (latency - long_term)
+        self._latencies[stage] = recent, long_term
+        if recent > long_term * self.latency_tolerance:
+            self.congested += 1
+            self._decrease(epoch, LATENCY_DECREASE, f"{stage} latency {recent:.1f} s, usually {long_term:.1f} s")
+        elif saturated:
+            # Only grow a limit that is actually used, a half idle limit says nothing about the quota
+            self._set_limit(self.limit + 1 / self.limit, "healthy")
+
+    def _decrease(self, epoch: int, factor: float, reason: str) -> None:
+        if epoch != self._epoch:
+            return
+        self._epoch += 1
+        self._set_limit(self.limit * factor, reason)
+
+    def _set_limit(self, limit: float, reason: str) -> None:
+        old = int(self.limit)
+        self.limit = min(max(limit, self.minimum), self.maximum)
+        new = int(self.limit)
+        if new != old:
+            self.lowest_limit, self.highest_limit = min(self.lowest_limit, new), max(self.highest_limit, new)
+            logger.info("Agent concurrency limit %d -> %d: %s (%d in flight)", old, new, reason, self.in_flight)
+            self._wake()
+
+    def log_stats(self) -> None:
+        logger.info(
+            "Agent calls: %d, %d throttled, %d congested, limit %d (range %d-%d), peak %d in flight",
+            self.calls, self.throttled, self.congested, int(self.limit), self.lowest_limit, self.highest_limit, self.peak_in_flight
+        )
+
+
+@cache
+def get_agent_limiter() -> AdaptiveLimiter:
+    """One limiter per task process, it keeps what it learned across the scans of a batch."""
+    return AdaptiveLimiter()
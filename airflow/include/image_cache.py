@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import mmap
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from functools import cache
+from pathlib import Path
+from typing import Iterator
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_DIR = Path(os.getenv("IMAGE_CACHE_DIR", Path(tempfile.gettempdir()) / "playroom-images"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+
+@cache
+def get_http_client() -> httpx.Client:
+    """One pooled client per worker process instead of a new connection per download."""
+    return httpx.Client(timeout=httpx.Timeout(30.0), limits=httpx.Limits(max_keepalive_connections=10))
+
+
+class ImageCache:
+    """
+    Worker-local on-disk cache of scan images, shared by all task processes on the worker.
+
+    Images are streamed from storage straight to disk and read back via mmap. Files are keyed
+    by a hash of the image path, which never changes its content. The modification time doubles
+    as the last access time, the least recently used files are evicted once the directory grows
+    beyond `max_bytes`.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, client: httpx.Client):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.client = client
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, image_path: str) -> Path:
+        return self.directory / hashlib.sha256(image_path.encode()).hexdigest()
+
+    def fetch(self, url: str, image_path: str) -> Path:
+        """Returns the local file of an image, downloading it on a miss."""
+        path = self._path(image_path)
+        try:
+            self._touch(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        # Parallel tasks may download the same image, the rename makes sure readers only ever
+        # see complete files
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".download-")
+        try:
+            with os.fdopen(fd, "wb") as f, self.client.stream("GET", url) as response:
+                response.raise_for_status()
+                for chunk in response.iter_bytes():
+                    f.write(chunk)
+            os.replace(tmp, path)
+            self._touch(path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+        self._evict(keep=path)
+        return path
+
+    @staticmethod
+    def _touch(path: Path) -> None:
+        # Explicit nanosecond timestamps, the file system clock is too coarse to order quick accesses
+        now = time.time_ns()
+        os.utime(path, ns=(now, now))
+
+    @contextmanager
+    def open(self, url: str, image_path: str) -> Iterator[mmap.mmap]:
+        """Memory-maps the cached image, readers get a file-like object without copying it."""
+        with open(self.fetch(url, image_path), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+
+    def read(self, url: str, image_path: str) -> bytes:
+        with self.open(url, image_path) as mapped:
+            return mapped[:]
+
+    def _evict(self, keep: Path) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(".download-"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # Evicted by another process in the meantime
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == str(keep):
+                continue
+            Path(path).unlink(missing_ok=True)
+            total -= size
+            logger.debug("Evicted %s from the image cache", path)
+
+
+@cache
+def get_image_cache() -> ImageCache:
+    return ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, get_http_client())
@@ -0,0 +1,27 @@
+# Per-stage metrics stored in the `metrics` column of each scan, read by the backend's /api/metrics
+
+
+def new_stage_metrics() -> dict:
+    return {
+        "seconds": 0.0,
+        "model": None,
+        "requests": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "thinking_tokens": 0,
+        "tool_calls": 0,
+        # Calls rejected with a 429 or 503 and retried, see `include/concurrency.py`
+        "throttled": 0,
+    }
+
+
+def add_usage(metrics: dict, result) -> None:
+    """Adds the usage of an agent run. Stages with several runs, e.g. tiled vision, are summed up."""
+    usage = result.usage()
+    metrics["model"] = result.response.model_name
+    metrics["requests"] += usage.requests
+    metrics["input_tokens"] += usage.input_tokens
+    metrics["output_tokens"] += usage.output_tokens
+    # Gemini reports the thinking tokens separately, they're billed as output
+    metrics["thinking_tokens"] += usage.details.get("thoughts_tokens", 0)
+    metrics["tool_calls"] += usage.tool_calls
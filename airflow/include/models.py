@@ -0,0 +1,60 @@
+from pydantic import BaseModel
+
+
+class BoundingBox(BaseModel):
+    x: float  # 0-1 normalized, left edge
+    y: float  # 0-1 normalized, top edge
+    w: float  # 0-1 normalized, width
+    h: float  # 0-1 normalized, height
+
+class Toy(BaseModel):
+    category: str
+    item_name: str
+    play_mode: str
+    count: int = 1  # 1 for individuals; >1 only for tight clusters of similar items under one bbox
+    bbox: BoundingBox  # Normalized 0-1 coordinates; hugs the toy, or the whole cluster for cluster entries
+
+class ToyInventory(BaseModel):
+    items: list[Toy]
+
+class SkillScores(BaseModel):
+    cognitive: int  # 0-100: problem solving, reasoning, memory
+    motor_fine: int  # 0-100: finger dexterity, precision
+    motor_gross: int  # 0-100: coordination, balance, strength
+    social_emotional: int  # 0-100: empathy, cooperation, expression
+    creative: int  # 0-100: imagination, artistic, open-ended play
+    language: int  # 0-100: communication, vocabulary, storytelling
+
+class RoadmapItem(BaseModel):
+    timeframe: str  # "now", "3_months", "6_months"
+    priority: int  # 1, 2, or 3
+    missing_skill: str  # O*NET ability name
+    skill_id: str  # O*NET ID like "1.A.1.f.2"
+    skill_category: str  # One of: cognitive, motor_fine, motor_gross, social_emotional, creative, language
+    recommended_toy: str
+    reasoning: str
+
+class AnalysisResult(BaseModel):
+    status_quo: str
+    skill_scores: SkillScores
+    roadmap: list[RoadmapItem]  # Exactly 3 items
+
+class ToyRecommendationItem(BaseModel):
+    timeframe: str
+    decision: str  # "APPROVED" or "SUBSTITUTED"
+    recommended_toy: str
+    safety_context: str
+    amazon_search: str
+
+class ToyRecommendation(BaseModel):
+    items: list[ToyRecommendationItem]
+
+class PlayQuest(BaseModel):
+    title: str
+    target_skill: str
+    skill_id: str
+    duration_minutes: int
+    toys_needed: list[str]
+    setup: str
+    instructions: list[str]
+    parent_tip: str
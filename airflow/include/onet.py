@@ -1,8 +1,83 @@
+import csv
+import logging
 import os
-from airflow.providers.postgres.hooks.postgres import PostgresHook
-from supabase import create_client
+from functools import cache, lru_cache
+from pathlib import Path
 
-_POSTGRES_CONN_ID = "postgres_playroom_diet"
+from supabase import Client, create_client
+
+logger = logging.getLogger(__name__)
+
+# Directory with the tab-delimited O*NET release files, the same files imported into the database
+ONET_DATA_DIR = Path(os.getenv("ONET_DATA_DIR", Path(__file__).parent / "onet"))
+ABILITIES_FILE = "Abilities.txt"
+OCCUPATIONS_FILE = "Occupation Data.txt"
+
+# Mirrors the get_careers_for_skill SQL function
+MIN_LEVEL = 4.5
+MAX_CAREERS = 5
+
+
+class OnetIndex:
+    """
+    Top occupations per ability, ranked by the ability's level (LV) data value.
+    Only keeps what `get_careers_for_skill` needs: a few titles per ability name.
+    """
+
+    def __init__(self, careers: dict[str, tuple[str, ...]]):
+        self._careers = careers
+
+    def __len__(self) -> int:
+        return len(self._careers)
+
+    def careers(self, skill_name: str) -> tuple[str, ...]:
+        return self._careers.get(skill_name, ())
+
+    @classmethod
+    def from_files(cls, abilities_path: Path, occupations_path: Path, min_level: float = MIN_LEVEL, limit: int = MAX_CAREERS) -> "OnetIndex":
+        with open(occupations_path, newline="", encoding="utf-8") as f:
+            titles = {row["O*NET-SOC Code"]: row["Title"] for row in csv.DictReader(f, delimiter="\t")}
+
+        candidates: dict[str, list[tuple[float, str]]] = {}
+        with open(abilities_path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f, delimiter="\t"):
+                if row["Scale ID"] != "LV":
+                    continue
+                level = float(row["Data Value"])
+                title = titles.get(row["O*NET-SOC Code"])
+                if level > min_level and title is not None:
+                    candidates.setdefault(row["Element Name"], []).append((level, title))
+
+        return cls({
+            name: tuple(title for _, title in sorted(rows, key=lambda r: (-r[0], r[1]))[:limit])
+            for name, rows in candidates.items()
+        })
+
+
+@cache
+def load_index() -> OnetIndex | None:
+    """Loads the index once per process, None if the O*NET files aren't available."""
+    abilities_path, occupations_path = ONET_DATA_DIR / ABILITIES_FILE, ONET_DATA_DIR / OCCUPATIONS_FILE
+    if not abilities_path.exists() or not occupations_path.exists():
+        logger.info("O*NET files not found in %s, using the database for career lookups", ONET_DATA_DIR)
+        return None
+    return OnetIndex.from_files(abilities_path, occupations_path)
+
+
+@cache
+def get_supabase() -> Client:
+    return create_client(os.getenv("SUPABASE_PROJECT_URL"), os.getenv("SUPABASE_SECRET_KEY"))
+
+
+@lru_cache(maxsize=1024)
+def _careers_for_skill(skill_name: str) -> tuple[str, ...]:
+    index = load_index()
+    if index is not None:
+        return index.careers(skill_name)
+
+    # Errors propagate, so only successful lookups are memoized
+    response = get_supabase().rpc("get_careers_for_skill", {"skill_name": skill_name}).execute()
+    return tuple(item['job_title'] for item in response.data)
 
 
 def get_careers_for_skill(skill_name: str) -> list[str]:
@@ -11,12 +86,7 @@ def get_careers_for_skill(skill_name: str) -> list[str]:
     """
 
     try:
-        url = os.getenv("SUPABASE_PROJECT_URL")
-        key = os.getenv("SUPABASE_SECRET_KEY")
-        supabase = create_client(url, key)
-
-        response = supabase.rpc("get_careers_for_skill", {"skill_name": skill_name}).execute()
-        return [item['job_title'] for item in response.data]
+        return list(_careers_for_skill(skill_name))
 
     except Exception as e:
         print(f"Tool Error: {e}")
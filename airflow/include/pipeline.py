@@ -0,0 +1,280 @@
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+from pydantic_ai import BinaryContent
+from pydantic_ai.exceptions import UnexpectedModelBehavior
+from supabase import AsyncClient, acreate_client
+
+from include.agents import VISION_PROMPT, ScanAgents, create_scan_agents
+from include.concurrency import get_agent_limiter
+from include.image_cache import get_image_cache
+from include.metrics import add_usage, new_stage_metrics
+from include.result_cache import AGENT_CACHE_TTL_HOURS, AgentResultCache, inventory_signature, roadmap_signature
+from include.results import build_results, partial_results
+from include.scans import mark_progress
+from include.tiering import ANALYSIS_TIER_MAX_TOYS, get_tier_stats, inventory_complexity, validate_analysis
+from include.tiling import VISION_TILE_GRID, VISION_TILE_OVERLAP, crop_tiles, image_size, merge_tile_items, should_tile
+
+logger = logging.getLogger(__name__)
+
+supabase_project_url = os.getenv("SUPABASE_PROJECT_URL")
+supabase_secret_key = os.getenv("SUPABASE_SECRET_KEY")
+
+
+# Agent stages, named like the task ids of the mapped mode
+AGENT_STAGES = ("analyze_image", "analyze_playroom", "safety_check", "generate_play_quest")
+
+
+def image_url(image_path: str) -> str:
+    return f"{supabase_project_url}/storage/v1/object/public/playroom-images/{image_path}"
+
+
+def image_media_type(image_path: str) -> str:
+    # The backend normalizes uploads to JPEG or WebP, older scans keep their original format
+    return mimetypes.guess_type(image_path)[0] or "image/jpeg"
+
+
+def get_image_bytes(image_path: str) -> bytes:
+    # Served from the worker's disk cache, retries and later stages don't download the image again
+    return get_image_cache().read(image_url(image_path), image_path)
+
+
+def inventory_prompt(toy_inventory: dict, child_age) -> str:
+    return json.dumps({"toys": toy_inventory.get("items", []), "child_age": child_age})
+
+
+def roadmap_prompt(analysis_result: dict, child_age) -> str:
+    return json.dumps({"roadmap": analysis_result.get("roadmap", []), "child_age": child_age})
+
+
+async def _mark_progress(scan_id: str, run_id: str, stage: str, state: str, results: dict | None = None) -> None:
+    # Same best effort semantics as the task callbacks of the mapped mode
+    try:
+        await asyncio.to_thread(mark_progress, scan_id, run_id, stage, state, results)
+    except Exception as e:
+        logger.warning("Failed to mark progress: %s", e)
+
+
+async def _run_agent(stage: str, agent, prompt, metrics: dict | None = None) -> dict:
+    # All agent calls of the task process share one adaptive concurrency limit, throttled calls are retried
+    on_throttle = None if metrics is None else lambda: metrics.update(throttled=metrics["throttled"] + 1)
+    result = await get_agent_limiter().run(stage, lambda: agent.run(prompt), on_throttle)
+    if metrics is not None:
+        add_usage(metrics, result)
+    return result.output.model_dump()
+
+
+def _run_cached(cache: AgentResultCache | None, stage: str, signature: str, run: Callable[[], Awaitable[dict]]) -> Awaitable[dict]:
+    if cache is None:
+        return run()
+    # Cache hits leave the usage at zero requests
+    return cache.get_or_run(stage, signature, run)
+
+
+async def run_analysis(agents: ScanAgents, toy_inventory: dict, child_age, metrics: dict) -> dict:
+    """
+    Runs the analysis agent. With `ANALYSIS_TIERING`, inventories of up to `ANALYSIS_TIER_MAX_TOYS`
+    entries go to the fast model first, and its answer is kept if `validate_analysis` finds nothing
+    wrong with it. Larger inventories, invalid answers and answers that don't even parse as an
+    `AnalysisResult` escalate to the analysis model. The usage of both runs adds up, the tier and
+    the reason for escalating are stored in the stage metrics.
+    """
+    prompt = inventory_prompt(toy_inventory, child_age)
+    if agents.analysis_fast is None:
+        return await _run_agent("analyze_playroom", agents.analysis, prompt, metrics)
+
+    start = time.monotonic()
+    escalation = "complexity"
+    if inventory_complexity(toy_inventory) <= ANALYSIS_TIER_MAX_TOYS:
+        # Own stage for the limiter, so the shorter Flash latencies don't skew the long-term average of Pro
+        try:
+            analysis_result = await _run_agent("analyze_playroom_fast", agents.analysis_fast, prompt, metrics)
+            problems = validate_analysis(analysis_result)
+        except UnexpectedModelBehavior as e:
+            problems = [str(e)]
+        metrics["fast_seconds"] = time.monotonic() - start
+        if not problems:
+            metrics.update(tier="flash", escalation=None)
+            get_tier_stats().record("flash", None, time.monotonic() - start)
+            return analysis_result
+        logger.info("Escalating the analysis to Pro: %s", "; ".join(problems))
+        escalation = "validation"
+
+    analysis_result = await _run_agent("analyze_playroom", agents.analysis, prompt, metrics)
+    metrics.update(tier="pro", escalation=escalation)
+    get_tier_stats().record("pro", escalation, time.monotonic() - start)
+    return analysis_result
+
+
+async def detect_toys(agent, image_bytes: bytes, media_type: str, metrics: dict | None = None) -> dict:
+    """
+    Runs the vision agent on the whole image, or with `VISION_TILE_GRID` > 1 on overlapping tiles
+    of large images. Tiles are analyzed concurrently, their boxes mapped back to the full image
+    and toys detected twice on a seam merged, see `include/tiling.py`.
+    """
+    if VISION_TILE_GRID <= 1 or not should_tile(*image_size(image_bytes), grid=VISION_TILE_GRID):
+        return await _run_agent("analyze_image", agent, [VISION_PROMPT, BinaryContent(data=image_bytes, media_type=media_type)], metrics)
+
+    (width, height), tiles = await asyncio.to_thread(crop_tiles, image_bytes, VISION_TILE_GRID, VISION_TILE_OVERLAP)
+    inventories = await asyncio.gather(*(
+        _run_agent("analyze_image", agent, [VISION_PROMPT, BinaryContent(data=tile_bytes, media_type="image/jpeg")], metrics)
+        for _, tile_bytes in tiles
+    ))
+    tile_items = [(tile, inventory.get("items", [])) for (tile, _), inventory in zip(tiles, inventories)]
+    items = merge_tile_items(tile_items, width, height)
+    logger.info(
+        "Merged %d detections of %d tiles into %d toys",
+        sum(len(tile_inventory) for _, tile_inventory in tile_items), len(tiles), len(items)
+    )
+    return {"items": items}
+
+
+async def _run_stage(scan_id: str, run_id: str, stage: str, run: Awaitable[dict], timings: dict[str, float],
+                     analysis_result: dict | None = None) -> dict:
+    await _mark_progress(scan_id, run_id, stage, "running")
+    start = time.monotonic()
+    output = await run
+    timings[stage] = time.monotonic() - start
+    # The frontend shows the output of the stage right away, without waiting for the others
+    await _mark_progress(scan_id, run_id, stage, "done", partial_results(stage, output, analysis_result))
+    return output
+
+
+async def run_scan(agents: ScanAgents, supabase: AsyncClient, scan_record, run_id: str, cache: AgentResultCache | None = None) -> dict[str, float]:
+    """
+    Runs one scan through the agent chain and stores the result. Returns the wall time per stage.
+
+    Each agent starts as soon as its inputs are ready: play quest and analysis both only need the
+    inventory and run concurrently, the safety check follows the analysis without waiting for the
+    play quest. The critical path is vision + max(play quest, analysis + safety).
+
+    With a `cache`, the agents after the vision agent reuse the outputs of earlier scans with the
+    same inventory (or roadmap) signature and age bucket instead of calling the model. With
+    `ANALYSIS_TIERING`, the analysis tries the fast model first, see `run_analysis`.
+
+    The output of each stage is merged into `results_json` as soon as it is done, so the frontend
+    shows the inventory while the analysis is still running. Wall time, model, token usage and
+    tool calls of each agent stage are stored with the result in the `metrics` column.
+
+    All writes are scoped to the Dag run `run_id` that claimed the scan. If its lease was reaped
+    and another run claimed the scan since, the result of this run is dropped.
+    """
+    scan_id, image_path, child_age = str(scan_record[0]), scan_record[1], scan_record[2]
+    timings: dict[str, float] = {}
+    metrics = {stage: new_stage_metrics() for stage in AGENT_STAGES}
+    start = time.monotonic()
+
+    image_bytes = await asyncio.to_thread(get_image_bytes, image_path)
+
+    # Stage names match the task ids of the mapped mode, the frontend shows progress by these keys
+    toy_inventory = await _run_stage(scan_id, run_id, "analyze_image", detect_toys(
+        agents.vision, image_bytes, image_media_type(image_path), metrics["analyze_image"]
+    ), timings)
+
+    signature = inventory_signature(toy_inventory, child_age)
+
+    async def analyze_and_check() -> tuple[dict, dict]:
+        analysis_result = await _run_stage(scan_id, run_id, "analyze_playroom", _run_cached(
+            cache, "analyze_playroom", signature, lambda: run_analysis(agents, toy_inventory, child_age, metrics["analyze_playroom"])
+        ), timings)
+        toy_recommendation = await _run_stage(scan_id, run_id, "safety_check", _run_cached(
+            cache, "safety_check", roadmap_signature(analysis_result, child_age),
+            lambda: _run_agent("safety_check", agents.safety, roadmap_prompt(analysis_result, child_age), metrics["safety_check"])
+        ), timings, analysis_result)
+        return analysis_result, toy_recommendation
+
+    play_quest, (analysis_result, toy_recommendation) = await asyncio.gather(
+        _run_stage(scan_id, run_id, "generate_play_quest", _run_cached(
+            cache, "generate_play_quest", signature,
+            lambda: _run_agent("generate_play_quest", agents.play_quest, inventory_prompt(toy_inventory, child_age), metrics["generate_play_quest"])
+        ), timings),
+        analyze_and_check(),
+    )
+
+    for stage, stage_metrics in metrics.items():
+        stage_metrics["seconds"] = timings[stage]
+
+    save_start = time.monotonic()
+    response = await supabase.table("scans").update({
+        "status": "done",
+        "results_json": build_results(toy_inventory, play_quest, analysis_result, toy_recommendation),
+        "metrics": metrics,
+        "completed_at": datetime.now(timezone.utc).isoformat(),
+        "lease_expires_at": None,
+        "error": None
+    }).eq("id", scan_id).eq("dag_run_id", run_id).execute()
+    timings["save_result"] = time.monotonic() - save_start
+    if not response.data:
+        logger.warning("Scan %s was claimed by another run in the meantime, dropped the result of run %s", scan_id, run_id)
+    timings["end_to_end"] = time.monotonic() - start
+
+    logger.info(
+        "Scan %s done in %.1f s (sum of stages %.1f s): %s",
+        scan_id, timings["end_to_end"], sum(v for k, v in timings.items() if k != "end_to_end"),
+        ", ".join(f"{stage} {seconds:.1f} s" for stage, seconds in timings.items() if stage != "end_to_end")
+    )
+    return timings
+
+
+async def _record_error(supabase: AsyncClient, scan_id: str, run_id: str, error: str) -> None:
+    # Shown if the scan fails for good, see `release_scans` in include/scans.py
+    try:
+        await supabase.table("scans").update({"error": error}).eq("id", scan_id).eq("dag_run_id", run_id).execute()
+    except Exception as e:
+        logger.warning("Failed to record the error of scan %s: %s", scan_id, e)
+
+
+async def process_batch(scan_records: list, concurrency: int, run_id: str) -> None:
+    """
+    Runs a chunk of scans through the agent chain inside one task, up to `concurrency` scans at a time.
+
+    A failing scan doesn't affect the others: its error is logged and stored with the scan, and
+    the task fails only after every scan has finished. Scans that are already `done` are skipped,
+    so an Airflow retry only reruns the failed ones, and so are scans claimed by another run since.
+    """
+    supabase = await acreate_client(supabase_project_url, supabase_secret_key)
+
+    ids = [str(record[0]) for record in scan_records]
+    response = await supabase.table("scans").select("id").in_("id", ids).eq("status", "in_flight").eq("dag_run_id", run_id).execute()
+    pending = {row["id"] for row in response.data}
+    scan_records = [record for record in scan_records if str(record[0]) in pending]
+
+    agents = create_scan_agents()
+    cache = AgentResultCache(supabase) if AGENT_CACHE_TTL_HOURS > 0 else None
+    if cache is not None:
+        await cache.evict_expired()
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.monotonic()
+
+    async def process(scan_record) -> bool:
+        async with semaphore:
+            try:
+                await run_scan(agents, supabase, scan_record, run_id, cache)
+                return True
+            except Exception as e:
+                logger.exception("Scan %s failed", scan_record[0])
+                await _record_error(supabase, str(scan_record[0]), run_id, f"{type(e).__name__}: {e}")
+                return False
+
+    succeeded = await asyncio.gather(*(process(record) for record in scan_records))
+
+    elapsed = time.monotonic() - start
+    done = sum(succeeded)
+    logger.info(
+        "Processed %d/%d scans in %.1f s (%.1f scans/minute, %d skipped as done or claimed by another run)",
+        done, len(scan_records), elapsed, done / elapsed * 60 if elapsed else 0.0, len(ids) - len(scan_records)
+    )
+    if cache is not None:
+        cache.log_stats()
+    get_agent_limiter().log_stats()
+    get_tier_stats().log_stats()
+
+    failed = [str(record[0]) for record, ok in zip(scan_records, succeeded) if not ok]
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(scan_records)} scans failed: {', '.join(failed)}")
@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from supabase import AsyncClient
+
+logger = logging.getLogger(__name__)
+
+# How long agent outputs are reused for matching inputs, 0 disables the cache
+AGENT_CACHE_TTL_HOURS = float(os.getenv("AGENT_CACHE_TTL_HOURS", "168"))
+
+# Upper bounds of the age buckets, children within a bucket get the same recommendations
+AGE_BUCKETS = (1, 3, 5, 8, 12)
+
+
+def age_bucket(child_age) -> str:
+    try:
+        age = int(child_age)
+    except (TypeError, ValueError):
+        return "unknown"
+    lower = 0
+    for upper in AGE_BUCKETS:
+        if age <= upper:
+            return f"{lower}-{upper}"
+        lower = upper + 1
+    return f"{lower}+"
+
+
+def _normalize(value) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", str(value or "").lower()).strip()
+
+
+def _digest(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def inventory_signature(toy_inventory: dict, child_age) -> str:
+    """
+    Key of the agents that only see the inventory and the age: analysis and play quest.
+
+    Bounding boxes, order, case and punctuation don't matter, and repeated entries of the same
+    toy are summed up, so "Red car" twice and "red-car" x 2 give the same signature.
+    """
+    counts: dict[tuple[str, str, str], int] = {}
+    for item in toy_inventory.get("items", []):
+        key = (_normalize(item.get("category")), _normalize(item.get("item_name")), _normalize(item.get("play_mode")))
+        counts[key] = counts.get(key, 0) + int(item.get("count") or 1)
+    return _digest({"toys": sorted([*key, count] for key, count in counts.items()), "age": age_bucket(child_age)})
+
+
+def roadmap_signature(analysis_result: dict, child_age) -> str:
+    """Key of the safety check, which sees the roadmap instead of the inventory."""
+    roadmap = [
+        [_normalize(item.get("timeframe")), _normalize(item.get("missing_skill")), _normalize(item.get("recommended_toy"))]
+        for item in analysis_result.get("roadmap", [])
+    ]
+    return _digest({"roadmap": roadmap, "age": age_bucket(child_age)})
+
+
+class AgentResultCache:
+    """
+    Agent outputs shared by all workers via the `agent_result_cache` table, keyed by stage and
+    input signature. Entries expire after `ttl_hours`.
+
+    Scans with the same signature within one batch share a single model call, later batches
+    read the stored output. Cache errors never fail a scan, they count as a miss.
+    """
+
+    def __init__(self, supabase: AsyncClient, ttl_hours: float = AGENT_CACHE_TTL_HOURS):
+        self.supabase = supabase
+        self.ttl_hours = ttl_hours
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries: dict[tuple[str, str], asyncio.Future] = {}
+
+    async def get_or_run(self, stage: str, signature: str, run: Callable[[], Awaitable[dict]]) -> dict:
+        key = (stage, signature)
+        if key in self._entries:
+            output, model_seconds = await asyncio.shield(self._entries[key])
+            self._hit(model_seconds)
+            return output
+
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = future
+        try:
+            entry = await self._load(stage, signature)
+            if entry is not None:
+                self._hit(entry[1])
+            else:
+                self.misses += 1
+                start = time.monotonic()
+                entry = (await run(), time.monotonic() - start)
+                await self._store(stage, signature, *entry)
+        except BaseException as e:
+            # The next scan with this signature calls the model again
+            del self._entries[key]
+            future.set_exception(e)
+            future.exception()
+            raise
+
+        future.set_result(entry)
+        return entry[0]
+
+    def _hit(self, model_seconds: float) -> None:
+        self.hits += 1
+        self.saved_seconds += model_seconds
+
+    async def _load(self, stage: str, signature: str) -> tuple[dict, float] | None:
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            result = await self.supabase.table("agent_result_cache").select("output, model_seconds") \
+                .eq("stage", stage).eq("signature", signature).gt("expires_at", now).execute()
+        except Exception as e:
+            logger.warning("Failed to read the agent result cache: %s", e)
+            return None
+        return (result.data[0]["output"], result.data[0]["model_seconds"]) if result.data else None
+
+    async def _store(self, stage: str, signature: str, output: dict, model_seconds: float) -> None:
+        now = datetime.now(timezone.utc)
+        try:
+            await self.supabase.table("agent_result_cache").upsert({
+                "stage": stage,
+                "signature": signature,
+                "output": output,
+                "model_seconds": model_seconds,
+                "created_at": now.isoformat(),
+                "expires_at": (now + timedelta(hours=self.ttl_hours)).isoformat(),
+            }, on_conflict="stage,signature").execute()
+        except Exception as e:
+            logger.warning("Failed to write the agent result cache: %s", e)
+
+    async def evict_expired(self) -> None:
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            await self.supabase.table("agent_result_cache").delete().lt("expires_at", now).execute()
+        except Exception as e:
+            logger.warning("Failed to evict expired agent results: %s", e)
+
+    def log_stats(self) -> None:
+        lookups = self.hits + self.misses
+        if lookups:
+            logger.info(
+                "Agent result cache: %d hits, %d misses (%.0f %% hit rate), %.1f s of model time saved",
+                self.hits, self.misses, self.hits / lookups * 100, self.saved_seconds
+            )
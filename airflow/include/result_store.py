@@ -0,0 +1,68 @@
+import json
+import os
+from functools import cache
+
+from airflow.sdk import ObjectStoragePath
+
+# Where mapped tasks keep the outputs they pass on by reference, e.g. s3://bucket/results. Every
+# worker must reach it, so a local path only works while all tasks run on one machine. Without
+# it, the outputs go through XCom.
+RESULT_STORE_URL = os.getenv("RESULT_STORE_URL") or None
+# Airflow connection with the credentials of the object store, not needed for local paths
+RESULT_STORE_CONN_ID = os.getenv("RESULT_STORE_CONN_ID") or None
+
+
+class ResultStore:
+    """
+    Agent outputs keyed by Dag run, scan ID and stage, in a local directory or an object store.
+
+    Mapped tasks pass the reference returned by `put` through XCom instead of the output itself.
+    A reference is a few dozen bytes no matter how many toys the inventory holds, so neither the
+    XCom of the producing task nor the rendered arguments of its consumers copy the output into
+    the metadata database. Writing the same run, scan and stage again, e.g. on a retry, replaces
+    it. Another run that claims the scan after its lease expired writes its own.
+    """
+
+    def __init__(self, root):
+        # Anything path-like: `ObjectStoragePath` in Airflow, `pathlib.Path` in tests
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, ref: str):
+        return self.root / f"{ref}.json"
+
+    def put(self, run_id: str, scan_id: str, stage: str, output: dict) -> str:
+        ref = f"{run_id}/{scan_id}.{stage}"
+        path = self._path(ref)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(output))
+        return ref
+
+    def get(self, ref: str) -> dict:
+        return json.loads(self._path(ref).read_text())
+
+    def delete(self, ref: str) -> None:
+        self._path(ref).unlink(missing_ok=True)
+
+
+@cache
+def get_result_store() -> ResultStore | None:
+    """The store at `RESULT_STORE_URL`, None if it isn't set."""
+    if not RESULT_STORE_URL:
+        return None
+    return ResultStore(ObjectStoragePath(RESULT_STORE_URL, conn_id=RESULT_STORE_CONN_ID))
+
+
+def store_output(run_id: str, scan_id: str, stage: str, output: dict) -> dict | str:
+    """What a task returns for its output: a reference into the store, or the output itself without one."""
+    result_store = get_result_store()
+    if result_store is None:
+        return output
+    return result_store.put(run_id, scan_id, stage, output)
+
+
+def load_output(value: dict | str) -> dict:
+    """The output behind a value returned by `store_output`."""
+    if isinstance(value, str):
+        return get_result_store().get(value)
+    return value
@@ -0,0 +1,50 @@
+# The `results_json` payload read by the frontend. Each agent stage fills in its own fields as soon
+# as it is done, the backend serves the partial payload while the scan is `in_flight`.
+
+
+def _merge_roadmap(analysis_result: dict, toy_recommendation: dict) -> list[dict]:
+    roadmap_items = analysis_result.get("roadmap", [])
+    safety_items = toy_recommendation.get("items", [])
+
+    merged_roadmap = []
+    for i, roadmap_item in enumerate(roadmap_items):
+        safety_item = safety_items[i] if i < len(safety_items) else {}
+        merged_roadmap.append({
+            **roadmap_item,
+            "decision": safety_item.get("decision", "APPROVED"),
+            "final_toy": safety_item.get("recommended_toy", roadmap_item.get("recommended_toy")),
+            "safety_context": safety_item.get("safety_context", ""),
+            "amazon_search": safety_item.get("amazon_search", "")
+        })
+    return merged_roadmap
+
+
+def partial_results(stage: str, output: dict, analysis_result: dict | None = None) -> dict:
+    """
+    The fields of `results_json` the output of one agent stage fills in. The safety check merges
+    its decisions into the roadmap of the analysis, so it needs the `analysis_result` as well.
+    Until then, roadmap items have no `decision`.
+    """
+    if stage == "analyze_image":
+        return {"toy_inventory": output.get("items", [])}
+    if stage == "generate_play_quest":
+        return {"play_quest": output}
+    if stage == "analyze_playroom":
+        return {
+            "status_quo": output.get("status_quo", ""),
+            "skill_scores": output.get("skill_scores", {}),
+            "roadmap": output.get("roadmap", [])
+        }
+    if stage == "safety_check":
+        return {"roadmap": _merge_roadmap(analysis_result or {}, output)}
+    raise ValueError(f"Unknown stage {stage}")
+
+
+def build_results(toy_inventory: dict, play_quest: dict, analysis_result: dict, toy_recommendation: dict) -> dict:
+    """Merges the agent outputs into the `results_json` payload read by the frontend."""
+    return {
+        **partial_results("analyze_image", toy_inventory),
+        **partial_results("generate_play_quest", play_quest),
+        **partial_results("analyze_playroom", analysis_result),
+        **partial_results("safety_check", toy_recommendation, analysis_result),
+    }
@@ -0,0 +1,94 @@
+import os
+
+# Scans one Dag run claims at most, a run that leaves a backlog triggers the next one
+SCAN_CLAIM_BATCH_SIZE = int(os.getenv("SCAN_CLAIM_BATCH_SIZE", "20"))
+# Scans of one client per round of a claim, so a heavy uploader can't take a whole batch while others wait
+SCAN_CLAIM_PER_CLIENT = int(os.getenv("SCAN_CLAIM_PER_CLIENT", "5"))
+# A claim is a lease: every stage of the scan renews it, a scan whose lease expires goes back to the queue
+SCAN_LEASE_SECONDS = int(os.getenv("SCAN_LEASE_SECONDS", "1800"))
+# Claims of a scan before it is `failed` for good
+SCAN_MAX_ATTEMPTS = int(os.getenv("SCAN_MAX_ATTEMPTS", "3"))
+
+# Claims a bounded batch of open scans, highest priority first, in rounds across clients: the
+# first round holds the `per_client` oldest scans of every client, the second round the next
+# `per_client` and so on, oldest first within a round. Scans of other clients never wait behind
+# more than `per_client` scans of a heavy uploader, but a lone uploader still fills the batch.
+# The ranking reads all open scans without locking them, only the picked rows are locked.
+# `FOR UPDATE SKIP LOCKED` lets parallel runs claim different scans, rows another run has claimed
+# in the meantime fail the status check and are skipped. Scans without a client rank as their
+# own client. `claim_order` below is the same policy in Python, keep both in sync.
+# The claim leases the scan to the run and counts the attempt. Progress, partial results and error
+# of an earlier attempt are cleared, the frontend shows the new attempt from its start.
+CLAIM_SCANS_SQL = """
+    WITH ranked AS (
+        SELECT id, priority, created_at,
+               row_number() OVER (
+                   PARTITION BY coalesce(client_id, id::text)
+                   ORDER BY priority DESC, created_at
+               ) AS client_rank
+        FROM public.scans
+        WHERE status = 'processing'
+    ), picked AS (
+        SELECT s.id
+        FROM public.scans s
+        JOIN ranked r ON r.id = s.id
+        WHERE s.status = 'processing'
+        ORDER BY r.priority DESC, (r.client_rank - 1) / %(per_client)s, r.created_at
+        LIMIT %(batch_size)s
+        FOR UPDATE OF s SKIP LOCKED
+    )
+    UPDATE public.scans s
+    SET status = 'in_flight', dag_run_id = %(run_id)s, worker_id = %(worker_id)s, attempts = s.attempts + 1,
+        claimed_at = now(), lease_expires_at = now() + make_interval(secs => %(lease_seconds)s), error = NULL,
+        progress = NULL, results_json = NULL
+    FROM picked
+    WHERE s.id = picked.id
+    RETURNING s.id, s.image_path, s.child_age;
+"""
+
+# Hands scans of a task that failed for good back to the queue, or fails them after their last
+# attempt. An error the pipeline recorded for the scan itself wins over the error of the task.
+# Only the run holding the claim releases a scan, not a stale run whose scan has been reclaimed since.
+RELEASE_SCANS_SQL = """
+    UPDATE public.scans
+    SET status = CASE WHEN attempts >= %(max_attempts)s THEN 'failed' ELSE 'processing' END,
+        error = coalesce(error, %(error)s), lease_expires_at = NULL, worker_id = NULL
+    WHERE id = ANY(%(scan_ids)s::uuid[]) AND status = 'in_flight' AND dag_run_id = %(run_id)s
+    RETURNING id, status;
+"""
+
+# Runs holding scans with an expired lease. The reaper asks Airflow which of them are still active.
+EXPIRED_LEASE_RUNS_SQL = """
+    SELECT DISTINCT dag_run_id
+    FROM public.scans
+    WHERE status = 'in_flight' AND coalesce(lease_expires_at, '-infinity') < now() AND dag_run_id IS NOT NULL;
+"""
+
+# Same as the release for scans whose worker died without releasing them. Scans claimed before
+# leases existed have none and count as expired. Scans of the `active_run_ids` are skipped: in
+# `mapped` mode a healthy run's scans can wait for a task slot longer than the lease, and a run that
+# is still going hands its scans back itself if a task fails for good.
+REAP_EXPIRED_SQL = """
+    UPDATE public.scans
+    SET status = CASE WHEN attempts >= %(max_attempts)s THEN 'failed' ELSE 'processing' END,
+        error = 'Lease of ' || coalesce(worker_id, 'unknown worker') || ' expired',
+        lease_expires_at = NULL, worker_id = NULL
+    WHERE status = 'in_flight' AND coalesce(lease_expires_at, '-infinity') < now()
+        AND (dag_run_id IS NULL OR dag_run_id <> ALL(%(active_run_ids)s::text[]))
+    RETURNING id, status;
+"""
+
+
+def claim_order(scans: list[dict], batch_size: int = SCAN_CLAIM_BATCH_SIZE, per_client: int = SCAN_CLAIM_PER_CLIENT) -> list[dict]:
+    """
+    The scans `CLAIM_SCANS_SQL` picks from the open `scans`, in claim order. Used by the queue
+    simulator, each scan needs `id`, `client_id`, `priority` and `created_at`.
+    """
+    ranks: dict[str, int] = {}
+    ranked = []
+    for scan in sorted(scans, key=lambda s: (-s["priority"], s["created_at"])):
+        client = scan["client_id"] or str(scan["id"])
+        ranks[client] = ranks.get(client, 0) + 1
+        ranked.append(((-scan["priority"], (ranks[client] - 1) // per_client, scan["created_at"]), scan))
+    ranked.sort(key=lambda item: item[0])
+    return [scan for _, scan in ranked[:batch_size]]
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timezone
+from functools import cache
+
+from airflow.providers.postgres.hooks.postgres import PostgresHook
+
+from include.metrics import new_stage_metrics
+from include.result_store import load_output
+from include.results import partial_results
+from include.scan_queue import (
+    CLAIM_SCANS_SQL,
+    EXPIRED_LEASE_RUNS_SQL,
+    REAP_EXPIRED_SQL,
+    RELEASE_SCANS_SQL,
+    SCAN_CLAIM_BATCH_SIZE,
+    SCAN_CLAIM_PER_CLIENT,
+    SCAN_LEASE_SECONDS,
+    SCAN_MAX_ATTEMPTS,
+)
+
+_POSTGRES_CONN_ID = "postgres_playroom_diet"
+
+PROCESS_SCANS_DAG_ID = "process_scans"
+ACTIVE_RUN_STATES = ("queued", "running")
+
+logger = logging.getLogger(__name__)
+
+
+class ScanDatabase:
+    """
+    One autocommit connection per task process for all its scan updates. In `pipelined` and
+    `batched` mode every stage of every scan marks its progress twice, a new connection per update
+    meant a handshake and a Postgres backend each, in bursts of `SCAN_BATCH_CONCURRENCY` scans.
+    Statements of concurrent threads take turns, a connection that failed is replaced by the next one.
+    """
+
+    def __init__(self, conn_id: str = _POSTGRES_CONN_ID):
+        self.conn_id = conn_id
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def run(self, sql: str, parameters=None) -> list:
+        """Runs one statement and returns its rows, none for statements without a result."""
+        with self._lock:
+            # A forked process must not share the socket of its parent
+            if self._connection is None or self._connection.closed or self._pid != os.getpid():
+                self._connection = PostgresHook(postgres_conn_id=self.conn_id).get_conn()
+                self._connection.autocommit = True
+                self._pid = os.getpid()
+            try:
+                with self._connection.cursor() as cursor:
+                    cursor.execute(sql, parameters)
+                    return cursor.fetchall() if cursor.description else []
+            except Exception:
+                # May have been a broken connection, the next statement opens a new one
+                self._connection.close()
+                self._connection = None
+                raise
+
+
+@cache
+def get_scan_db() -> ScanDatabase:
+    return ScanDatabase()
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_scans(run_id: str) -> list[list]:
+    """Claims the next batch of open scans for a Dag run, see `include/scan_queue.py`."""
+    rows = get_scan_db().run(CLAIM_SCANS_SQL, {
+        "batch_size": SCAN_CLAIM_BATCH_SIZE, "per_client": SCAN_CLAIM_PER_CLIENT, "run_id": run_id,
+        "worker_id": worker_id(), "lease_seconds": SCAN_LEASE_SECONDS,
+    })
+    return [[str(scan_id), image_path, child_age] for scan_id, image_path, child_age in rows]
+
+
+def release_scans(scan_ids: list[str], error: str, run_id: str) -> list:
+    rows = get_scan_db().run(
+        RELEASE_SCANS_SQL, {"scan_ids": scan_ids, "error": error, "max_attempts": SCAN_MAX_ATTEMPTS, "run_id": run_id}
+    )
+    _log_released("Released", rows)
+    return rows
+
+
+def reap_expired_leases(ti) -> list:
+    """
+    Hands back the scans with an expired lease, except those of `process_scans` runs that are
+    still queued or running. `ti` is the task instance of the reaper, which asks for the run states.
+    """
+    run_ids = [run_id for run_id, in get_scan_db().run(EXPIRED_LEASE_RUNS_SQL)]
+    active_run_ids = [run_id for run_id in run_ids if _run_state(ti, run_id) in ACTIVE_RUN_STATES]
+    if active_run_ids:
+        logger.info("Expired leases of %d active runs left to their runs: %s", len(active_run_ids), active_run_ids)
+    rows = get_scan_db().run(REAP_EXPIRED_SQL, {"max_attempts": SCAN_MAX_ATTEMPTS, "active_run_ids": active_run_ids})
+    _log_released("Reaped expired leases of", rows)
+    return rows
+
+
+def _run_state(ti, run_id: str) -> str | None:
+    try:
+        return ti.get_dagrun_state(dag_id=PROCESS_SCANS_DAG_ID, run_id=run_id)
+    except Exception as e:
+        # E.g. a run deleted in the meantime, its scans are reaped like those of an ended run
+        logger.warning("Failed to get the state of run %s: %s", run_id, e)
+        return None
+
+
+def should_trigger_process_scans(ti) -> bool:
+    """
+    True if open scans are waiting and no run of `process_scans` is queued. A queued run claims
+    them when it starts, another one would pile up behind it and find nothing left to claim.
+    """
+    if ti.get_dr_count(dag_id=PROCESS_SCANS_DAG_ID, states=["queued"]):
+        return False
+    return get_scan_db().run("SELECT EXISTS (SELECT 1 FROM public.scans WHERE status = 'processing');")[0][0]
+
+
+def _log_released(action: str, rows: list) -> None:
+    failed = [str(scan_id) for scan_id, status in rows if status == "failed"]
+    if rows:
+        logger.warning("%s %d scans: %d back in the queue, %d failed after %d attempts %s",
+                       action, len(rows), len(rows) - len(failed), len(failed), SCAN_MAX_ATTEMPTS, failed)
+
+
+def mark_progress(scan_id: str, run_id: str, stage: str, state: str, results: dict | None = None) -> None:
+    """
+    Merges the state of one agent stage into the scan's `progress` map, and the `results` fields
+    its output fills in into `results_json`, in the same update so both appear together.
+    The backend streams the progress to the frontend via server-sent events.
+    Every update also renews the lease of the scan, as long as the run `run_id` still holds it.
+    A run whose scan was reaped and claimed by another run no longer touches it.
+    """
+    # Without results, `results_json` stays as it is, NULL until the first stage is done
+    results_json = json.dumps(results) if results else None
+    get_scan_db().run(
+        """
+            UPDATE public.scans
+            SET progress = COALESCE(progress, '{}'::jsonb) || jsonb_build_object(%s::text, %s::text),
+                results_json = COALESCE(results_json || %s::jsonb, results_json, %s::jsonb),
+                lease_expires_at = now() + make_interval(secs => %s)
+            WHERE id = %s AND dag_run_id = %s AND status = 'in_flight';
+        """,
+        (stage, state, results_json, results_json, SCAN_LEASE_SECONDS, scan_id, run_id),
+    )
+
+
+def record_metrics(scan_id: str, run_id: str, stage: str, metrics: dict) -> None:
+    """Merges the metrics of one agent stage into the scan's `metrics` map, like `mark_progress`."""
+    get_scan_db().run(
+        """
+            UPDATE public.scans
+            SET metrics = COALESCE(metrics, '{}'::jsonb) || jsonb_build_object(%s::text, %s::jsonb)
+            WHERE id = %s AND dag_run_id = %s;
+        """,
+        (stage, json.dumps(metrics), scan_id, run_id),
+    )
+
+
+def _scan_id_from_context(context) -> str:
+    # Mapped tasks receive either the scan record itself, or a zipped tuple with the scan record last
+    op_kwargs = context["task"].op_kwargs
+    scan_record = op_kwargs["scan_record"] if "scan_record" in op_kwargs else op_kwargs["zipped_input"][-1]
+    return str(scan_record[0])
+
+
+def on_scan_failure(context) -> None:
+    """
+    Failure callback of the tasks processing scans, called once their retries are used up. Their
+    scans go back to the queue right away instead of waiting for the lease to expire.
+    """
+    op_kwargs = context["task"].op_kwargs
+    if "scan_records" in op_kwargs:
+        scan_ids = [str(record[0]) for record in op_kwargs["scan_records"]]
+    else:
+        scan_ids = [_scan_id_from_context(context)]
+    exception = context.get("exception")
+    error = f"{context['task'].task_id}: {type(exception).__name__}: {exception}" if exception else f"{context['task'].task_id} failed"
+    try:
+        release_scans(scan_ids, error, context["run_id"])
+    except Exception as e:
+        # The lease expires anyway, the reaper picks the scans up then
+        logger.warning("Failed to release scans: %s", e)
+
+
+def _stage_results(context) -> dict | None:
+    # The output of the task instance, pushed to XCom before its success callback runs
+    ti = context["ti"]
+    output = ti.xcom_pull(task_ids=ti.task_id, map_indexes=ti.map_index)
+    if not output:
+        return None
+    # May be a reference into the result store, see `analyze_image`
+    output = load_output(output)
+    # The safety check gets the analysis zipped with its scan record
+    analysis_result = context["task"].op_kwargs["zipped_input"][0] if ti.task_id == "safety_check" else None
+    return partial_results(ti.task_id, output, analysis_result)
+
+
+def _mark_stage(context, state: str) -> None:
+    # Progress is best effort, it must never fail the actual agent task
+    try:
+        results = _stage_results(context) if state == "done" else None
+        mark_progress(_scan_id_from_context(context), context["run_id"], context["task"].task_id, state, results)
+    except Exception as e:
+        logger.warning("Failed to mark progress: %s", e)
+
+
+def on_stage_start(context) -> None:
+    _mark_stage(context, "running")
+
+
+def on_stage_success(context) -> None:
+    _mark_stage(context, "done")
+
+
+def on_agent_success(context) -> None:
+    """
+    Success callback of the `@task.agent` tasks. The operator doesn't expose the usage of its
+    agent run, so only the wall time and the model of the stage are recorded.
+    """
+    _mark_stage(context, "done")
+    try:
+        start_date = context["ti"].start_date
+        record_metrics(_scan_id_from_context(context), context["run_id"], context["task"].task_id, {
+            **new_stage_metrics(),
+            "seconds": (datetime.now(timezone.utc) - start_date).total_seconds() if start_date else 0.0,
+            "model": getattr(context["task"], "model_id", None),
+        })
+    except Exception as e:
+        logger.warning("Failed to record metrics: %s", e)
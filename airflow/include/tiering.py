@@ -0,0 +1,76 @@
+import logging
+import os
+import re
+from functools import cache
+
+logger = logging.getLogger(__name__)
+
+# With tiering, `analyze_playroom` runs on Flash first and escalates to Pro only when needed
+ANALYSIS_TIERING = os.getenv("ANALYSIS_TIERING", "false").lower() in ("1", "true", "yes")
+# Inventories with more entries than this go to Pro right away, a Flash attempt would rarely pass
+ANALYSIS_TIER_MAX_TOYS = int(os.getenv("ANALYSIS_TIER_MAX_TOYS", "25"))
+
+ROADMAP_TIMEFRAMES = ("now", "3_months", "6_months")
+SKILL_CATEGORIES = ("cognitive", "motor_fine", "motor_gross", "social_emotional", "creative", "language")
+# O*NET abilities are element IDs 1.A.<group>.<subgroup>.<number>, e.g. 1.A.1.f.2
+ONET_ABILITY_ID = re.compile(r"1\.A\.[1-4]\.[a-z]\.\d{1,2}")
+
+
+def inventory_complexity(toy_inventory: dict) -> int:
+    """Entries of the inventory, a cluster of similar toys counts once."""
+    return len(toy_inventory.get("items", []))
+
+
+def validate_analysis(analysis_result: dict) -> list[str]:
+    """
+    What's wrong with an `AnalysisResult` beyond its schema, empty if nothing: a roadmap of
+    exactly 3 items with the priorities and timeframes of the instructions, O*NET ability IDs
+    and known skill categories, and scores between 0 and 100 that actually tell skills apart.
+    """
+    problems = []
+    roadmap = analysis_result.get("roadmap", [])
+    if len(roadmap) != 3:
+        problems.append(f"{len(roadmap)} roadmap items instead of 3")
+    elif [(item.get("priority"), item.get("timeframe")) for item in roadmap] != list(enumerate(ROADMAP_TIMEFRAMES, start=1)):
+        problems.append("roadmap priorities or timeframes out of order")
+    for item in roadmap:
+        if not ONET_ABILITY_ID.fullmatch(item.get("skill_id", "")):
+            problems.append(f"invalid O*NET ability ID {item.get('skill_id')!r}")
+        if item.get("skill_category") not in SKILL_CATEGORIES:
+            problems.append(f"unknown skill category {item.get('skill_category')!r}")
+
+    scores = analysis_result.get("skill_scores", {})
+    values = [scores.get(category) for category in SKILL_CATEGORIES]
+    if any(not isinstance(value, int) or not 0 <= value <= 100 for value in values):
+        problems.append(f"skill scores outside of 0-100: {scores}")
+    elif len(set(values)) == 1:
+        problems.append(f"all skill scores are {values[0]}")
+    return problems
+
+
+class TierStats:
+    """Analyses served per tier, and why they were escalated, logged at the end of each batch."""
+
+    def __init__(self):
+        self.served: dict[tuple[str, str | None], list[float]] = {}
+
+    def record(self, tier: str, escalation: str | None, seconds: float) -> None:
+        self.served.setdefault((tier, escalation), []).append(seconds)
+
+    def log_stats(self) -> None:
+        total = sum(len(samples) for samples in self.served.values())
+        if not total:
+            return
+        escalated = sum(len(samples) for (_, escalation), samples in self.served.items() if escalation)
+        logger.info(
+            "Analyses: %d, %.0f%% escalated to Pro. %s", total, escalated / total * 100, ", ".join(
+                f"{tier}{f' ({escalation})' if escalation else ''} {len(samples)}, {sum(samples) / len(samples):.1f} s on average"
+                for (tier, escalation), samples in sorted(self.served.items(), key=lambda item: (item[0][0], item[0][1] or ""))
+            )
+        )
+
+
+@cache
+def get_tier_stats() -> TierStats:
+    """One per task process, like the agent limiter."""
+    return TierStats()
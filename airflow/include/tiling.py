@@ -0,0 +1,149 @@
+import os
+from io import BytesIO
+from typing import NamedTuple
+
+from PIL import Image, ImageOps
+
+# Tiled vision inference for large, cluttered photos: 1 sends the whole image in one call,
+# N splits it into an N x N grid of overlapping tiles that are analyzed concurrently
+VISION_TILE_GRID = int(os.getenv("VISION_TILE_GRID", "1"))
+# Each tile extends into its neighbours by this fraction of its size, so toys on a seam are whole in at least one tile
+VISION_TILE_OVERLAP = float(os.getenv("VISION_TILE_OVERLAP", "0.15"))
+# Smaller images are analyzed in one call, tiles of them would lose too much context
+VISION_TILE_MIN_EDGE = int(os.getenv("VISION_TILE_MIN_EDGE", "1600"))
+VISION_TILE_IOU_THRESHOLD = float(os.getenv("VISION_TILE_IOU_THRESHOLD", "0.5"))
+# A box cut by a tile edge that lies this much within a kept box is the same toy, whatever the IoU
+VISION_TILE_CONTAINMENT_THRESHOLD = float(os.getenv("VISION_TILE_CONTAINMENT_THRESHOLD", "0.8"))
+# Boxes of the model are not pixel exact, one this close to a tile edge counts as cut by it
+_EDGE_MARGIN = 0.02
+
+
+class Tile(NamedTuple):
+    """Pixel box of a tile within the full image, right and bottom exclusive."""
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+
+def image_size(image_bytes: bytes) -> tuple[int, int]:
+    # Only reads the header
+    with Image.open(BytesIO(image_bytes)) as image:
+        return image.size
+
+
+def should_tile(width: int, height: int, grid: int = VISION_TILE_GRID, min_edge: int = VISION_TILE_MIN_EDGE) -> bool:
+    return grid > 1 and max(width, height) >= min_edge
+
+
+def tile_grid(width: int, height: int, grid: int, overlap: float) -> list[Tile]:
+    tile_width, tile_height = width / grid, height / grid
+    pad_x, pad_y = tile_width * overlap, tile_height * overlap
+    return [
+        Tile(
+            max(0, round(col * tile_width - pad_x)),
+            max(0, round(row * tile_height - pad_y)),
+            min(width, round((col + 1) * tile_width + pad_x)),
+            min(height, round((row + 1) * tile_height + pad_y)),
+        )
+        for row in range(grid)
+        for col in range(grid)
+    ]
+
+
+def crop_tiles(image_bytes: bytes, grid: int, overlap: float, quality: int = 90) -> tuple[tuple[int, int], list[tuple[Tile, bytes]]]:
+    """Returns the size of the upright image and its tiles as JPEG."""
+    with Image.open(BytesIO(image_bytes)) as image:
+        # Same orientation as the full image shown in the frontend
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        tiles = []
+        for tile in tile_grid(image.width, image.height, grid, overlap):
+            buffer = BytesIO()
+            image.crop(tile).save(buffer, "JPEG", quality=quality)
+            tiles.append((tile, buffer.getvalue()))
+        return image.size, tiles
+
+
+def to_global(bbox: dict, tile: Tile, width: int, height: int) -> dict:
+    """Maps a bounding box normalized to a tile to one normalized to the full image."""
+    tile_width, tile_height = tile.right - tile.left, tile.bottom - tile.top
+    return {
+        "x": (tile.left + bbox["x"] * tile_width) / width,
+        "y": (tile.top + bbox["y"] * tile_height) / height,
+        "w": bbox["w"] * tile_width / width,
+        "h": bbox["h"] * tile_height / height,
+    }
+
+
+def area(bbox: dict) -> float:
+    return max(0.0, bbox["w"]) * max(0.0, bbox["h"])
+
+
+def intersection(a: dict, b: dict) -> float:
+    overlap_w = min(a["x"] + a["w"], b["x"] + b["w"]) - max(a["x"], b["x"])
+    overlap_h = min(a["y"] + a["h"], b["y"] + b["h"]) - max(a["y"], b["y"])
+    if overlap_w <= 0 or overlap_h <= 0:
+        return 0.0
+    return overlap_w * overlap_h
+
+
+def iou(a: dict, b: dict) -> float:
+    shared = intersection(a, b)
+    return shared / (area(a) + area(b) - shared) if shared else 0.0
+
+
+def containment(a: dict, b: dict) -> float:
+    """Share of the smaller box that lies within the other one."""
+    smaller = min(area(a), area(b))
+    return intersection(a, b) / smaller if smaller else 0.0
+
+
+def is_cut(bbox: dict, tile: Tile, width: int, height: int) -> bool:
+    """Whether a box normalized to a tile touches one of its edges inside the image, i.e. a seam."""
+    return (
+        (tile.left > 0 and bbox["x"] <= _EDGE_MARGIN)
+        or (tile.top > 0 and bbox["y"] <= _EDGE_MARGIN)
+        or (tile.right < width and bbox["x"] + bbox["w"] >= 1 - _EDGE_MARGIN)
+        or (tile.bottom < height and bbox["y"] + bbox["h"] >= 1 - _EDGE_MARGIN)
+    )
+
+
+def non_max_suppression(
+    items: list[dict],
+    iou_threshold: float = VISION_TILE_IOU_THRESHOLD,
+    containment_threshold: float = VISION_TILE_CONTAINMENT_THRESHOLD,
+    cut: list[bool] | None = None,
+) -> list[dict]:
+    """
+    Drops detections whose box overlaps a kept one by at least `iou_threshold`, or that are cut
+    by a tile edge and lie within a kept one by at least `containment_threshold`.
+
+    The model reports no confidence, so larger boxes win: a toy cut by a tile edge is seen
+    partially in one tile and whole in the overlapping one. The part can be much smaller than
+    the whole toy, hence the containment check. It only applies to boxes in `cut`, all if None,
+    so a small toy lying on a play mat is kept. Categories are ignored, tiles may name the same
+    toy differently.
+    """
+    cut = cut if cut is not None else [True] * len(items)
+    kept = []
+    for index in sorted(range(len(items)), key=lambda index: area(items[index]["bbox"]), reverse=True):
+        bbox = items[index]["bbox"]
+        if any(
+            iou(bbox, other["bbox"]) >= iou_threshold
+            or (cut[index] and containment(bbox, other["bbox"]) >= containment_threshold)
+            for other in kept
+        ):
+            continue
+        kept.append(items[index])
+    return kept
+
+
+def merge_tile_items(tile_items: list[tuple[Tile, list[dict]]], width: int, height: int, iou_threshold: float = VISION_TILE_IOU_THRESHOLD) -> list[dict]:
+    """Combines the inventories of all tiles into one, in global coordinates and without seam duplicates."""
+    items, cut = [], []
+    for tile, tile_inventory in tile_items:
+        for item in tile_inventory:
+            items.append({**item, "bbox": to_global(item["bbox"], tile, width, height)})
+            cut.append(is_cut(item["bbox"], tile, width, height))
+    # Reading order, like the inventory of a single call
+    return sorted(non_max_suppression(items, iou_threshold, cut=cut), key=lambda item: (item["bbox"]["y"], item["bbox"]["x"]))
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from pydantic_ai.exceptions import ModelHTTPError
+
+from include.concurrency import AdaptiveLimiter
+
+
+class ThrottlingModel:
+    """Answers `capacity` concurrent calls, more are rejected with a 429 like an exhausted quota."""
+
+    def __init__(self, capacity: int | None, latency: float = 0.01, latency_per_call: float = 0.0):
+        self.capacity, self.latency, self.latency_per_call = capacity, latency, latency_per_call
+        self.in_flight = 0
+        self.rejected = 0
+
+    async def call(self) -> str:
+        self.in_flight += 1
+        try:
+            if self.capacity is not None and self.in_flight > self.capacity:
+                self.rejected += 1
+                await asyncio.sleep(0.001)
+                raise ModelHTTPError(429, "gemini", {"error": "RESOURCE_EXHAUSTED"})
+            # Overloaded endpoints answer slower the more calls they serve at once
+            await asyncio.sleep(self.latency + self.latency_per_call * self.in_flight)
+            return "ok"
+        finally:
+            self.in_flight -= 1
+
+
+def _run(limiter: AdaptiveLimiter, model: ThrottlingModel, calls: int) -> list[str]:
+    async def scenario():
+        return await asyncio.gather(*(limiter.run("analyze_image", model.call) for _ in range(calls)))
+
+    return asyncio.run(scenario())
+
+
+def test_limit_grows_while_healthy_up_to_the_maximum():
+    limiter = AdaptiveLimiter(initial=1, maximum=8, backoff_seconds=0.001)
+
+    assert _run(limiter, ThrottlingModel(capacity=None), 200) == ["ok"] * 200
+    assert int(limiter.limit) == 8
+    assert limiter.peak_in_flight == 8
+    assert limiter.throttled == limiter.congested == 0
+
+
+def test_limit_backs_off_and_settles_below_the_quota():
+    limiter = AdaptiveLimiter(initial=16, maximum=32, retries=10, backoff_seconds=0.001)
+    model = ThrottlingModel(capacity=6)
+
+    assert _run(limiter, model, 300) == ["ok"] * 300
+    assert limiter.throttled == model.rejected > 0
+    assert limiter.lowest_limit < 6
+    # After the first burst of 429s, throttles are rare probes at the edge of the quota
+    assert model.rejected < 60
+    assert 3 <= int(limiter.limit) <= 7
+
+
+def test_slow_responses_stop_the_growth_without_any_429():
+    limiter = AdaptiveLimiter(initial=2, maximum=32, latency_tolerance=2.0, backoff_seconds=0.001)
+    model = ThrottlingModel(capacity=None, latency=0.005, latency_per_call=0.005)
+
+    _run(limiter, model, 300)
+
+    assert limiter.throttled == 0
+    assert limiter.congested > 0
+    assert limiter.highest_limit < 32
+
+
+def test_throttling_beyond_the_retries_raises():
+    limiter = AdaptiveLimiter(initial=1, retries=2, backoff_seconds=0.001)
+
+    with pytest.raises(ModelHTTPError):
+        _run(limiter, ThrottlingModel(capacity=0), 1)
+    assert (limiter.throttled, limiter.in_flight) == (3, 0)
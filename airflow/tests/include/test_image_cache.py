@@ -0,0 +1,38 @@
+import httpx
+
+from include.image_cache import ImageCache
+
+
+def _cache(tmp_path, max_bytes=1024):
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        return httpx.Response(200, content=request.url.path.encode() * 100)
+
+    return ImageCache(tmp_path, max_bytes, httpx.Client(transport=httpx.MockTransport(handler))), requests
+
+
+def test_hits_disk_after_first_download(tmp_path):
+    cache, requests = _cache(tmp_path, max_bytes=10_000)
+
+    first = cache.read("https://storage/scans/a.jpg", "scans/a.jpg")
+    second = cache.read("https://storage/scans/a.jpg", "scans/a.jpg")
+
+    assert first == second == b"/scans/a.jpg" * 100
+    assert requests == ["/scans/a.jpg"]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    # Each image is 1500 bytes, the cache holds two of them
+    cache, requests = _cache(tmp_path, max_bytes=3500)
+
+    cache.read("https://storage/scans/aaaa.jpg", "aaaa")
+    cache.read("https://storage/scans/bbbb.jpg", "bbbb")
+    cache.read("https://storage/scans/aaaa.jpg", "aaaa")
+    cache.read("https://storage/scans/cccc.jpg", "cccc")
+    cache.read("https://storage/scans/aaaa.jpg", "aaaa")
+    cache.read("https://storage/scans/bbbb.jpg", "bbbb")
+
+    assert requests == ["/scans/aaaa.jpg", "/scans/bbbb.jpg", "/scans/cccc.jpg", "/scans/bbbb.jpg"]
+    assert sum(path.stat().st_size for path in tmp_path.iterdir()) <= 3500
@@ -0,0 +1,49 @@
+from include import onet
+from include.onet import OnetIndex
+
+ABILITIES = """O*NET-SOC Code\tElement ID\tElement Name\tScale ID\tData Value\tN\tStandard Error\tLower CI Bound\tUpper CI Bound\tRecommend Suppress\tNot Relevant\tDate\tDomain Source
+29-1022.00\t1.A.2.a.2\tManual Dexterity\tLV\t5.12\t8\t0.2\t4.7\t5.5\tN\tN\t08/2023\tAnalyst
+29-1022.00\t1.A.2.a.2\tManual Dexterity\tIM\t4.50\t8\t0.2\t4.1\t4.9\tN\tN\t08/2023\tAnalyst
+29-1021.00\t1.A.2.a.2\tManual Dexterity\tLV\t4.88\t8\t0.2\t4.5\t5.2\tN\tN\t08/2023\tAnalyst
+11-1011.00\t1.A.2.a.2\tManual Dexterity\tLV\t1.20\t8\t0.2\t0.9\t1.5\tN\tN\t08/2023\tAnalyst
+11-1011.00\t1.A.1.f.2\tVisualization\tLV\t3.00\t8\t0.2\t2.7\t3.3\tN\tN\t08/2023\tAnalyst
+"""
+
+OCCUPATIONS = """O*NET-SOC Code\tTitle\tDescription
+29-1022.00\tOral and Maxillofacial Surgeons\tPerform surgery.
+29-1021.00\tDentists, General\tExamine teeth.
+11-1011.00\tChief Executives\tPlan strategy.
+"""
+
+
+def _write_release(path):
+    (path / onet.ABILITIES_FILE).write_text(ABILITIES)
+    (path / onet.OCCUPATIONS_FILE).write_text(OCCUPATIONS)
+
+
+def test_index_keeps_top_occupations_by_level(tmp_path):
+    _write_release(tmp_path)
+    index = OnetIndex.from_files(tmp_path / onet.ABILITIES_FILE, tmp_path / onet.OCCUPATIONS_FILE)
+
+    # Importance (IM) rows and levels at or below the threshold are ignored, like in the SQL function
+    assert index.careers("Manual Dexterity") == ("Oral and Maxillofacial Surgeons", "Dentists, General")
+    assert index.careers("Visualization") == ()
+    assert index.careers("Unknown") == ()
+
+
+def _no_rpc():
+    raise AssertionError("The RPC must not be used when the index is available")
+
+
+def test_get_careers_for_skill_uses_local_index(tmp_path, monkeypatch):
+    _write_release(tmp_path)
+    monkeypatch.setattr(onet, "ONET_DATA_DIR", tmp_path)
+    monkeypatch.setattr(onet, "get_supabase", _no_rpc)
+    onet.load_index.cache_clear()
+    onet._careers_for_skill.cache_clear()
+
+    try:
+        assert onet.get_careers_for_skill("Manual Dexterity") == ["Oral and Maxillofacial Surgeons", "Dentists, General"]
+    finally:
+        onet.load_index.cache_clear()
+        onet._careers_for_skill.cache_clear()
@@ -0,0 +1,208 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from include import pipeline
+
+
+class FakeQuery:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def select(self, *columns):
+        return self
+
+    def in_(self, column, values):
+        self.rows = [row for row in self.rows if row[column] in values]
+        return self
+
+    def update(self, values):
+        self.rows.append({"update": values})
+        return self
+
+    def eq(self, column, value):
+        self.rows = [row for row in self.rows if row.get(column) == value]
+        return self
+
+    async def execute(self):
+        return SimpleNamespace(data=self.rows)
+
+
+class FakeSupabase:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        return FakeQuery(self.rows)
+
+
+def _patch(monkeypatch, rows, run_scan):
+    async def fake_client(url, key):
+        return FakeSupabase(rows)
+
+    monkeypatch.setattr(pipeline, "acreate_client", fake_client)
+    monkeypatch.setattr(pipeline, "create_scan_agents", lambda: None)
+    monkeypatch.setattr(pipeline, "run_scan", run_scan)
+    monkeypatch.setattr(pipeline, "AGENT_CACHE_TTL_HOURS", 0)
+
+
+def test_process_batch_isolates_failing_scans(monkeypatch):
+    processed = []
+
+    async def run_scan(agents, supabase, scan_record, run_id, cache=None):
+        if scan_record[0] == "b":
+            raise ValueError("model error")
+        processed.append(scan_record[0])
+
+    rows = [{"id": scan_id, "status": "in_flight", "dag_run_id": "run-1"} for scan_id in "abc"]
+    _patch(monkeypatch, rows, run_scan)
+
+    with pytest.raises(RuntimeError, match="1 of 3 scans failed: b"):
+        asyncio.run(pipeline.process_batch([("a", "a.jpg", 4), ("b", "b.jpg", 5), ("c", "c.jpg", 6)], concurrency=2, run_id="run-1"))
+
+    assert sorted(processed) == ["a", "c"]
+    assert {"update": {"error": "ValueError: model error"}} in rows
+
+
+def test_process_batch_skips_scans_done_by_a_previous_try_or_claimed_by_another_run(monkeypatch):
+    processed = []
+
+    async def run_scan(agents, supabase, scan_record, run_id, cache=None):
+        processed.append(scan_record[0])
+
+    _patch(monkeypatch, [
+        {"id": "a", "status": "done", "dag_run_id": "run-1"},
+        {"id": "b", "status": "in_flight", "dag_run_id": "run-1"},
+        # Reaped after its lease expired and claimed again
+        {"id": "c", "status": "in_flight", "dag_run_id": "run-2"},
+    ], run_scan)
+
+    asyncio.run(pipeline.process_batch([("a", "a.jpg", 4), ("b", "b.jpg", 5), ("c", "c.jpg", 6)], concurrency=2, run_id="run-1"))
+
+    assert processed == ["b"]
+
+
+class FakeAgent:
+    def __init__(self, name, delay, output, log):
+        self.name, self.delay, self.output, self.log = name, delay, output, log
+
+    async def run(self, prompt):
+        self.log.append(("start", self.name))
+        await asyncio.sleep(self.delay)
+        self.log.append(("end", self.name))
+        return SimpleNamespace(
+            output=SimpleNamespace(model_dump=lambda: self.output),
+            response=SimpleNamespace(model_name=f"model-{self.name}"),
+            usage=lambda: SimpleNamespace(requests=1, input_tokens=100, output_tokens=20, details={"thoughts_tokens": 50}, tool_calls=1),
+        )
+
+
+def test_run_scan_runs_independent_agents_concurrently(monkeypatch):
+    partial = []
+
+    async def record_progress(scan_id, run_id, stage, state, results=None):
+        if results:
+            partial.append((stage, results))
+
+    monkeypatch.setattr(pipeline, "_mark_progress", record_progress)
+    monkeypatch.setattr(pipeline, "get_image_bytes", lambda image_path: b"image")
+    log = []
+    agents = pipeline.ScanAgents(
+        vision=FakeAgent("vision", 0.01, {"items": []}, log),
+        play_quest=FakeAgent("play_quest", 0.2, {"title": "Quest"}, log),
+        analysis=FakeAgent("analysis", 0.05, {"roadmap": []}, log),
+        safety=FakeAgent("safety", 0.05, {"items": []}, log),
+    )
+    supabase = FakeSupabase([])
+
+    timings = asyncio.run(pipeline.run_scan(agents, supabase, ("a", "a.jpg", 4), "run-1"))
+
+    # Analysis and play quest start right after vision, safety doesn't wait for the play quest
+    assert log[:3] == [("start", "vision"), ("end", "vision"), ("start", "play_quest")]
+    assert log.index(("end", "safety")) < log.index(("end", "play_quest"))
+    assert timings["end_to_end"] < sum(timings[stage] for stage in ("analyze_image", "generate_play_quest", "analyze_playroom", "safety_check"))
+    update = supabase.rows[0]["update"]
+    assert update["status"] == "done"
+    # Every stage stored its part of the result when it was done, the inventory first
+    assert [stage for stage, _ in partial] == ["analyze_image", "analyze_playroom", "safety_check", "generate_play_quest"]
+    assert partial[0][1] == {"toy_inventory": []}
+    merged = {}
+    for _, results in partial:
+        merged.update(results)
+    assert merged == update["results_json"]
+    assert update["metrics"]["safety_check"] == {
+        "seconds": timings["safety_check"], "model": "model-safety", "requests": 1,
+        "input_tokens": 100, "output_tokens": 20, "thinking_tokens": 50, "tool_calls": 1, "throttled": 0,
+    }
+
+
+def test_detect_toys_runs_tiles_concurrently_and_merges_them(monkeypatch):
+    from io import BytesIO
+
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new("RGB", (2000, 1000)).save(buffer, "JPEG")
+    monkeypatch.setattr(pipeline, "VISION_TILE_GRID", 2)
+    log = []
+
+    class TileAgent(FakeAgent):
+        async def run(self, prompt):
+            first_tile = not self.log
+            result = await super().run(prompt)
+            # Every tile reports a toy at its top left, the first tile also a toy on its right seam
+            items = [{"item_name": "Block", "bbox": {"x": 0.0, "y": 0.0, "w": 0.1, "h": 0.1}}]
+            if first_tile:
+                items.append({"item_name": "Car", "bbox": {"x": 0.85, "y": 0.5, "w": 0.15, "h": 0.1}})
+            result.output.model_dump = lambda: {"items": items}
+            return result
+
+    metrics = pipeline.new_stage_metrics()
+    inventory = asyncio.run(pipeline.detect_toys(TileAgent("vision", 0.01, None, log), buffer.getvalue(), "image/jpeg", metrics))
+
+    # All four tiles are in flight before the first one finishes
+    assert [event for event, _ in log[:4]] == ["start"] * 4
+    assert metrics["requests"] == 4 and metrics["input_tokens"] == 400
+    # Boxes are in global coordinates and in reading order
+    assert [item["item_name"] for item in inventory["items"]] == ["Block", "Block", "Car", "Block", "Block"]
+    assert inventory["items"][2]["bbox"]["x"] == 0.48875
+
+
+def _analysis(roadmap_items: int = 3) -> dict:
+    return {
+        "status_quo": "Mostly constructive play.",
+        "skill_scores": {"cognitive": 70, "motor_fine": 60, "motor_gross": 40, "social_emotional": 55, "creative": 65, "language": 30},
+        "roadmap": [
+            {"timeframe": timeframe, "priority": priority, "missing_skill": "Oral Expression", "skill_id": "1.A.1.a.3",
+             "skill_category": "language", "recommended_toy": "Story cubes", "reasoning": "Storytelling builds vocabulary."}
+            for priority, timeframe in enumerate(("now", "3_months", "6_months")[:roadmap_items], start=1)
+        ],
+    }
+
+
+@pytest.mark.parametrize("toys, fast_output, expected", [
+    (3, _analysis(), ("flash", None, ["fast"])),
+    (3, _analysis(roadmap_items=2), ("pro", "validation", ["fast", "pro"])),
+    (4, _analysis(), ("pro", "complexity", ["pro"])),
+])
+def test_run_analysis_escalates_to_pro(monkeypatch, toys, fast_output, expected):
+    monkeypatch.setattr(pipeline, "ANALYSIS_TIER_MAX_TOYS", 3)
+    stats = pipeline.get_tier_stats.__wrapped__()
+    monkeypatch.setattr(pipeline, "get_tier_stats", lambda: stats)
+    log = []
+    agents = pipeline.ScanAgents(
+        vision=None, play_quest=None, safety=None,
+        analysis=FakeAgent("pro", 0, _analysis(), log),
+        analysis_fast=FakeAgent("fast", 0, fast_output, log),
+    )
+    metrics = pipeline.new_stage_metrics()
+
+    analysis_result = asyncio.run(pipeline.run_analysis(agents, {"items": [{"item_name": "Block"}] * toys}, 4, metrics))
+
+    tier, escalation, models = expected
+    assert [name for event, name in log if event == "start"] == models
+    assert analysis_result == (fast_output if tier == "flash" else _analysis())
+    assert (metrics["tier"], metrics["escalation"], metrics["requests"]) == (tier, escalation, len(models))
+    assert metrics["model"] == f"model-{models[-1]}"
+    assert list(stats.served) == [(tier, escalation)]
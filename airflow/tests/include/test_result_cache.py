@@ -0,0 +1,112 @@
+import asyncio
+from types import SimpleNamespace
+
+from include.result_cache import AgentResultCache, age_bucket, inventory_signature, roadmap_signature
+
+
+class FakeTable:
+    def __init__(self, rows, action="select"):
+        self.rows, self.action, self.filters, self.payload = rows, action, [], None
+
+    def select(self, columns):
+        return self
+
+    def upsert(self, payload, on_conflict):
+        self.action, self.payload = "upsert", payload
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row[column] == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row[column] > value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row[column] < value)
+        return self
+
+    async def execute(self):
+        matched = [row for row in self.rows if all(f(row) for f in self.filters)]
+        if self.action == "upsert":
+            self.rows.append(self.payload)
+        elif self.action == "delete":
+            self.rows[:] = [row for row in self.rows if row not in matched]
+        return SimpleNamespace(data=matched)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.rows = []
+
+    def table(self, name):
+        return FakeTable(self.rows)
+
+
+def _toy(name, category="Vehicle", count=1):
+    return {"category": category, "item_name": name, "play_mode": "Pretend Play", "count": count, "bbox": {"x": 0.1}}
+
+
+def test_signature_ignores_order_boxes_and_spelling_within_an_age_bucket():
+    first = {"items": [_toy("Red Car"), _toy("Red car"), _toy("Teddy Bear", "Plush")]}
+    second = {"items": [{**_toy("teddy-bear", "plush"), "bbox": {"x": 0.9}}, _toy("red CAR", count=2)]}
+
+    assert age_bucket(4) == age_bucket(5) == "4-5"
+    assert inventory_signature(first, 4) == inventory_signature(second, 5)
+    assert inventory_signature(first, 4) != inventory_signature(first, 7)
+    assert inventory_signature(first, 4) != inventory_signature({"items": [_toy("Red Car")]}, 4)
+    assert roadmap_signature({"roadmap": [{"recommended_toy": "Puzzle"}]}, 4) != roadmap_signature({"roadmap": [{"recommended_toy": "Kite"}]}, 4)
+
+
+def test_cache_shares_model_calls_within_a_batch_and_across_batches():
+    supabase = FakeSupabase()
+    calls = []
+
+    async def run():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"title": "Quest"}
+
+    async def batch() -> AgentResultCache:
+        cache = AgentResultCache(supabase, ttl_hours=1)
+        outputs = await asyncio.gather(*(cache.get_or_run("generate_play_quest", "sig", run) for _ in range(3)))
+        assert outputs == [{"title": "Quest"}] * 3
+        return cache
+
+    first = asyncio.run(batch())
+    assert (first.hits, first.misses, len(calls)) == (2, 1, 1)
+    assert first.saved_seconds > 0.01
+
+    # The next batch reads the stored output, until it expires
+    second = asyncio.run(batch())
+    assert (second.hits, second.misses, len(calls)) == (3, 0, 1)
+
+    supabase.rows[0]["expires_at"] = "2000-01-01T00:00:00+00:00"
+    asyncio.run(AgentResultCache(supabase).evict_expired())
+    assert supabase.rows == []
+
+
+def test_failed_model_calls_are_not_cached():
+    cache = AgentResultCache(FakeSupabase(), ttl_hours=1)
+    attempts = []
+
+    async def run():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise TimeoutError
+        return {"items": []}
+
+    async def scenario():
+        try:
+            await cache.get_or_run("safety_check", "sig", run)
+        except TimeoutError:
+            pass
+        return await cache.get_or_run("safety_check", "sig", run)
+
+    assert asyncio.run(scenario()) == {"items": []}
+    assert len(attempts) == 2
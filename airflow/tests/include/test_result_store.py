@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from include import result_store
+from include.result_store import ResultStore, load_output, store_output
+
+
+def _inventory(toys: int) -> dict:
+    return {"items": [
+        {"category": "Construction", "item_name": f"Block {i}", "play_mode": "Constructive", "count": 1,
+         "bbox": {"x": 0.1, "y": 0.2, "w": 0.05, "h": 0.05}}
+        for i in range(toys)
+    ]}
+
+
+def test_put_returns_a_small_reference_to_the_output(tmp_path):
+    store = ResultStore(tmp_path / "results")
+    inventory = _inventory(200)
+
+    ref = store.put("scheduled__2026-10-17T08:00:00+00:00", "0b7f6f1e-1c5a-4c1e-9d1a-6f0c2a3b4c5d", "analyze_image", inventory)
+
+    assert len(json.dumps(ref)) < 100 < len(json.dumps(inventory)) / 100
+    assert store.get(ref) == inventory
+
+
+def test_put_replaces_and_delete_removes(tmp_path):
+    store = ResultStore(tmp_path)
+
+    ref = store.put("run-1", "scan-1", "analyze_image", _inventory(3))
+    assert store.put("run-1", "scan-1", "analyze_image", _inventory(1)) == ref
+    assert store.get(ref) == _inventory(1)
+
+    store.delete(ref)
+    store.delete(ref)
+    with pytest.raises(FileNotFoundError):
+        store.get(ref)
+
+
+def test_runs_of_the_same_scan_keep_their_own_outputs(tmp_path):
+    store = ResultStore(tmp_path)
+
+    stale_ref = store.put("run-1", "scan-1", "analyze_image", _inventory(3))
+    ref = store.put("run-2", "scan-1", "analyze_image", _inventory(1))
+
+    # The teardown of the stale run must not delete what the run holding the claim wrote
+    store.delete(stale_ref)
+    assert store.get(ref) == _inventory(1)
+
+
+def test_outputs_stay_in_xcom_without_a_store(monkeypatch):
+    monkeypatch.setattr(result_store, "RESULT_STORE_URL", None)
+    result_store.get_result_store.cache_clear()
+
+    output = store_output("run-1", "scan-1", "analyze_image", _inventory(2))
+
+    assert output == _inventory(2)
+    assert load_output(output) == _inventory(2)
+    assert result_store.get_result_store() is None
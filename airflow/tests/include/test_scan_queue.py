@@ -0,0 +1,30 @@
+from include.scan_queue import claim_order
+
+
+def _scans(client_id, count, start, priority=0):
+    return [
+        {"id": f"{client_id}-{i}", "client_id": client_id, "priority": priority, "created_at": start + i}
+        for i in range(count)
+    ]
+
+
+def test_heavy_uploader_shares_the_batch_with_later_clients():
+    scans = _scans("heavy", 50, 0) + _scans("a", 2, 100) + _scans("b", 1, 101)
+
+    claimed = [scan["id"] for scan in claim_order(scans, batch_size=10, per_client=3)]
+
+    # First round: 3 of each client, oldest first, then the heavy uploader fills the batch
+    assert claimed == ["heavy-0", "heavy-1", "heavy-2", "a-0", "a-1", "b-0", "heavy-3", "heavy-4", "heavy-5", "heavy-6"]
+
+
+def test_priority_goes_first_and_a_lone_uploader_fills_the_batch():
+    scans = _scans("heavy", 30, 0) + _scans("demo", 1, 500, priority=1) + [
+        {"id": "anonymous", "client_id": None, "priority": 0, "created_at": 1000}
+    ]
+
+    claimed = [scan["id"] for scan in claim_order(scans, batch_size=8, per_client=5)]
+
+    assert claimed[0] == "demo-0"
+    assert claimed[1:6] == [f"heavy-{i}" for i in range(5)]
+    assert claimed[6:] == ["anonymous", "heavy-5"]
+    assert len(claim_order(_scans("heavy", 30, 0), batch_size=20, per_client=5)) == 20
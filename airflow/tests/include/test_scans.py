@@ -0,0 +1,81 @@
+import pytest
+
+from include import scans
+from include.scans import ScanDatabase
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection, self.description = connection, None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, parameters):
+        if self.connection.fail:
+            raise ConnectionError("server closed the connection unexpectedly")
+        self.connection.statements.append((sql, parameters))
+        self.description = [("id",)] if sql.startswith("SELECT") else None
+
+    def fetchall(self):
+        return [(1,)]
+
+
+class FakeConnection:
+    def __init__(self):
+        self.autocommit, self.closed, self.fail, self.statements = False, 0, False, []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+
+    class FakeHook:
+        def __init__(self, postgres_conn_id):
+            pass
+
+        def get_conn(self):
+            opened.append(FakeConnection())
+            return opened[-1]
+
+    monkeypatch.setattr(scans, "PostgresHook", FakeHook)
+    return opened
+
+
+def test_statements_share_one_connection(connections):
+    db = ScanDatabase()
+    assert db.run("SELECT 1;") == [(1,)]
+    assert db.run("UPDATE public.scans SET progress = NULL;", ("scan-1",)) == []
+
+    assert len(connections) == 1
+    assert connections[0].autocommit
+    assert len(connections[0].statements) == 2
+
+
+def test_failed_connection_is_replaced(connections):
+    db = ScanDatabase()
+    db.run("SELECT 1;")
+    connections[0].fail = True
+    with pytest.raises(ConnectionError):
+        db.run("SELECT 1;")
+    assert connections[0].closed
+
+    assert db.run("SELECT 1;") == [(1,)]
+    assert len(connections) == 2
+
+
+def test_forked_process_opens_its_own_connection(connections, monkeypatch):
+    db = ScanDatabase()
+    db.run("SELECT 1;")
+    monkeypatch.setattr(scans.os, "getpid", lambda: -1)
+    db.run("SELECT 1;")
+    assert len(connections) == 2
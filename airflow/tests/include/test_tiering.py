@@ -0,0 +1,58 @@
+import pytest
+
+from include.tiering import TierStats, inventory_complexity, validate_analysis
+
+
+def _analysis() -> dict:
+    return {
+        "status_quo": "Mostly constructive play.",
+        "skill_scores": {"cognitive": 70, "motor_fine": 60, "motor_gross": 40, "social_emotional": 55, "creative": 65, "language": 30},
+        "roadmap": [
+            {"timeframe": "now", "priority": 1, "missing_skill": "Oral Expression", "skill_id": "1.A.1.a.3", "skill_category": "language"},
+            {"timeframe": "3_months", "priority": 2, "missing_skill": "Gross Body Coordination", "skill_id": "1.A.3.c.3",
+             "skill_category": "motor_gross"},
+            {"timeframe": "6_months", "priority": 3, "missing_skill": "Visualization", "skill_id": "1.A.1.f.2", "skill_category": "cognitive"},
+        ],
+    }
+
+
+def test_valid_analysis_has_no_problems():
+    assert validate_analysis(_analysis()) == []
+
+
+@pytest.mark.parametrize("change, problem", [
+    (lambda a: a["roadmap"].pop(), "2 roadmap items instead of 3"),
+    (lambda a: a["roadmap"].reverse(), "roadmap priorities or timeframes out of order"),
+    (lambda a: a["roadmap"][0].update(skill_id="Oral Expression"), "invalid O*NET ability ID 'Oral Expression'"),
+    (lambda a: a["roadmap"][1].update(skill_id="2.A.1.a"), "invalid O*NET ability ID '2.A.1.a'"),
+    (lambda a: a["roadmap"][2].update(skill_category="math"), "unknown skill category 'math'"),
+    (lambda a: a["skill_scores"].update(language=120), "skill scores outside of 0-100"),
+    (lambda a: a["skill_scores"].pop("creative"), "skill scores outside of 0-100"),
+    (lambda a: a["skill_scores"].update(dict.fromkeys(a["skill_scores"], 50)), "all skill scores are 50"),
+])
+def test_invalid_analysis_is_reported(change, problem):
+    analysis = _analysis()
+    change(analysis)
+
+    problems = validate_analysis(analysis)
+
+    assert len(problems) == 1 and problems[0].startswith(problem)
+
+
+def test_clusters_count_once_towards_the_complexity():
+    assert inventory_complexity({"items": [{"item_name": "Duplo Block Pile", "count": 40}, {"item_name": "Teddy Bear", "count": 1}]}) == 2
+    assert inventory_complexity({}) == 0
+
+
+def test_tier_stats_log_the_escalation_rate(caplog):
+    stats = TierStats()
+    for tier, escalation, seconds in (("flash", None, 6), ("flash", None, 8), ("pro", "validation", 31), ("pro", "complexity", 25)):
+        stats.record(tier, escalation, seconds)
+
+    with caplog.at_level("INFO"):
+        stats.log_stats()
+
+    assert caplog.messages == [
+        "Analyses: 4, 50% escalated to Pro. flash 2, 7.0 s on average, pro (complexity) 1, 25.0 s on average, "
+        "pro (validation) 1, 31.0 s on average"
+    ]
@@ -0,0 +1,76 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from include.tiling import Tile, crop_tiles, merge_tile_items, non_max_suppression, tile_grid, to_global
+
+
+def _box(x, y, w, h) -> dict:
+    return {"x": x, "y": y, "w": w, "h": h}
+
+
+def test_tiles_overlap_and_cover_the_image():
+    tiles = tile_grid(1000, 800, grid=2, overlap=0.1)
+
+    assert tiles == [Tile(0, 0, 550, 440), Tile(450, 0, 1000, 440), Tile(0, 360, 550, 800), Tile(450, 360, 1000, 800)]
+
+    image = Image.new("RGB", (1000, 800))
+    size, cropped = crop_tiles(_jpeg(image), grid=2, overlap=0.1)
+    assert size == (1000, 800)
+    assert [Image.open(BytesIO(data)).size for _, data in cropped] == [(550, 440)] * 4
+
+
+def test_tile_boxes_map_back_to_global_coordinates():
+    bbox = to_global(_box(0.5, 0.25, 0.1, 0.5), Tile(450, 360, 1000, 800), 1000, 800)
+
+    assert bbox == pytest.approx(_box(0.725, 0.5875, 0.055, 0.275))
+
+
+def test_merge_removes_seam_duplicates_but_keeps_neighbouring_toys():
+    width, height = 1000, 800
+    left, right = Tile(0, 0, 550, 800), Tile(450, 0, 1000, 800)
+    # A car on the seam at x 470-530 is seen whole by both tiles, the right tile also cuts a teddy at its edge
+    tile_items = [
+        (left, [{"item_name": "Red Car", "bbox": _box(470 / 550, 0.5, 60 / 550, 0.1)},
+                {"item_name": "Teddy", "bbox": _box(380 / 550, 0.1, 170 / 550, 0.3)}]),
+        (right, [{"item_name": "Toy Car", "bbox": _box(22 / 550, 0.5, 58 / 550, 0.1)},
+                 {"item_name": "Teddy", "bbox": _box(0, 0.1, 100 / 550, 0.3)},
+                 {"item_name": "Blocks", "bbox": _box(0.5, 0.5, 0.2, 0.2)}]),
+    ]
+
+    items = merge_tile_items(tile_items, width, height)
+
+    assert [item["item_name"] for item in items] == ["Teddy", "Red Car", "Blocks"]
+    # The larger box of a duplicate wins
+    assert items[0]["bbox"] == pytest.approx(_box(0.38, 0.1, 0.17, 0.3))
+    # Boxes that only touch are distinct toys
+    assert len(non_max_suppression([{"bbox": _box(0, 0, 0.1, 0.1)}, {"bbox": _box(0.1, 0, 0.1, 0.1)}])) == 2
+
+
+def test_merge_removes_a_partial_box_of_a_toy_whole_in_the_neighbouring_tile():
+    width, height = 1000, 800
+    left, right = Tile(0, 0, 550, 800), Tile(450, 0, 1000, 800)
+    # A train at x 300-540: whole in the left tile, cut by the left edge of the right tile at 450
+    tile_items = [
+        (left, [{"item_name": "Train", "bbox": _box(300 / 550, 0.4, 240 / 550, 0.2)}]),
+        (right, [{"item_name": "Train Wagon", "bbox": _box(0, 0.41, 90 / 550, 0.18)},
+                 {"item_name": "Car", "bbox": _box(0.5, 0.45, 0.05, 0.05)}]),
+    ]
+
+    items = merge_tile_items(tile_items, width, height)
+
+    assert [item["item_name"] for item in items] == ["Train", "Car"]
+
+
+def test_small_toy_within_a_larger_one_is_kept_unless_cut():
+    mat, car = {"bbox": _box(0.1, 0.1, 0.5, 0.5)}, {"bbox": _box(0.3, 0.3, 0.05, 0.05)}
+
+    assert non_max_suppression([mat, car], cut=[False, False]) == [mat, car]
+    assert non_max_suppression([mat, car], cut=[False, True]) == [mat]
+
+
+def _jpeg(image: Image.Image) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, "JPEG")
+    return buffer.getvalue()
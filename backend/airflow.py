@@ -1,40 +1,145 @@
-import requests
+import asyncio
+import logging
+from time import monotonic
+
+import httpx
+
+logger = logging.getLogger(__name__)
 
 class AirflowClient:
 
-    def __init__(self, host: str, username: str, password: str, token: str | None = None):
+    def __init__(self, host: str, username: str, password: str, token: str | None = None, max_connections: int = 20):
         self.host = host
         self.username = username
         self.password = password
-        self.session = requests.Session()
+        # One pooled client for all requests, so triggers reuse keep-alive connections
+        self.client = httpx.AsyncClient(
+            base_url=host,
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
 
         self._static_token = token is not None
-        self.token = token if self._static_token else self.get_jwt_token()
-        self._update_session_auth()
+        self.token = token
 
-    def get_jwt_token(self) -> str:
-        url = f"{self.host}/auth/token"
-        response = requests.post(url, json={"username": self.username, "password": self.password})
+    async def get_jwt_token(self) -> str:
+        response = await self.client.post("/auth/token", json={"username": self.username, "password": self.password})
         response.raise_for_status()
         return response.json().get("access_token")
 
-    def trigger_dag(self, dag_id: str, payload: dict | None = None) -> str:
-        url = f"{self.host}/api/v2/dags/{dag_id}/dagRuns"
+    async def trigger_dag(self, dag_id: str, payload: dict | None = None) -> str:
         payload = payload or {"logical_date": None}
-        response = self.session.post(url, json=payload)
+        response = await self._request("POST", f"/api/v2/dags/{dag_id}/dagRuns", json=payload)
+        return response.json().get("dag_run_id")
+
+    async def get_queued_dag_run(self, dag_id: str) -> str | None:
+        """Returns the ID of a run that is queued and has not claimed any scans yet, if there is one."""
+        response = await self._request("GET", f"/api/v2/dags/{dag_id}/dagRuns", params={"state": "queued", "limit": 1})
+        dag_runs = response.json().get("dag_runs", [])
+        return dag_runs[0]["dag_run_id"] if dag_runs else None
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    def _auth_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if self.token is None:
+            self.token = await self.get_jwt_token()
+        response = await self.client.request(method, url, headers=self._auth_headers(), **kwargs)
 
         if response.status_code == 401 and not self._static_token:
-            self.token = self.get_jwt_token()
-            self._update_session_auth()
-            response = self.session.post(url, json=payload)
+            self.token = await self.get_jwt_token()
+            response = await self.client.request(method, url, headers=self._auth_headers(), **kwargs)
 
         response.raise_for_status()
-        return response.json().get("dag_run_id")
+        return response
+
+
+class TriggerCoalescer:
+    """
+    Collapses a burst of uploads into as few Dag runs as possible.
+
+    Every run claims a batch of open scans when it starts and triggers the next run while a
+    backlog remains, so a scan only needs a trigger if no run is still queued. Within
+    `window_seconds` of the last trigger, scans are collected and handed to one trailing
+    trigger at the end of the window instead of starting a run each.
+    `on_assigned(scan_ids, dag_run_id)` records which run will pick up which scans.
+    """
 
-    def _update_session_auth(self):
-        self.session.headers.update({"Authorization": f"Bearer {self.token}"})
+    def __init__(self, client: AirflowClient, dag_id: str, window_seconds: float, on_assigned: callable):
+        self.client = client
+        self.dag_id = dag_id
+        self.window_seconds = window_seconds
+        self.on_assigned = on_assigned
+        self._lock = asyncio.Lock()
+        self._window_start = float("-inf")
+        self._pending: list[str] = []
+        self._flush_task: asyncio.Task | None = None
+
+    async def request(self, scan_id: str) -> str | None:
+        """Returns the run that will pick up the scan, or None if it waits for the trailing trigger."""
+        async with self._lock:
+            wait = self._window_start + self.window_seconds - monotonic()
+            if wait > 0:
+                self._pending.append(scan_id)
+                if self._flush_task is None:
+                    self._flush_task = asyncio.create_task(self._flush_after(wait))
+                return None
+
+            dag_run_id = await self._queued_or_trigger()
+
+        await self._assign([scan_id], dag_run_id)
+        return dag_run_id
+
+    async def close(self) -> None:
+        """Flushes pending scans right away, e.g. on shutdown."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+            await self._flush()
+
+    async def _flush_after(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        await self._flush()
+
+    async def _flush(self) -> None:
+        async with self._lock:
+            scan_ids, self._pending = self._pending, []
+            if not scan_ids:
+                return
+            try:
+                dag_run_id = await self._queued_or_trigger()
+            except Exception as e:
+                # The scans stay 'processing', so the next run claims them anyway
+                logger.error("Coalesced trigger for %d scans failed: %s", len(scan_ids), e)
+                return
+
+        await self._assign(scan_ids, dag_run_id)
+
+    async def _assign(self, scan_ids: list[str], dag_run_id: str) -> None:
+        try:
+            await self.on_assigned(scan_ids, dag_run_id)
+        except Exception as e:
+            logger.error("Failed to record run %s for %d scans: %s", dag_run_id, len(scan_ids), e)
+
+    async def _queued_or_trigger(self) -> str:
+        # Starts a new window either way, so a burst costs one Airflow round trip per window
+        self._window_start = monotonic()
+        dag_run_id = await self.client.get_queued_dag_run(self.dag_id)
+        if dag_run_id is not None:
+            logger.info("Attaching scans to queued run %s", dag_run_id)
+            return dag_run_id
+
+        return await self.client.trigger_dag(self.dag_id)
 
 if __name__ == "__main__":
-    client = AirflowClient("http://localhost:8080", "airflow", "airflow")
-    dag_run_id = client.trigger_dag("process_scans")
-    print(f"Triggered DAG run with ID: {dag_run_id}")
+    async def main():
+        client = AirflowClient("http://localhost:8080", "airflow", "airflow")
+        dag_run_id = await client.trigger_dag("process_scans")
+        print(f"Triggered DAG run with ID: {dag_run_id}")
+        await client.close()
+
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Rows deleted per second by DataCleaner.cleanup against the in-memory fake Supabase client,
+with a simulated network round trip per request.
+
+Compares the batched cleanup with the previous per-row deletes (which also loaded the whole
+backlog at once). The per-row variant only runs up to --legacy-max scans, it needs one round
+trip per scan.
+
+    uv run python -m benchmarks.bench_cleanup --sizes 10000 100000 --latency-ms 5
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from cleanup import DataCleaner
+from tests.fake_supabase import FakeSupabase
+
+
+def expired_scans(count: int) -> FakeSupabase:
+    created_at = (datetime.now() - timedelta(days=5)).isoformat()
+    scans = [{"id": f"{i:036d}", "image_path": f"scans/{i:036d}.jpg", "created_at": created_at} for i in range(count)]
+    fake = FakeSupabase({"scans": scans})
+    fake.objects = {scan["image_path"]: b"" for scan in scans}
+    return fake
+
+
+async def legacy_cleanup(supabase: FakeSupabase, cutoff: str) -> None:
+    old_scans = await supabase.table("scans").select("id, image_path").lt("created_at", cutoff).execute()
+    await supabase.storage.from_("playroom-images").remove([scan["image_path"] for scan in old_scans.data])
+    for scan in old_scans.data:
+        await supabase.table("scans").delete().eq("id", scan["id"]).execute()
+
+
+async def run(name: str, count: int, latency: float, cleanup) -> None:
+    fake = expired_scans(count)
+    fake.latency = latency
+
+    start = time.perf_counter()
+    await cleanup(fake)
+    elapsed = time.perf_counter() - start
+
+    assert not fake.tables["scans"], "cleanup left scans behind"
+    requests = len(fake.calls)
+    print(f"{name:>8} {count:>8} scans: {elapsed:7.2f} s  {count / elapsed:10.0f} rows/s  {requests:>6} requests")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Simulated round trip per request")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--legacy-max", type=int, default=10_000)
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    cutoff = (datetime.now() - timedelta(days=2)).isoformat()
+
+    for count in args.sizes:
+        async def batched(fake: FakeSupabase):
+            async def get_supabase():
+                return fake
+            await DataCleaner(get_supabase, age_days=2, batch_size=args.batch_size).cleanup()
+
+        await run("batched", count, latency, batched)
+        if count <= args.legacy_max:
+            await run("per-row", count, latency, lambda fake: legacy_cleanup(fake, cutoff))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
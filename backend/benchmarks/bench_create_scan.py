@@ -0,0 +1,173 @@
+"""
+Load benchmark for POST /api/scan against a local stub standing in for Supabase and Airflow.
+
+Every stub call sleeps for a fixed latency, like a network round trip would. A backend that
+blocks the event loop on these calls serializes all uploads of a worker, an async one overlaps them.
+
+    uv run python -m benchmarks.bench_create_scan --latency-ms 20 --concurrency 50 200 1000
+
+Run it on an older revision (e.g. via `git worktree`) to compare before and after.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import time
+import uuid
+from io import BytesIO
+
+import httpx
+import uvicorn
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+STUB_PORT = 54321
+APP_PORT = 54322
+
+
+def build_stub(latency: float) -> Starlette:
+    async def rest(request: Request):
+        await asyncio.sleep(latency)
+        if request.method == "GET":
+            return JSONResponse([], headers={"content-range": "0-0/0"})
+        return JSONResponse([], status_code=201 if request.method == "POST" else 200)
+
+    async def rpc(request: Request):
+        # increment_daily_scans, always below the limit
+        await asyncio.sleep(latency)
+        return JSONResponse(1)
+
+    async def storage(request: Request):
+        await asyncio.sleep(latency)
+        if request.path_params["path"].startswith("list/"):
+            return JSONResponse([])
+        return JSONResponse({"Key": request.path_params["path"]})
+
+    async def token(request: Request):
+        await asyncio.sleep(latency)
+        return JSONResponse({"access_token": "stub-token"})
+
+    async def dag_runs(request: Request):
+        await asyncio.sleep(latency)
+        return JSONResponse({"dag_run_id": f"manual__{uuid.uuid4()}"})
+
+    return Starlette(routes=[
+        Route("/rest/v1/rpc/{function}", rpc, methods=["POST"]),
+        Route("/rest/v1/{table}", rest, methods=["GET", "POST", "PATCH", "DELETE"]),
+        Route("/storage/v1/object/{path:path}", storage, methods=["GET", "POST", "DELETE"]),
+        Route("/auth/token", token, methods=["POST"]),
+        Route("/api/v2/dags/{dag_id}/dagRuns", dag_runs, methods=["GET", "POST"]),
+    ])
+
+
+def run_stub(latency: float) -> None:
+    uvicorn.run(build_stub(latency), port=STUB_PORT, log_level="warning", access_log=False, backlog=4096)
+
+
+def run_backend() -> None:
+    stub_url = f"http://127.0.0.1:{STUB_PORT}"
+    os.environ.update({
+        "SUPABASE_URL": stub_url,
+        "SUPABASE_SECRET_KEY": "stub.secret.key",
+        "AIRFLOW_HOST": stub_url,
+        "AIRFLOW_STATIC_TOKEN": "stub-token",
+        "POST_RATE_LIMIT": "1000000/minute",
+        "GET_RATE_LIMIT": "1000000/minute",
+        "DAILY_SCAN_LIMIT": "1000000000",
+    })
+    # Imported only here, so the module level configuration picks up the stub env
+    import main as backend
+    uvicorn.run(backend.app, port=APP_PORT, log_level="warning", access_log=False, backlog=4096)
+
+
+def wait_for_port(port: int) -> None:
+    while True:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+
+
+def random_jpeg() -> bytes:
+    # Noise gives every upload a different SHA-256 and perceptual hash, so no upload hits the dedupe cache
+    buffer = BytesIO()
+    Image.effect_noise((320, 240), 100).convert("RGB").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+async def run_load(concurrency: int, total: int, timeout: float) -> tuple[float, list[float], int]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    photos = [random_jpeg() for _ in range(total)]
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{APP_PORT}", limits=limits, timeout=timeout) as client:
+        async def upload(i: int):
+            nonlocal errors
+            async with semaphore:
+                content = photos[i]
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/api/scan", data={"age": "4"}, files={"file": ("playroom.jpg", content, "image/jpeg")})
+                except httpx.HTTPError:
+                    # A timeout, like a client giving up. Counted as an error, not as a latency
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(upload(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return elapsed, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Latency of every stub call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--requests-per-level", type=int, default=0, help="Defaults to 2x the concurrency")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds until an upload counts as an error")
+    args = parser.parse_args()
+
+    # Stub, backend and load generator run in separate processes, so they don't compete for the GIL
+    processes = [
+        multiprocessing.Process(target=run_stub, args=(args.latency_ms / 1000,), daemon=True),
+        # Not a daemon, the backend starts its own image process pool
+        multiprocessing.Process(target=run_backend),
+    ]
+    processes[0].start()
+    wait_for_port(STUB_PORT)
+    processes[1].start()
+    wait_for_port(APP_PORT)
+
+    print(f"stub latency: {args.latency_ms:.0f} ms per call")
+    print(f"{'concurrency':>11} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>6}")
+    try:
+        for concurrency in args.concurrency:
+            total = args.requests_per_level or concurrency * 2
+            elapsed, latencies, errors = asyncio.run(run_load(concurrency, total, args.timeout))
+            # Throughput and latencies of the uploads that succeeded
+            latencies.sort()
+            p50 = statistics.median(latencies) * 1000 if latencies else float("nan")
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else float("nan")
+            print(f"{concurrency:>11} {total:>8} {(total - errors) / elapsed:>8.1f} {p50:>8.1f} {p99:>8.1f} {errors:>6}")
+    finally:
+        # Backend first, it flushes pending Dag triggers to the stub on shutdown. Also when the load
+        # generator failed, or the non-daemon backend would keep the benchmark from exiting
+        for process in reversed(processes):
+            process.terminate()
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
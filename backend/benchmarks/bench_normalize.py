@@ -0,0 +1,72 @@
+"""
+Bytes saved and CPU time per image of the upload normalization.
+
+Generates phone-sized synthetic playroom photos (textured background with toy-like shapes and
+an EXIF block) unless real photos are passed in.
+
+    uv run python -m benchmarks.bench_normalize --count 10
+    uv run python -m benchmarks.bench_normalize ~/Pictures/playroom*.jpg
+"""
+import argparse
+import random
+import statistics
+import time
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from images import normalize_image
+
+
+def synthetic_photo(rng: random.Random, size: tuple[int, int] = (4032, 3024)) -> bytes:
+    # Noise blurred into texture compresses like a real photo, flat colors would be unrealistically small
+    noise = Image.effect_noise((size[0] // 4, size[1] // 4), 64).resize(size).filter(ImageFilter.GaussianBlur(2))
+    image = Image.merge("RGB", (noise, noise.point(lambda v: v * 0.9), noise.point(lambda v: v * 0.7)))
+
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        w, h = rng.randrange(80, 600), rng.randrange(80, 600)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)((x, y, x + w, y + h), fill=color)
+
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotated 90 degrees, like portrait shots from a phone
+    exif[0x010F] = "Synthetic Phone"
+
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=95, exif=exif)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("photos", nargs="*", type=Path, help="Real photos to use instead of synthetic ones")
+    parser.add_argument("--count", type=int, default=5, help="Number of synthetic photos")
+    parser.add_argument("--max-edge", type=int, default=2048)
+    parser.add_argument("--format", choices=["jpeg", "webp"], default="jpeg")
+    parser.add_argument("--quality", type=int, default=85)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    photos = [path.read_bytes() for path in args.photos] or [synthetic_photo(rng) for _ in range(args.count)]
+
+    sizes_in, sizes_out, cpu_times = [], [], []
+    for photo in photos:
+        start = time.process_time()
+        normalized, _, _, _ = normalize_image(photo, args.max_edge, args.format, args.quality)
+        cpu_times.append(time.process_time() - start)
+        sizes_in.append(len(photo))
+        sizes_out.append(len(normalized))
+
+    total_in, total_out = sum(sizes_in), sum(sizes_out)
+    print(f"images:        {len(photos)} ({args.format}, max edge {args.max_edge}, quality {args.quality})")
+    print(f"input:         {total_in / len(photos) / 1e6:.2f} MB per image")
+    print(f"output:        {total_out / len(photos) / 1e6:.2f} MB per image")
+    print(f"bytes saved:   {(1 - total_out / total_in) * 100:.1f} %")
+    print(f"cpu time:      p50 {statistics.median(cpu_times) * 1000:.0f} ms, max {max(cpu_times) * 1000:.0f} ms per image")
+
+
+if __name__ == "__main__":
+    main()
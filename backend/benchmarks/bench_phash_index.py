@@ -0,0 +1,73 @@
+"""
+Lookup latency of the perceptual hash index versus a linear Hamming scan.
+
+    uv run python -m benchmarks.bench_phash_index --size 100000 --max-distance 6
+"""
+import argparse
+import random
+import statistics
+import time
+
+from phash import HASH_BITS, PerceptualHashIndex
+
+
+def flip_bits(value: int, count: int, rng: random.Random) -> int:
+    for bit in rng.sample(range(HASH_BITS), count):
+        value ^= 1 << bit
+    return value
+
+
+def linear_find(hashes: dict[str, int], value: int, max_distance: int) -> tuple[str, int] | None:
+    best = None
+    for key, stored in hashes.items():
+        distance = (stored ^ value).bit_count()
+        if distance <= max_distance and (best is None or distance < best[1]):
+            best = (key, distance)
+    return best
+
+
+def percentiles(samples: list[float]) -> str:
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f"mean {statistics.mean(samples) * 1e6:8.1f} us  p50 {statistics.median(samples) * 1e6:8.1f} us  p99 {p99 * 1e6:8.1f} us"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    parser.add_argument("--max-distance", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    hashes = {f"scan-{i}": rng.getrandbits(HASH_BITS) for i in range(args.size)}
+
+    start = time.perf_counter()
+    index = PerceptualHashIndex(args.max_distance)
+    for key, value in hashes.items():
+        index.add(key, value)
+    print(f"indexed {len(index)} hashes in {time.perf_counter() - start:.2f} s")
+
+    # Half near-duplicates of stored hashes, half unrelated images
+    stored = list(hashes.values())
+    queries = [flip_bits(rng.choice(stored), rng.randint(0, args.max_distance), rng) for _ in range(args.queries // 2)]
+    queries += [rng.getrandbits(HASH_BITS) for _ in range(args.queries - len(queries))]
+    rng.shuffle(queries)
+
+    # The linear scan is slow, a sample of the queries is enough
+    for name, find, count in [
+        ("index", index.find, len(queries)),
+        ("linear", lambda v: linear_find(hashes, v, args.max_distance), min(len(queries), 200)),
+    ]:
+        samples = []
+        hits = 0
+        for query in queries[:count]:
+            start = time.perf_counter()
+            hits += find(query) is not None
+            samples.append(time.perf_counter() - start)
+        print(f"{name:>6}: {percentiles(samples)}  ({len(samples)} queries, {hits} hits)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Overhead of the slowapi rate limiter per request, with in-memory and shared redis storage.
+
+Without --redis-uri, an in-process fakeredis server (dev dependency) stands in for redis. It runs
+the same Lua scripts, but without a network round trip: add one RTT to redis per request.
+Also checks that two limiters sharing a storage, like two uvicorn workers, enforce one limit together.
+
+    uv run python -m benchmarks.bench_rate_limit --requests 2000
+    uv run python -m benchmarks.bench_rate_limit --redis-uri redis://localhost:6379
+"""
+import argparse
+import statistics
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from slowapi import Limiter
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
+from starlette.responses import JSONResponse
+
+
+def fake_redis_options() -> dict:
+    import fakeredis
+    import redis
+
+    server = fakeredis.FakeServer()
+    return {"connection_pool": redis.ConnectionPool(connection_class=fakeredis.FakeConnection, server=server)}
+
+
+def build_app(storage_uri: str | None, limit: str, storage_options: dict | None = None) -> FastAPI:
+    app = FastAPI()
+
+    if storage_uri is None:
+        @app.get("/ping")
+        async def ping(request: Request):
+            return {"ok": True}
+        return app
+
+    limiter = Limiter(key_func=get_remote_address, storage_uri=storage_uri, storage_options=storage_options or {}, strategy="moving-window")
+    app.state.limiter = limiter
+
+    @app.exception_handler(RateLimitExceeded)
+    async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
+        return JSONResponse(status_code=429, content={"detail": "Rate limit exceeded"})
+
+    @app.get("/ping")
+    @limiter.limit(limit)
+    async def limited_ping(request: Request):
+        return {"ok": True}
+
+    return app
+
+
+def measure(client: TestClient, requests: int) -> list[float]:
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get("/ping")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def shared_limit_check(storage_uri: str, storage_options: dict, limit: int) -> int:
+    """Alternates requests between two apps ("workers") on the same storage, returns how many passed."""
+    workers = [TestClient(build_app(storage_uri, f"{limit}/minute", storage_options)) for _ in range(2)]
+    return sum(workers[i % 2].get("/ping").status_code == 200 for i in range(limit * 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--redis-uri", help="Real redis to measure against, instead of fakeredis")
+    args = parser.parse_args()
+
+    # With a connection pool, the storage ignores the host of the URI
+    redis = ("redis", args.redis_uri, {}) if args.redis_uri else ("fakeredis", "redis://fakeredis", fake_redis_options())
+    baseline = None
+    for name, storage_uri, options in [("no limiter", None, {}), ("memory://", "memory://", {}), redis]:
+        client = TestClient(build_app(storage_uri, "1000000/minute", options))
+        measure(client, 100)  # Warm up connections and caches
+        p50 = statistics.median(measure(client, args.requests))
+        baseline = baseline if baseline is not None else p50
+        print(f"{name:>12}: p50 {p50 * 1e6:8.0f} us per request, limiter overhead {(p50 - baseline) * 1e6:6.0f} us")
+
+    # Every app gets its own in-memory storage, while both share the redis one
+    for name, storage_uri, options in [("memory://", "memory://", {}), redis]:
+        print(f"{name:>12}: 2 workers with a limit of 10/minute let {shared_limit_check(storage_uri, options, 10)} of 20 requests through")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Response size and latency of `GET /api/scan/{id}` for a finished scan with a large inventory.
+
+Compares the full and the compact view, with and without gzip, against the in-memory Supabase
+fake with a simulated round trip. The result cache is disabled, so every request queries the
+fake and serializes the result like a cache miss. A last row shows cached responses.
+
+    uv run python -m benchmarks.bench_scan_payload --toys 200 --latency-ms 20
+"""
+import argparse
+import logging
+import random
+import statistics
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from scan_cache import ScanCache
+from tests.fake_supabase import FakeSupabase
+
+CATEGORIES = ["blocks", "vehicles", "dolls", "puzzles", "art supplies", "books", "musical", "balls"]
+PLAY_MODES = ["construction", "pretend", "sensory", "gross motor", "creative"]
+
+
+def synthetic_result(rng: random.Random, toys: int) -> dict:
+    return {
+        "status_quo": "The playroom leans heavily on construction toys and vehicles. " * 4,
+        "skill_scores": {"cognitive": 70, "motor_fine": 55, "motor_gross": 40, "social_emotional": 35, "creative": 60, "language": 45},
+        "toy_inventory": [
+            {
+                "category": rng.choice(CATEGORIES),
+                "item_name": f"{rng.choice(['wooden', 'plastic', 'soft', 'magnetic'])} toy {i}",
+                "play_mode": rng.choice(PLAY_MODES),
+                "count": rng.choice([1, 1, 1, 2, 4]),
+                "bbox": {k: round(rng.random(), 4) for k in ("x", "y", "w", "h")},
+            }
+            for i in range(toys)
+        ],
+        "roadmap": [
+            {
+                "timeframe": timeframe, "priority": priority, "missing_skill": "Oral Expression", "skill_id": "1.A.1.a.3",
+                "skill_category": "language", "recommended_toy": "Story cubes",
+                "reasoning": "Open-ended storytelling builds vocabulary and sentence structure. " * 6,
+                "decision": "APPROVED", "final_toy": "Story cubes", "safety_context": "No small parts for this age.",
+                "amazon_search": "story cubes kids",
+            }
+            for priority, timeframe in enumerate(["now", "3_months", "6_months"], start=1)
+        ],
+        "play_quest": {"title": "Tower Tales", "instructions": ["Build a tower.", "Tell its story."] * 3},
+    }
+
+
+def measure(client: TestClient, url: str, headers: dict, requests: int) -> tuple[int, list[float]]:
+    samples, size = [], 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        samples.append(time.perf_counter() - start)
+        # Bytes on the wire, the body is already decompressed
+        size = int(response.headers["content-length"])
+    return size, samples
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--toys", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated database round trip")
+    args = parser.parse_args()
+
+    fake = FakeSupabase({"scans": [{
+        "id": "scan-1", "status": "done", "child_age": 4, "image_path": "scans/scan-1.jpg",
+        "image_hash": "0" * 64, "image_phash": "0" * 16, "progress": {}, "dag_run_id": "run",
+        "created_at": "2026-01-01T00:00:00", "results_json": synthetic_result(random.Random(42), args.toys),
+    }]}, latency=args.latency_ms / 1000)
+
+    async def get_supabase():
+        return fake
+
+    main.get_supabase = get_supabase
+    main.scan_cache = ScanCache(max_entries=0)
+    client = TestClient(main.app)
+    main.limiter.enabled = False
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    print(f"{args.toys} toys, {args.requests} requests per row, {args.latency_ms:.0f} ms simulated round trip")
+    print(f"{'view':<10} {'encoding':<10} {'bytes':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for view in ("full", "compact"):
+        for encoding in ("identity", "gzip"):
+            size, samples = measure(client, f"/api/scan/scan-1?view={view}", {"Accept-Encoding": encoding}, args.requests)
+            samples.sort()
+            print(f"{view:<10} {encoding:<10} {size:>9} {statistics.median(samples) * 1000:>8.2f} {samples[int(len(samples) * 0.99) - 1] * 1000:>8.2f}")
+
+    main.scan_cache = ScanCache()
+    size, samples = measure(client, "/api/scan/scan-1?view=compact", {"Accept-Encoding": "gzip"}, args.requests)
+    samples.sort()
+    print(f"{'compact':<10} {'gzip':<10} {size:>9} {statistics.median(samples) * 1000:>8.2f} {samples[int(len(samples) * 0.99) - 1] * 1000:>8.2f}  (cached)")
+
+
+if __name__ == "__main__":
+    main_()
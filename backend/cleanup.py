@@ -1,102 +1,177 @@
 import os
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from supabase import Client
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 logger = logging.getLogger(__name__)
 
+ORPHAN_WATERMARK_KEY = "orphan_watermark"
+
 
 class DataCleaner:
 
-    def __init__(self, get_supabase: callable, age_days: int = 2, interval_minutes: int = 60, whitelist: list[str] = None):
+    def __init__(self, get_supabase: callable, age_days: int = 2, interval_minutes: int = 60, whitelist: list[str] = None, batch_size: int = 200,
+                 orphan_interval_hours: int = 24, orphan_grace_minutes: int = 60, orphan_page_size: int = 1000,
+                 on_deleted: callable = None):
         self.get_supabase = get_supabase
         self.age_days = age_days
         self.interval_minutes = interval_minutes
         self.whitelist = set(whitelist) if whitelist else set()
-        self.scheduler = BackgroundScheduler()
-
-    def cleanup(self) -> None:
+        # Bounded by the URL length of the PostgREST `in` filter (~37 characters per UUID)
+        self.batch_size = batch_size
+        self.orphan_interval_hours = orphan_interval_hours
+        self.orphan_grace_minutes = orphan_grace_minutes
+        self.orphan_page_size = orphan_page_size
+        # Called with the ids of every deleted page, e.g. to drop the scans from in-process caches
+        self.on_deleted = on_deleted
+        self.scheduler = AsyncIOScheduler()
+
+    async def cleanup(self) -> None:
+        """
+        Deletes scans older than `age_days` and their images, one page of `batch_size` scans at a time.
+
+        Pages are selected by keyset pagination on the id, so whitelisted scans are skipped without
+        re-reading them and the backlog is never loaded into memory at once. Each page costs one
+        storage request and one delete request, instead of one request per scan.
+        """
         try:
-            supabase = self.get_supabase()
+            supabase = await self.get_supabase()
             cutoff = (datetime.now() - timedelta(days=self.age_days)).isoformat()
 
-            old_scans = supabase.table("scans").select("id, image_path").lt("created_at", cutoff).execute()
-
-            if not old_scans.data:
+            deleted = whitelisted = 0
+            last_id = None
+            while True:
+                query = supabase.table("scans").select("id, image_path").lt("created_at", cutoff)
+                if last_id is not None:
+                    query = query.gt("id", last_id)
+                page = (await query.order("id").limit(self.batch_size).execute()).data
+                if not page:
+                    break
+                last_id = page[-1]["id"]
+
+                # Filter out whitelisted scans
+                scans_to_delete = [scan for scan in page if scan["id"] not in self.whitelist]
+                whitelisted += len(page) - len(scans_to_delete)
+                if scans_to_delete:
+                    await self._delete_scans(supabase, scans_to_delete)
+                    deleted += len(scans_to_delete)
+
+                if len(page) < self.batch_size:
+                    break
+
+            if whitelisted > 0:
+                logger.info("Skipping %d whitelisted scans", whitelisted)
+            if deleted:
+                logger.info("Deleted %d scans older than %d days", deleted, self.age_days)
+            else:
                 logger.info("No old scans to clean up")
-                return
-
-            # Filter out whitelisted scans
-            scans_to_delete = [scan for scan in old_scans.data if scan["id"] not in self.whitelist]
-            whitelisted_count = len(old_scans.data) - len(scans_to_delete)
-
-            if whitelisted_count > 0:
-                logger.info("Skipping %d whitelisted scans", whitelisted_count)
-
-            if not scans_to_delete:
-                logger.info("No scans to clean up after whitelist filter")
-                return
-
-            image_paths = [scan["image_path"] for scan in scans_to_delete if scan.get("image_path")]
-            scan_ids = [scan["id"] for scan in scans_to_delete]
-
-            if image_paths:
-                try:
-                    result = supabase.storage.from_("playroom-images").remove(image_paths)
-                    logger.info("Deleted %d images from storage: %s", len(image_paths), result)
-                except Exception as storage_error:
-                    logger.error("Failed to delete images from storage: %s (paths: %s)", storage_error, image_paths)
-
-            # Delete scans by ID to respect whitelist
-            for scan_id in scan_ids:
-                supabase.table("scans").delete().eq("id", scan_id).execute()
-            logger.info("Deleted %d scans older than %d days", len(scan_ids), self.age_days)
 
         except Exception as e:
             logger.error("Cleanup failed: %s", e)
 
-    def cleanup_orphaned_images(self) -> None:
-        """One-time cleanup: delete images not referenced by any scan."""
-        try:
-            supabase = self.get_supabase()
-
-            # Get all image paths from database
-            scans = supabase.table("scans").select("image_path").execute()
-            referenced_paths = {scan["image_path"] for scan in scans.data if scan.get("image_path")}
-
-            # List all files in storage
-            storage_files = supabase.storage.from_("playroom-images").list("scans")
-            if not storage_files:
-                logger.info("No files in storage to check for orphans")
-                return
-
-            # Find orphaned files (in storage but not in database)
-            orphaned_paths = []
-            for file in storage_files:
-                file_path = f"scans/{file['name']}"
-                if file_path not in referenced_paths:
-                    orphaned_paths.append(file_path)
-
-            if not orphaned_paths:
-                logger.info("No orphaned images found")
-                return
-
-            # Delete orphaned files
+    async def _delete_scans(self, supabase, scans: list[dict]) -> None:
+        image_paths = [scan["image_path"] for scan in scans if scan.get("image_path")]
+        if image_paths:
             try:
-                result = supabase.storage.from_("playroom-images").remove(orphaned_paths)
-                logger.info("Deleted %d orphaned images: %s", len(orphaned_paths), result)
-            except Exception as e:
-                logger.error("Failed to delete orphaned images: %s", e)
+                await supabase.storage.from_("playroom-images").remove(image_paths)
+                logger.debug("Deleted %d images from storage", len(image_paths))
+            except Exception as storage_error:
+                logger.error("Failed to delete images from storage: %s (paths: %s)", storage_error, image_paths)
+
+        # Delete scans by ID to respect whitelist
+        scan_ids = [scan["id"] for scan in scans]
+        await supabase.table("scans").delete().in_("id", scan_ids).execute()
+        if self.on_deleted is not None:
+            self.on_deleted(scan_ids)
+
+    async def cleanup_orphaned_images(self) -> None:
+        """
+        Deletes storage images not referenced by any scan.
+
+        Walks the bucket newest first, one page of `orphan_page_size` objects at a time, and only
+        looks up the image paths of the current page in the database, so memory stays bounded
+        however many objects there are. Objects older than the watermark of the last completed
+        pass were already checked and end the pass. Objects younger than `orphan_grace_minutes`
+        are skipped, their scan row may not be inserted yet.
+        """
+        try:
+            supabase = await self.get_supabase()
+            bucket = supabase.storage.from_("playroom-images")
+            watermark = await self._load_state(supabase, ORPHAN_WATERMARK_KEY)
+            grace_cutoff = datetime.now(timezone.utc) - timedelta(minutes=self.orphan_grace_minutes)
+
+            newest_checked = None
+            offset = checked = deleted = 0
+            while True:
+                files = await bucket.list("scans", {
+                    "limit": self.orphan_page_size,
+                    "offset": offset,
+                    "sortBy": {"column": "created_at", "order": "desc"},
+                })
+                if not files:
+                    break
+
+                candidates = []
+                reached_watermark = False
+                for file in files:
+                    if not file.get("id"):
+                        continue  # Folder placeholder, not an object
+                    # Objects created at the watermark itself are checked again, they may not all have been seen
+                    if watermark is not None and file["created_at"] < watermark:
+                        reached_watermark = True
+                        break
+                    if datetime.fromisoformat(file["created_at"]) > grace_cutoff:
+                        continue
+                    newest_checked = newest_checked or file["created_at"]
+                    candidates.append(f"scans/{file['name']}")
+
+                removed = await self._remove_orphans(supabase, candidates)
+                checked += len(candidates)
+                deleted += removed
+
+                if reached_watermark or len(files) < self.orphan_page_size:
+                    break
+                # Removed objects shift the following ones up into the current page
+                offset += len(files) - removed
+
+            if newest_checked is not None:
+                await self._save_state(supabase, ORPHAN_WATERMARK_KEY, newest_checked)
+            logger.info("Checked %d images for orphans, deleted %d (watermark %s)", checked, deleted, newest_checked or watermark)
 
         except Exception as e:
             logger.error("Orphan cleanup failed: %s", e)
 
-    def start(self) -> None:
-        self.cleanup_orphaned_images()  # One-time orphan cleanup on startup
-        self.cleanup()
-        self.scheduler.add_job(self.cleanup, "interval", minutes=self.interval_minutes)
+    async def _remove_orphans(self, supabase, paths: list[str]) -> int:
+        referenced_paths = set()
+        for i in range(0, len(paths), self.batch_size):
+            chunk = paths[i:i + self.batch_size]
+            scans = await supabase.table("scans").select("image_path").in_("image_path", chunk).execute()
+            referenced_paths.update(scan["image_path"] for scan in scans.data)
+
+        orphaned_paths = [path for path in paths if path not in referenced_paths]
+        if not orphaned_paths:
+            return 0
+
+        # Errors abort the pass before the watermark moves, so the next pass checks these objects again
+        await supabase.storage.from_("playroom-images").remove(orphaned_paths)
+        logger.debug("Deleted %d orphaned images", len(orphaned_paths))
+        return len(orphaned_paths)
+
+    @staticmethod
+    async def _load_state(supabase, key: str) -> str | None:
+        result = await supabase.table("cleanup_state").select("value").eq("key", key).execute()
+        return result.data[0]["value"] if result.data else None
+
+    @staticmethod
+    async def _save_state(supabase, key: str, value: str) -> None:
+        await supabase.table("cleanup_state").upsert({"key": key, "value": value}, on_conflict="key").execute()
+
+    async def start(self) -> None:
+        # Both jobs run in the background right away, startup doesn't wait for them
+        now = datetime.now()
+        self.scheduler.add_job(self.cleanup, "interval", minutes=self.interval_minutes, next_run_time=now)
+        self.scheduler.add_job(self.cleanup_orphaned_images, "interval", hours=self.orphan_interval_hours, next_run_time=now)
         self.scheduler.start()
         logger.info("Started data cleaner (age_days=%d, interval=%dm, whitelist=%d)", self.age_days, self.interval_minutes, len(self.whitelist))
 
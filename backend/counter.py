@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+from supabase import AsyncClient
+
+
+def utc_today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+class SupabaseScanCounter:
+    """
+    Daily scan counter shared by all workers, one row per UTC day in `daily_scan_counts`.
+
+    `increment_daily_scans` increments and checks the limit in a single statement, so concurrent
+    uploads on different workers can never push the count past the limit.
+    """
+
+    def __init__(self, get_supabase: Callable[[], Awaitable[AsyncClient]], limit: int):
+        self.get_supabase = get_supabase
+        self.limit = limit
+
+    async def try_increment(self) -> int | None:
+        """Reserves one scan for today. Returns the new count, or None if the limit is reached."""
+        client = await self.get_supabase()
+        result = await client.rpc("increment_daily_scans", {"p_limit": self.limit}).execute()
+        return result.data
+
+    async def release(self) -> None:
+        """Gives back a reservation whose scan was never created."""
+        client = await self.get_supabase()
+        await client.rpc("decrement_daily_scans", {}).execute()
+
+    async def get(self) -> int:
+        client = await self.get_supabase()
+        result = await client.table("daily_scan_counts").select("count").eq("day", utc_today()).execute()
+        return result.data[0]["count"] if result.data else 0
+
+
+class LocalScanCounter:
+    """In-process counter with the same semantics, for tests and single-worker setups."""
+
+    def __init__(self, limit: int, today: Callable[[], str] = utc_today):
+        self.limit = limit
+        self.today = today
+        self._counts: dict[str, int] = {}
+        self._lock = asyncio.Lock()
+
+    async def try_increment(self) -> int | None:
+        async with self._lock:
+            day = self.today()
+            count = self._counts.get(day, 0)
+            if count >= self.limit:
+                return None
+            # Only today's count is ever needed
+            self._counts = {day: count + 1}
+            return count + 1
+
+    async def release(self) -> None:
+        async with self._lock:
+            day = self.today()
+            if self._counts.get(day, 0) > 0:
+                self._counts[day] -= 1
+
+    async def get(self) -> int:
+        return self._counts.get(self.today(), 0)
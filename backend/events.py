@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+# Airflow fails a scan for good after its last attempt, see the scan leases in the Airflow README
+TERMINAL_STATUSES = {"done", "failed"}
+
+
+class ScanWatcher:
+    """Polls a single scan and fans every change out to all subscribed queues."""
+
+    def __init__(self, scan_id: str, fetch_scan: callable, poll_interval: float):
+        self.scan_id = scan_id
+        self.fetch_scan = fetch_scan
+        self.poll_interval = poll_interval
+        self.subscribers: set[asyncio.Queue] = set()
+        self.last_event: dict | None = None
+        self.task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self.task and not self.task.done():
+            self.task.cancel()
+
+    def _publish(self, event: dict) -> None:
+        self.last_event = event
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                scan = await self.fetch_scan(self.scan_id)
+            except Exception as e:
+                logger.warning("Failed to poll scan %s: %s", self.scan_id, e)
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            if scan is None:
+                self._publish({"type": "not_found", "scan_id": self.scan_id})
+                return
+
+            event = {
+                "type": "status",
+                "scan_id": self.scan_id,
+                "status": scan["status"],
+                "progress": scan.get("progress") or {},
+            }
+            if self.last_event is None or event != self.last_event:
+                self._publish(event)
+
+            if scan["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(self.poll_interval)
+
+
+class ScanEventHub:
+    """
+    Shares one watcher per scan between all connected clients, so the database
+    is polled once per interval per scan, no matter how many tabs are open.
+    """
+
+    def __init__(self, fetch_scan: callable, poll_interval: float = 2.0, heartbeat_interval: float = 15.0):
+        self.fetch_scan = fetch_scan
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.watchers: dict[str, ScanWatcher] = {}
+
+    async def subscribe(self, scan_id: str) -> AsyncIterator[dict | None]:
+        """Yields scan events until the scan reaches a terminal state; yields None as a heartbeat."""
+        watcher = self.watchers.get(scan_id)
+        if watcher is None:
+            watcher = ScanWatcher(scan_id, self.fetch_scan, self.poll_interval)
+            self.watchers[scan_id] = watcher
+            watcher.start()
+
+        queue: asyncio.Queue = asyncio.Queue()
+        watcher.subscribers.add(queue)
+        if watcher.last_event is not None:
+            queue.put_nowait(watcher.last_event)
+
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=self.heartbeat_interval)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+
+                yield event
+                if event["type"] == "not_found" or event.get("status") in TERMINAL_STATUSES:
+                    return
+        finally:
+            watcher.subscribers.discard(queue)
+            if not watcher.subscribers and self.watchers.get(scan_id) is watcher:
+                watcher.stop()
+                del self.watchers[scan_id]
@@ -0,0 +1,40 @@
+from io import BytesIO
+
+from PIL import Image, ImageOps
+from pillow_heif import register_heif_opener
+
+from phash import dhash
+
+# Lets Pillow decode HEIC/HEIF photos straight off iPhones
+register_heif_opener()
+
+FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "webp": ("WEBP", "image/webp", "webp"),
+}
+
+
+def normalize_image(data: bytes, max_edge: int = 2048, image_format: str = "jpeg", quality: int = 85) -> tuple[bytes, str, str, int | None]:
+    """
+    Decodes an upload, applies the EXIF orientation, downscales it to `max_edge` and re-encodes it
+    without any metadata. Returns the encoded bytes, content type, file extension and the
+    perceptual hash of the normalized image, None if it is too uniform to tell photos apart.
+
+    CPU bound, meant to run in a process pool. Raises ValueError for anything that isn't a decodable image.
+    """
+    pil_format, content_type, extension = FORMATS[image_format]
+
+    try:
+        with Image.open(BytesIO(data)) as image:
+            # JPEG decoders can skip straight to a reduced scale that is still >= max_edge
+            image.draft("RGB", (max_edge, max_edge))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Unsupported image: {e}") from e
+
+    image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    buffer = BytesIO()
+    # A fresh save without exif/icc arguments drops all metadata, including GPS tags
+    image.save(buffer, pil_format, quality=quality, optimize=True)
+    return buffer.getvalue(), content_type, extension, dhash(image)
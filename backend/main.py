@@ -1,39 +1,56 @@
+import asyncio
 import hashlib
+import json
 import logging
 import os
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import asynccontextmanager
-from datetime import datetime, date, timezone
-from time import time
+from datetime import datetime, date
+from typing import Literal
 
 from dotenv import load_dotenv
 
 logging.basicConfig(level=logging.INFO)
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from postgrest.exceptions import APIError
 from slowapi import Limiter
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
-from supabase import create_client, Client
+from supabase import acreate_client, AsyncClient
 
-from airflow import AirflowClient
+from airflow import AirflowClient, TriggerCoalescer
 from cleanup import DataCleaner
+from counter import LocalScanCounter, SupabaseScanCounter
+from events import ScanEventHub
+from images import normalize_image
+from metrics import PROMETHEUS_CONTENT_TYPE, ScanMetricsCollector, format_counter
+from phash import PerceptualHashIndex, is_low_information, to_hex, from_hex
+from results import compact_result, section_status
+from scan_cache import ScanCache, etag_matches
 
 load_dotenv()
 
-supabase: Client | None = None
+logger = logging.getLogger(__name__)
+
+supabase: AsyncClient | None = None
 airflow_client: AirflowClient | None = None
+trigger_coalescer: TriggerCoalescer | None = None
+_supabase_lock = asyncio.Lock()
 
-def get_supabase() -> Client:
+async def get_supabase() -> AsyncClient:
     global supabase
     if supabase is None:
-        url = os.getenv("SUPABASE_URL", "")
-        key = os.getenv("SUPABASE_SECRET_KEY", "")
-        if not url or not key:
-            raise ValueError("Missing SUPABASE_URL or SUPABASE_SECRET_KEY")
-        supabase = create_client(url, key)
+        async with _supabase_lock:
+            if supabase is None:
+                url = os.getenv("SUPABASE_URL", "")
+                key = os.getenv("SUPABASE_SECRET_KEY", "")
+                if not url or not key:
+                    raise ValueError("Missing SUPABASE_URL or SUPABASE_SECRET_KEY")
+                supabase = await acreate_client(url, key)
 
     return supabase
 
@@ -54,20 +71,134 @@ POST_RATE_LIMIT = os.getenv("POST_RATE_LIMIT", "5/minute")
 CLEANUP_AGE_DAYS = int(os.getenv("CLEANUP_AGE_DAYS", "2"))
 CLEANUP_INTERVAL_MINUTES = int(os.getenv("CLEANUP_INTERVAL_MINUTES", "60"))
 CLEANUP_WHITELIST = [x.strip() for x in os.getenv("CLEANUP_WHITELIST", "").split(",") if x.strip()]
-limiter = Limiter(key_func=get_remote_address)
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "200"))
+ORPHAN_CLEANUP_INTERVAL_HOURS = int(os.getenv("ORPHAN_CLEANUP_INTERVAL_HOURS", "24"))
+ORPHAN_GRACE_MINUTES = int(os.getenv("ORPHAN_GRACE_MINUTES", "60"))
+SCAN_EVENTS_POLL_SECONDS = float(os.getenv("SCAN_EVENTS_POLL_SECONDS", "2"))
+TRIGGER_COALESCE_SECONDS = float(os.getenv("TRIGGER_COALESCE_SECONDS", "5"))
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "2048"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg")
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "0")) or None
+# Uploads processed at once per worker, the rest wait their turn. Below the 100 connections of the
+# Supabase client pool, so a burst queues here instead of timing out halfway through the pool.
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "64"))
+SCAN_CACHE_SIZE = int(os.getenv("SCAN_CACHE_SIZE", "1024"))
+SCAN_CACHE_TTL_SECONDS = float(os.getenv("SCAN_CACHE_TTL_SECONDS", "3600"))
+METRICS_REFRESH_SECONDS = float(os.getenv("METRICS_REFRESH_SECONDS", "10"))
+# Results of a done scan never change, browsers and CDNs may keep them until the cleanup deletes the scan
+DONE_SCAN_CACHE_CONTROL = f"public, max-age={CLEANUP_AGE_DAYS * 24 * 3600}, immutable"
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1000"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# Only what the response is built from, not the hashes, run id and timestamps of the row.
+# `results_json` holds the sections done so far while a scan is pending, `progress` their status.
+SCAN_COLUMNS = "status, child_age, image_path, results_json, progress"
+# Shared storage (e.g. redis://host:6379) makes the limits apply across all workers and replicas,
+# the default in-memory storage counts per process
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "moving-window")
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    strategy=RATE_LIMIT_STRATEGY,
+    # Falls back to per-process limits while the shared storage is unreachable, instead of failing requests
+    in_memory_fallback_enabled=True,
+)
 
-_scan_count_cache = {"count": 0, "timestamp": 0}
-CACHE_TTL_SECONDS = 5
+# "supabase" shares the daily count between all workers, "local" counts per process
+SCAN_COUNTER_BACKEND = os.getenv("SCAN_COUNTER_BACKEND", "supabase")
+scan_counter = (
+    LocalScanCounter(DAILY_SCAN_LIMIT) if SCAN_COUNTER_BACKEND == "local"
+    else SupabaseScanCounter(get_supabase, DAILY_SCAN_LIMIT)
+)
 
 data_cleaner: DataCleaner | None = None
+image_pool: ProcessPoolExecutor | None = None
+phash_index = PerceptualHashIndex(PHASH_MAX_DISTANCE)
+scan_cache = ScanCache(SCAN_CACHE_SIZE, SCAN_CACHE_TTL_SECONDS)
+upload_slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+scan_metrics = ScanMetricsCollector(get_supabase, METRICS_REFRESH_SECONDS)
+
+
+async def fetch_scan_status(scan_id: str) -> dict | None:
+    client = await get_supabase()
+    try:
+        result = await client.table("scans").select("status, progress").eq("id", scan_id).execute()
+    except APIError:
+        return None
+
+    return result.data[0] if result.data else None
+
+event_hub = ScanEventHub(fetch_scan_status, SCAN_EVENTS_POLL_SECONDS)
+
+
+async def record_dag_run(scan_ids: list[str], dag_run_id: str) -> None:
+    client = await get_supabase()
+    # Only scans no run has claimed yet. A trailing trigger can land after an earlier run claimed
+    # the scans, that run owns them now and scopes its writes by its own ID in `dag_run_id`.
+    await client.table("scans").update({"dag_run_id": dag_run_id}).in_("id", scan_ids).eq("status", "processing").execute()
+
+def get_trigger_coalescer() -> TriggerCoalescer:
+    global trigger_coalescer
+    if trigger_coalescer is None:
+        trigger_coalescer = TriggerCoalescer(get_airflow(), "process_scans", TRIGGER_COALESCE_SECONDS, record_dag_run)
+
+    return trigger_coalescer
+
+async def load_phash_index(page_size: int = 1000) -> None:
+    try:
+        client = await get_supabase()
+        start = 0
+        while True:
+            result = await client.table("scans").select("id, image_phash").order("created_at").range(start, start + page_size - 1).execute()
+            for scan in result.data:
+                # Hashes of flat images stored before they were left out would match each other
+                if scan.get("image_phash") and not is_low_information(from_hex(scan["image_phash"])):
+                    phash_index.add(scan["id"], from_hex(scan["image_phash"]))
+            if len(result.data) < page_size:
+                break
+            start += page_size
+        logger.info("Loaded %d perceptual hashes", len(phash_index))
+    except Exception as e:
+        logger.error("Failed to load perceptual hashes: %s", e)
+
+
+def client_id(request: Request) -> str:
+    # Airflow claims scans fairly between clients, identified like the rate limits by their address, stored hashed
+    return hashlib.sha256(get_remote_address(request).encode()).hexdigest()[:16]
+
+
+async def find_near_duplicate(image_phash: int) -> dict | None:
+    client = await get_supabase()
+    while (match := phash_index.find(image_phash)) is not None:
+        result = await client.table("scans").select("id, status").eq("id", match[0]).execute()
+        if result.data and result.data[0]["status"] != "failed":
+            return result.data[0]
+        # Scan was cleaned up in the meantime, or failed and must not be reused
+        phash_index.remove(match[0])
+    return None
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global data_cleaner
-    data_cleaner = DataCleaner(get_supabase, CLEANUP_AGE_DAYS, CLEANUP_INTERVAL_MINUTES, CLEANUP_WHITELIST)
-    data_cleaner.start()
+    global data_cleaner, image_pool
+    image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    phash_loader = asyncio.create_task(load_phash_index())
+    data_cleaner = DataCleaner(
+        get_supabase, CLEANUP_AGE_DAYS, CLEANUP_INTERVAL_MINUTES, CLEANUP_WHITELIST, CLEANUP_BATCH_SIZE,
+        orphan_interval_hours=ORPHAN_CLEANUP_INTERVAL_HOURS, orphan_grace_minutes=ORPHAN_GRACE_MINUTES,
+        on_deleted=scan_cache.invalidate
+    )
+    await data_cleaner.start()
     yield
+    phash_loader.cancel()
     data_cleaner.stop()
+    image_pool.shutdown(cancel_futures=True)
+    if trigger_coalescer is not None:
+        await trigger_coalescer.close()
+    if airflow_client is not None:
+        await airflow_client.close()
 
 app = FastAPI(title="Playroom Diet API", lifespan=lifespan)
 app.state.limiter = limiter
@@ -86,20 +217,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-
-def get_today_scan_count(bypass_cache: bool = False) -> int:
-    now = time()
-    if not bypass_cache and now - _scan_count_cache["timestamp"] < CACHE_TTL_SECONDS:
-        return _scan_count_cache["count"]
-
-    # Use UTC midnight for consistent comparison with database timestamps
-    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-    result = get_supabase().table("scans").select("id", count="exact").gte("created_at", today_start).execute()
-    count = result.count or 0
-
-    _scan_count_cache["count"] = count
-    _scan_count_cache["timestamp"] = now
-    return count
+# Result payloads are repetitive JSON and shrink several times over, the event stream is never compressed
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_LEVEL)
 
 
 @app.get("/")
@@ -109,8 +228,8 @@ def health_check():
 
 @app.get("/api/limits")
 @limiter.limit(GET_RATE_LIMIT)
-def get_limits(request: Request):
-    current_count = get_today_scan_count()
+async def get_limits(request: Request):
+    current_count = await scan_counter.get()
     return {
         "daily_scan_limit": DAILY_SCAN_LIMIT,
         "scans_today": current_count,
@@ -120,25 +239,95 @@ def get_limits(request: Request):
 
 @app.get("/api/scan/{scan_id}")
 @limiter.limit(GET_RATE_LIMIT)
-def get_scan(request: Request, scan_id: str):
-    try:
-        result = get_supabase().table("scans").select("*").eq("id", scan_id).execute()
-    except APIError:
-        raise HTTPException(status_code=404, detail="Scan not found")
+async def get_scan(
+    request: Request,
+    scan_id: str,
+    fields: Literal["all", "status"] = "all",
+    view: Literal["full", "compact"] = "full"
+):
+    # Finished scans are answered from the cache, without touching the database
+    cached = scan_cache.get(scan_id)
+    if cached is None:
+        client = await get_supabase()
+        try:
+            # Status checks of pending scans only need the status column
+            result = await client.table("scans").select("status" if fields == "status" else SCAN_COLUMNS).eq("id", scan_id).execute()
+        except APIError:
+            raise HTTPException(status_code=404, detail="Scan not found")
+
+        if not result.data:
+            raise HTTPException(status_code=404, detail="Scan not found")
+
+        scan = result.data[0]
+        if fields == "status":
+            return JSONResponse({"scan_id": scan_id, "status": scan["status"]}, headers={"Cache-Control": "no-cache"})
+
+        image_url = await client.storage.from_("playroom-images").get_public_url(scan["image_path"]) if scan.get("image_path") else None
+
+        payload = {
+            "scan_id": scan_id,
+            "status": scan["status"],
+            "image_url": image_url,
+            "child_age": scan.get("child_age"),
+            # Partial while the scan is pending, the frontend shows each section once it is done
+            "result": scan.get("results_json"),
+            "sections": section_status(scan["status"], scan.get("progress"))
+        }
+        if scan["status"] != "done":
+            if view == "compact":
+                payload["result"] = compact_result(payload["result"])
+            return JSONResponse(payload, headers={"Cache-Control": "no-cache"})
+        cached = scan_cache.put(scan_id, payload)
+
+    if fields == "status":
+        return JSONResponse({"scan_id": scan_id, "status": cached.payload["status"]}, headers={"Cache-Control": DONE_SCAN_CACHE_CONTROL})
+
+    payload, etag = cached.payload, cached.etag
+    if view == "compact":
+        payload = {**payload, "result": compact_result(payload["result"])}
+        etag = f'{etag[:-1]}-compact"'
+
+    headers = {"ETag": etag, "Cache-Control": DONE_SCAN_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
+
+
+@app.get("/api/cache/stats")
+@limiter.limit(GET_RATE_LIMIT)
+async def get_cache_stats(request: Request):
+    return {"scan_cache": scan_cache.stats()}
 
-    if not result.data:
-        raise HTTPException(status_code=404, detail="Scan not found")
 
-    scan = result.data[0]
-    image_url = get_supabase().storage.from_("playroom-images").get_public_url(scan["image_path"]) if scan.get("image_path") else None
+@app.get("/api/metrics")
+async def get_metrics():
+    """Prometheus metrics: per-stage latency, tokens and tool calls of completed scans, result cache counters."""
+    await scan_metrics.refresh()
+    lines = [
+        *scan_metrics.render(),
+        *format_counter("playroom_scan_cache_hits_total", "Scan views served from the result cache", [({}, scan_cache.hits)]),
+        *format_counter("playroom_scan_cache_misses_total", "Scan views that queried the database", [({}, scan_cache.misses)]),
+    ]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type=PROMETHEUS_CONTENT_TYPE)
 
-    return {
-        "scan_id": scan_id,
-        "status": scan["status"],
-        "image_url": image_url,
-        "child_age": scan.get("child_age"),
-        "result": scan.get("results_json") if scan["status"] == "done" else None
-    }
+
+@app.get("/api/scan/{scan_id}/events")
+@limiter.limit(GET_RATE_LIMIT)
+async def get_scan_events(request: Request, scan_id: str):
+    async def stream():
+        async for event in event_hub.subscribe(scan_id):
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.post("/api/scan")
@@ -149,38 +338,65 @@ async def create_scan(
     file: UploadFile = File(...)
 ):
     try:
-        file_content = await file.read()
-        image_hash = hashlib.sha256(file_content).hexdigest()
-
-        existing = get_supabase().table("scans").select("id, status").eq("image_hash", image_hash).execute()
-        if existing.data:
-            existing_scan = existing.data[0]
-            return {"scan_id": existing_scan["id"], "cached": True, "status": existing_scan["status"]}
-
-        current_count = get_today_scan_count(bypass_cache=True)
-        if current_count >= DAILY_SCAN_LIMIT:
-            raise HTTPException(status_code=429, detail="Daily scan limit reached")
-
-        scan_id = str(uuid.uuid4())
-        file_ext = file.filename.split(".")[-1]
-        file_path = f"scans/{scan_id}.{file_ext}"
-
-        get_supabase().storage.from_("playroom-images").upload(
-            path=file_path,
-            file=file_content,
-            file_options={"content-type": file.content_type or "image/jpeg"}
-        )
-
-        get_supabase().table("scans").insert({
-            "id": scan_id,
-            "child_age": age,
-            "image_path": file_path,
-            "image_hash": image_hash,
-            "status": "processing",
-            "created_at": datetime.now().isoformat()
-        }).execute()
-
-        dag_run_id = get_airflow().trigger_dag("process_scans")
+        async with upload_slots:
+            file_content = await file.read()
+            image_hash = hashlib.sha256(file_content).hexdigest()
+
+            client = await get_supabase()
+            existing = await client.table("scans").select("id, status").eq("image_hash", image_hash).execute()
+            # Uploading the photo of a failed scan again is how users retry it
+            existing = [scan for scan in existing.data if scan["status"] != "failed"]
+            if existing:
+                existing_scan = existing[0]
+                return {"scan_id": existing_scan["id"], "cached": True, "status": existing_scan["status"]}
+
+            # Decoding and re-encoding is CPU bound, keep it off the event loop
+            try:
+                normalized_content, content_type, file_ext, image_phash = await asyncio.get_running_loop().run_in_executor(
+                    image_pool, normalize_image, file_content, IMAGE_MAX_EDGE, IMAGE_FORMAT, IMAGE_QUALITY
+                )
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Unsupported image format")
+
+            # Re-encoded, resized or EXIF-stripped copies of a known photo reuse its results. Flat
+            # images have no hash, they only match uploads of the exact same bytes.
+            near_duplicate = await find_near_duplicate(image_phash) if image_phash is not None else None
+            if near_duplicate:
+                return {"scan_id": near_duplicate["id"], "cached": True, "status": near_duplicate["status"]}
+
+            # Increment and check in one step, concurrent uploads can't overshoot the limit
+            if await scan_counter.try_increment() is None:
+                raise HTTPException(status_code=429, detail="Daily scan limit reached")
+
+            scan_id = str(uuid.uuid4())
+            file_path = f"scans/{scan_id}.{file_ext}"
+
+            try:
+                await client.storage.from_("playroom-images").upload(
+                    path=file_path,
+                    file=normalized_content,
+                    file_options={"content-type": content_type}
+                )
+
+                await client.table("scans").insert({
+                    "id": scan_id,
+                    "child_age": age,
+                    "image_path": file_path,
+                    "image_hash": image_hash,
+                    "image_phash": to_hex(image_phash) if image_phash is not None else None,
+                    "status": "processing",
+                    "client_id": client_id(request),
+                    "created_at": datetime.now().isoformat()
+                }).execute()
+            except Exception:
+                # The scan was never created, it must not count towards the limit
+                await scan_counter.release()
+                raise
+            if image_phash is not None:
+                phash_index.add(scan_id, image_phash)
+
+        # Outside the slot, uploads queue on the lock of the coalescer while it triggers a run
+        dag_run_id = await get_trigger_coalescer().request(scan_id)
         return {"scan_id": scan_id, "dag_run_id": dag_run_id, "cached": False}
     except HTTPException:
         raise
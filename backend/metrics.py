@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+from supabase import AsyncClient
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DURATION_BUCKETS = (1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+TOKEN_KINDS = ("input", "output", "thinking")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    return "+Inf" if value == math.inf else f"{value:g}"
+
+
+def format_counter(name: str, help: str, samples: list[tuple[dict, float]]) -> list[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} counter", *(f"{name}{_labels(labels)} {_number(value)}" for labels, value in samples)]
+
+
+class Histogram:
+    """Cumulative Prometheus histogram with labels, rendered in the text exposition format."""
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.buckets = (*buckets, math.inf)
+        self._series: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        counts, total = self._series.setdefault(key, ([0] * len(self.buckets), [0.0]))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._series.items()):
+            labels = dict(key)
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels({**labels, 'le': _number(bound)})} {count}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {_number(total[0])}")
+            lines.append(f"{self.name}_count{_labels(labels)} {counts[-1]}")
+        return lines
+
+
+class ScanMetricsCollector:
+    """
+    Aggregates the per-stage metrics the Airflow pipeline stores with each scan into histograms.
+
+    Scans are read incrementally by `completed_at`, at most once every `refresh_seconds`, so a
+    scrape costs one small query no matter how many scans exist. Like any Prometheus counter, the
+    histograms start empty when the worker starts and only count scans completed since.
+    """
+
+    def __init__(self, get_supabase: Callable[[], Awaitable[AsyncClient]], refresh_seconds: float = 10, page_size: int = 500,
+                 clock: Callable[[], float] = time.monotonic):
+        self.get_supabase = get_supabase
+        self.refresh_seconds = refresh_seconds
+        self.page_size = page_size
+        self.clock = clock
+        self.watermark = datetime.now(timezone.utc).isoformat()
+        self._refreshed_at: float | None = None
+        self._lock = asyncio.Lock()
+
+        self.scans = 0
+        self.duration = Histogram("playroom_stage_duration_seconds", "Wall time of an agent stage per scan", DURATION_BUCKETS)
+        self.tokens = Histogram("playroom_stage_tokens", "Tokens used by an agent stage per scan", TOKEN_BUCKETS)
+        self.requests: dict[tuple[str, str], int] = {}
+        self.tool_calls: dict[str, int] = {}
+        self.throttled: dict[str, int] = {}
+        # Analyses run with ANALYSIS_TIERING, by tier and reason for escalating
+        self.tier_duration = Histogram("playroom_analysis_tier_duration_seconds",
+                                       "Wall time of a tiered analysis, including the fast attempt of escalated ones", DURATION_BUCKETS)
+        self.tiers: dict[tuple[str, str], int] = {}
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            if self._refreshed_at is not None and self.clock() - self._refreshed_at < self.refresh_seconds:
+                return
+            self._refreshed_at = self.clock()
+            try:
+                client = await self.get_supabase()
+                while True:
+                    result = await client.table("scans").select("completed_at, metrics").gt("completed_at", self.watermark) \
+                        .order("completed_at").limit(self.page_size).execute()
+                    for scan in result.data:
+                        self.observe(scan.get("metrics") or {})
+                    if result.data:
+                        self.watermark = result.data[-1]["completed_at"]
+                    if len(result.data) < self.page_size:
+                        break
+            except Exception as e:
+                logger.error("Failed to read scan metrics: %s", e)
+
+    def observe(self, scan_metrics: dict) -> None:
+        self.scans += 1
+        for stage, metrics in scan_metrics.items():
+            model = metrics.get("model") or "unknown"
+            self.duration.observe(metrics.get("seconds", 0.0), stage=stage, model=model)
+            # Stages answered from the agent result cache made no model request and used no tokens
+            if metrics.get("requests"):
+                for kind in TOKEN_KINDS:
+                    self.tokens.observe(metrics.get(f"{kind}_tokens", 0), stage=stage, kind=kind)
+            self.requests[(stage, model)] = self.requests.get((stage, model), 0) + metrics.get("requests", 0)
+            self.tool_calls[stage] = self.tool_calls.get(stage, 0) + metrics.get("tool_calls", 0)
+            self.throttled[stage] = self.throttled.get(stage, 0) + metrics.get("throttled", 0)
+            if metrics.get("tier"):
+                key = (metrics["tier"], metrics.get("escalation") or "none")
+                self.tier_duration.observe(metrics.get("seconds", 0.0), tier=key[0], escalation=key[1])
+                self.tiers[key] = self.tiers.get(key, 0) + 1
+
+    def render(self) -> list[str]:
+        return [
+            *format_counter("playroom_scans_completed_total", "Scans completed since the worker started", [({}, self.scans)]),
+            *self.duration.render(),
+            *self.tokens.render(),
+            *format_counter("playroom_stage_model_requests_total", "Model requests of an agent stage",
+                            [({"stage": stage, "model": model}, count) for (stage, model), count in sorted(self.requests.items())]),
+            *format_counter("playroom_stage_tool_calls_total", "Tool calls of an agent stage",
+                            [({"stage": stage}, count) for stage, count in sorted(self.tool_calls.items())]),
+            *format_counter("playroom_stage_throttled_total", "Model calls of an agent stage rejected with 429 or 503 and retried",
+                            [({"stage": stage}, count) for stage, count in sorted(self.throttled.items())]),
+            *format_counter("playroom_analysis_tier_total", "Tiered analyses by the tier that answered and the reason for escalating",
+                            [({"tier": tier, "escalation": escalation}, count) for (tier, escalation), count in sorted(self.tiers.items())]),
+            *self.tier_duration.render(),
+        ]
@@ -0,0 +1,103 @@
+from collections import defaultdict
+
+from PIL import Image, ImageOps
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+# Thumbnails whose gray levels span less than this are flat: black, blank or covered-lens shots,
+# their bits are sensor noise
+FLAT_RANGE = 16
+# Hashes with fewer set or fewer unset bits than this say little more than "uniform" or "gradient"
+MIN_INFORMATION_BITS = 8
+
+
+def is_low_information(value: int) -> bool:
+    ones = value.bit_count()
+    return ones < MIN_INFORMATION_BITS or HASH_BITS - ones < MIN_INFORMATION_BITS
+
+
+def dhash(image: Image.Image) -> int | None:
+    """
+    64-bit difference hash: compares neighbouring pixels of a 9x8 grayscale thumbnail.
+    Survives re-encoding, resizing and metadata changes, unlike a hash of the raw bytes.
+
+    None for flat thumbnails and low-information hashes. All black photos hash alike, as do
+    transparent or 1x1 images, so matching them would hand one user the scan of another.
+    """
+    gray = ImageOps.exif_transpose(image).convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = gray.tobytes()
+    if max(pixels) - min(pixels) < FLAT_RANGE:
+        return None
+
+    bits = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return None if is_low_information(bits) else bits
+
+
+def to_hex(value: int) -> str:
+    return f"{value:016x}"
+
+
+def from_hex(value: str) -> int:
+    return int(value, 16)
+
+
+class PerceptualHashIndex:
+    """
+    Finds the nearest stored hash within `max_distance` bits (Hamming distance).
+
+    Uses multi-index hashing: each hash is split into `max_distance + 1` bands. Two hashes that
+    differ in at most `max_distance` bits must agree exactly on at least one band, so only keys
+    sharing a band are compared instead of scanning every stored hash.
+    """
+
+    def __init__(self, max_distance: int = 6):
+        self.max_distance = max_distance
+        band_count = max_distance + 1
+        widths = [HASH_BITS // band_count + (1 if i < HASH_BITS % band_count else 0) for i in range(band_count)]
+
+        self._bands: list[tuple[int, int]] = []
+        shift = 0
+        for width in widths:
+            self._bands.append((shift, (1 << width) - 1))
+            shift += width
+
+        self._tables: list[dict[int, set[str]]] = [defaultdict(set) for _ in self._bands]
+        self._hashes: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, key: str, value: int) -> None:
+        self.remove(key)
+        self._hashes[key] = value
+        for table, (shift, mask) in zip(self._tables, self._bands):
+            table[(value >> shift) & mask].add(key)
+
+    def remove(self, key: str) -> None:
+        value = self._hashes.pop(key, None)
+        if value is None:
+            return
+        for table, (shift, mask) in zip(self._tables, self._bands):
+            bucket = table[(value >> shift) & mask]
+            bucket.discard(key)
+            if not bucket:
+                del table[(value >> shift) & mask]
+
+    def find(self, value: int) -> tuple[str, int] | None:
+        """Returns the closest key and its distance, or None if nothing is within `max_distance`."""
+        best: tuple[str, int] | None = None
+        seen = set()
+        for table, (shift, mask) in zip(self._tables, self._bands):
+            for key in table.get((value >> shift) & mask, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                distance = (self._hashes[key] ^ value).bit_count()
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (key, distance)
+        return best
@@ -0,0 +1,37 @@
+# Per-item fields left out of the compact view, the bulk of a large inventory
+COMPACT_OMITTED_FIELDS = {
+    "toy_inventory": ("bbox",),
+    "roadmap": ("reasoning",),
+}
+
+
+# Sections of `results_json` and the Airflow agent stage that fills each in, see `include/results.py` there
+RESULT_SECTIONS = {
+    "toy_inventory": "analyze_image",
+    "play_quest": "generate_play_quest",
+    "analysis": "analyze_playroom",
+    "safety": "safety_check",
+}
+
+
+def section_status(status: str, progress: dict | None) -> dict[str, str]:
+    """`pending`, `running` or `done` per section, from the `progress` of the scan's agent stages."""
+    if status == "done":
+        return {section: "done" for section in RESULT_SECTIONS}
+    progress = progress or {}
+    return {section: progress.get(stage, "pending") for section, stage in RESULT_SECTIONS.items()}
+
+
+def compact_result(result: dict | None) -> dict | None:
+    """`results_json` without the bounding boxes of every toy and the reasoning of every roadmap item."""
+    if not result:
+        return result
+
+    compact = dict(result)
+    for section, fields in COMPACT_OMITTED_FIELDS.items():
+        if isinstance(result.get(section), list):
+            compact[section] = [
+                {key: value for key, value in item.items() if key not in fields} if isinstance(item, dict) else item
+                for item in result[section]
+            ]
+    return compact
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Callable, NamedTuple
+
+
+class CachedScan(NamedTuple):
+    payload: dict
+    etag: str
+    expires_at: float
+
+
+def compute_etag(payload: dict) -> str:
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Weak comparison as required for If-None-Match, accepts a list of tags and `*`."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+class ScanCache:
+    """
+    Bounded LRU of the response payloads of finished scans, per worker.
+
+    Results of a `done` scan never change, so repeat views are served without a database query.
+    Entries only go away when the cleanup deletes the scan: the worker running the cleanup drops
+    them right away, other workers after `ttl_seconds` at the latest.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, CachedScan] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, scan_id: str) -> CachedScan | None:
+        entry = self._entries.get(scan_id)
+        if entry is None or entry.expires_at <= self.clock():
+            if entry is not None:
+                del self._entries[scan_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(scan_id)
+        self.hits += 1
+        return entry
+
+    def put(self, scan_id: str, payload: dict) -> CachedScan:
+        entry = CachedScan(payload, compute_etag(payload), self.clock() + self.ttl_seconds)
+        if self.max_entries <= 0:
+            return entry
+
+        self._entries[scan_id] = entry
+        self._entries.move_to_end(scan_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, scan_ids: list[str]) -> None:
+        for scan_id in scan_ids:
+            self._entries.pop(scan_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
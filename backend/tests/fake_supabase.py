@@ -0,0 +1,189 @@
+import asyncio
+import heapq
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+
+class FakeQuery:
+
+    def __init__(self, client: "FakeSupabase", table: str):
+        self.client = client
+        self.table = table
+        self.action = "select"
+        self.columns = "*"
+        self.payload = None
+        self.count = None
+        self.filters = []
+        self.order_by = None
+        self.limit_count = None
+
+    def select(self, columns: str = "*", count: str | None = None) -> "FakeQuery":
+        self.action = "select"
+        self.columns = columns
+        self.count = count
+        return self
+
+    def insert(self, payload: dict) -> "FakeQuery":
+        self.action = "insert"
+        self.payload = payload
+        return self
+
+    def upsert(self, payload: dict, on_conflict: str = "id") -> "FakeQuery":
+        self.action = "upsert"
+        self.payload = payload
+        self.filters.append(lambda row: row.get(on_conflict) == payload.get(on_conflict))
+        return self
+
+    def update(self, payload: dict) -> "FakeQuery":
+        self.action = "update"
+        self.payload = payload
+        return self
+
+    def delete(self) -> "FakeQuery":
+        self.action = "delete"
+        return self
+
+    def eq(self, column: str, value) -> "FakeQuery":
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column: str, values: list) -> "FakeQuery":
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def lt(self, column: str, value) -> "FakeQuery":
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) < value)
+        return self
+
+    def gt(self, column: str, value) -> "FakeQuery":
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "FakeQuery":
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, count: int) -> "FakeQuery":
+        self.limit_count = count
+        return self
+
+    async def execute(self) -> SimpleNamespace:
+        self.client.calls.append((self.table, self.action, self.columns))
+        await self.client.round_trip()
+        rows = self.client.tables.setdefault(self.table, [])
+        matched = [row for row in rows if all(f(row) for f in self.filters)]
+        if self.order_by is not None:
+            column, desc = self.order_by
+            if self.limit_count is not None:
+                pick = heapq.nlargest if desc else heapq.nsmallest
+                matched = pick(self.limit_count, matched, key=lambda row: row.get(column))
+            else:
+                matched.sort(key=lambda row: row.get(column), reverse=desc)
+        if self.limit_count is not None:
+            matched = matched[:self.limit_count]
+
+        if self.action == "insert":
+            rows.append(dict(self.payload))
+            return SimpleNamespace(data=[dict(self.payload)], count=None)
+
+        if self.action == "upsert":
+            if matched:
+                matched[0].update(self.payload)
+            else:
+                rows.append(dict(self.payload))
+            return SimpleNamespace(data=[dict(self.payload)], count=None)
+
+        if self.action == "update":
+            for row in matched:
+                row.update(self.payload)
+        elif self.action == "delete":
+            deleted = {id(row) for row in matched}
+            self.client.tables[self.table] = [row for row in rows if id(row) not in deleted]
+        elif self.columns != "*":
+            names = [c.strip() for c in self.columns.split(",")]
+            matched = [{name: row.get(name) for name in names} for row in matched]
+
+        return SimpleNamespace(data=[dict(row) for row in matched], count=len(matched) if self.count else None)
+
+
+class FakeRpc:
+
+    def __init__(self, client: "FakeSupabase", name: str, params: dict):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    async def execute(self) -> SimpleNamespace:
+        self.client.calls.append(("rpc", self.name, None))
+        await self.client.round_trip()
+        return SimpleNamespace(data=self.client.functions[self.name](**self.params), count=None)
+
+
+class FakeBucket:
+
+    def __init__(self, client: "FakeSupabase", name: str):
+        self.client = client
+        self.name = name
+
+    async def upload(self, path: str, file: bytes, file_options: dict | None = None) -> dict:
+        self.client.objects[path] = file
+        self.client.object_created_at[path] = datetime.now(timezone.utc).isoformat()
+        return {"Key": f"{self.name}/{path}"}
+
+    async def remove(self, paths: list[str]) -> list[dict]:
+        self.client.calls.append(("storage", "remove", len(paths)))
+        await self.client.round_trip()
+        return [{"name": path} for path in paths if self.client.objects.pop(path, None) is not None]
+
+    async def list(self, path: str, options: dict | None = None) -> list[dict]:
+        options = options or {}
+        offset, limit = options.get("offset", 0), options.get("limit", 100)
+        sort_by = options.get("sortBy", {"column": "name", "order": "asc"})
+        self.client.calls.append(("storage", "list", offset))
+        await self.client.round_trip()
+
+        prefix = f"{path}/"
+        files = [
+            {"name": key[len(prefix):], "id": key, "created_at": self.client.object_created_at.get(key)}
+            for key in self.client.objects if key.startswith(prefix)
+        ]
+        files.sort(key=lambda file: file[sort_by["column"]], reverse=sort_by.get("order") == "desc")
+        return files[offset:offset + limit]
+
+    async def get_public_url(self, path: str) -> str:
+        return f"http://fake-supabase/storage/v1/object/public/{self.name}/{path}"
+
+
+class FakeStorage:
+
+    def __init__(self, client: "FakeSupabase"):
+        self.client = client
+
+    def from_(self, bucket: str) -> FakeBucket:
+        return FakeBucket(self.client, bucket)
+
+
+class FakeSupabase:
+    """In-memory stand-in for the parts of the supabase client used by the backend."""
+
+    def __init__(self, tables: dict[str, list[dict]] | None = None, latency: float = 0.0):
+        self.tables = tables or {}
+        self.objects: dict[str, bytes] = {}
+        self.object_created_at: dict[str, str] = {}
+        self.calls: list[tuple] = []
+        self.storage = FakeStorage(self)
+        # Stand-ins for database functions, called with the RPC parameters
+        self.functions: dict[str, callable] = {}
+        # Simulated network round trip per request, for benchmarks
+        self.latency = latency
+
+    async def round_trip(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: dict) -> FakeRpc:
+        return FakeRpc(self, name, params)
@@ -0,0 +1,94 @@
+import asyncio
+
+import main
+from airflow import TriggerCoalescer
+from tests.fake_supabase import FakeSupabase
+
+
+class FakeAirflowClient:
+
+    def __init__(self, queued: str | None = None):
+        self.queued = queued
+        self.triggered: list[str] = []
+
+    async def get_queued_dag_run(self, dag_id: str) -> str | None:
+        await asyncio.sleep(0.001)
+        return self.queued
+
+    async def trigger_dag(self, dag_id: str) -> str:
+        await asyncio.sleep(0.001)
+        self.triggered.append(f"run-{len(self.triggered) + 1}")
+        return self.triggered[-1]
+
+
+def _coalescer(client: FakeAirflowClient, window_seconds: float) -> tuple[TriggerCoalescer, dict]:
+    assignments = {}
+
+    async def on_assigned(scan_ids: list[str], dag_run_id: str):
+        for scan_id in scan_ids:
+            assignments[scan_id] = dag_run_id
+
+    return TriggerCoalescer(client, "process_scans", window_seconds, on_assigned), assignments
+
+
+def test_burst_triggers_once_per_window():
+    client = FakeAirflowClient()
+    coalescer, assignments = _coalescer(client, window_seconds=0.05)
+
+    async def scenario():
+        results = await asyncio.gather(*(coalescer.request(f"scan-{i}") for i in range(100)))
+        await asyncio.sleep(0.1)
+        return results
+
+    results = asyncio.run(scenario())
+
+    # One leading trigger for the first scan, one trailing trigger for the rest of the burst
+    assert client.triggered == ["run-1", "run-2"]
+    assert results[0] == "run-1"
+    assert results[1:] == [None] * 99
+    assert assignments["scan-0"] == "run-1"
+    assert {assignments[f"scan-{i}"] for i in range(1, 100)} == {"run-2"}
+
+
+def test_scans_attach_to_queued_run():
+    client = FakeAirflowClient(queued="queued-run")
+    coalescer, assignments = _coalescer(client, window_seconds=0)
+
+    async def scenario():
+        return [await coalescer.request(f"scan-{i}") for i in range(3)]
+
+    assert asyncio.run(scenario()) == ["queued-run"] * 3
+    assert client.triggered == []
+    assert set(assignments.values()) == {"queued-run"}
+
+
+def test_close_flushes_pending_scans():
+    client = FakeAirflowClient()
+    coalescer, assignments = _coalescer(client, window_seconds=60)
+
+    async def scenario():
+        await coalescer.request("scan-1")
+        await coalescer.request("scan-2")
+        await coalescer.close()
+
+    asyncio.run(scenario())
+
+    assert client.triggered == ["run-1", "run-2"]
+    assert assignments == {"scan-1": "run-1", "scan-2": "run-2"}
+
+
+def test_trailing_trigger_leaves_claimed_scans_to_their_run(monkeypatch):
+    fake = FakeSupabase({"scans": [
+        {"id": "scan-1", "status": "in_flight", "dag_run_id": "run-1"},
+        {"id": "scan-2", "status": "processing", "dag_run_id": None},
+    ]})
+
+    async def get_supabase():
+        return fake
+
+    monkeypatch.setattr(main, "get_supabase", get_supabase)
+
+    # run-1 claimed scan-1 before the trailing trigger of its window recorded run-2
+    asyncio.run(main.record_dag_run(["scan-1", "scan-2"], "run-2"))
+
+    assert {row["id"]: row["dag_run_id"] for row in fake.tables["scans"]} == {"scan-1": "run-1", "scan-2": "run-2"}
@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from cleanup import DataCleaner
+from tests.fake_supabase import FakeSupabase
+
+
+def _scan(scan_id: str, age_days: int) -> dict:
+    created_at = (datetime.now() - timedelta(days=age_days)).isoformat()
+    return {"id": scan_id, "image_path": f"scans/{scan_id}.jpg", "created_at": created_at}
+
+
+def _cleaner(fake: FakeSupabase, whitelist: list[str] | None = None) -> DataCleaner:
+    async def get_supabase():
+        return fake
+
+    return DataCleaner(get_supabase, age_days=2, whitelist=whitelist, batch_size=3)
+
+
+def test_cleanup_deletes_old_scans_in_batches():
+    old = [_scan(f"old-{i:02d}", age_days=5) for i in range(10)]
+    fake = FakeSupabase({"scans": old + [_scan("new", age_days=0)]})
+    fake.objects = {scan["image_path"]: b"image" for scan in fake.tables["scans"]}
+
+    asyncio.run(_cleaner(fake).cleanup())
+
+    assert [scan["id"] for scan in fake.tables["scans"]] == ["new"]
+    assert list(fake.objects) == ["scans/new.jpg"]
+    # 10 scans in pages of 3: one delete and one storage request per page instead of per scan
+    assert sum(1 for call in fake.calls if call[1] == "delete") == 4
+    assert sum(1 for call in fake.calls if call[1] == "remove") == 4
+
+
+def test_cleanup_pages_past_whitelisted_scans():
+    fake = FakeSupabase({"scans": [_scan(f"old-{i:02d}", age_days=5) for i in range(8)]})
+    whitelist = ["old-00", "old-01", "old-02", "old-03"]
+
+    asyncio.run(_cleaner(fake, whitelist).cleanup())
+
+    assert [scan["id"] for scan in fake.tables["scans"]] == whitelist
+
+
+def _store(fake: FakeSupabase, path: str, age: timedelta) -> None:
+    fake.objects[path] = b"image"
+    fake.object_created_at[path] = (datetime.now(timezone.utc) - age).isoformat()
+
+
+def test_orphan_pass_pages_through_storage_and_resumes_from_watermark():
+    fake = FakeSupabase({"scans": [_scan(f"kept-{i}", age_days=0) for i in range(3)]})
+    for i in range(3):
+        _store(fake, f"scans/kept-{i}.jpg", timedelta(hours=i + 2))
+    for i in range(5):
+        _store(fake, f"scans/orphan-{i}.jpg", timedelta(hours=i + 2, minutes=30))
+    # Upload in progress, its scan row isn't inserted yet
+    _store(fake, "scans/uploading.jpg", timedelta(seconds=5))
+
+    cleaner = DataCleaner(_cleaner(fake).get_supabase, batch_size=2, orphan_page_size=3)
+    asyncio.run(cleaner.cleanup_orphaned_images())
+
+    assert sorted(fake.objects) == ["scans/kept-0.jpg", "scans/kept-1.jpg", "scans/kept-2.jpg", "scans/uploading.jpg"]
+    watermark = fake.tables["cleanup_state"][0]["value"]
+    assert watermark == fake.object_created_at["scans/kept-0.jpg"]
+
+    # The next pass only checks objects from the watermark on
+    _store(fake, "scans/orphan-new.jpg", timedelta(hours=1, minutes=30))
+    fake.calls.clear()
+    asyncio.run(cleaner.cleanup_orphaned_images())
+
+    assert "scans/orphan-new.jpg" not in fake.objects
+    # The first page ends at the watermark object, the removed orphan shifts the second page by one.
+    # The second page starts below the watermark and ends the pass.
+    assert [call for call in fake.calls if call[:2] == ("storage", "list")] == [("storage", "list", 0), ("storage", "list", 2)]
@@ -0,0 +1,59 @@
+import asyncio
+
+from counter import LocalScanCounter, SupabaseScanCounter, utc_today
+from tests.fake_supabase import FakeSupabase
+
+
+def test_concurrent_increments_never_overshoot_the_limit():
+    counter = LocalScanCounter(limit=20)
+
+    async def scenario():
+        return await asyncio.gather(*(counter.try_increment() for _ in range(50)))
+
+    results = asyncio.run(scenario())
+
+    assert sorted(r for r in results if r is not None) == list(range(1, 21))
+    assert results.count(None) == 30
+    assert asyncio.run(counter.get()) == 20
+
+
+def test_counter_resets_on_a_new_utc_day_and_releases():
+    day = ["2026-01-01"]
+    counter = LocalScanCounter(limit=1, today=lambda: day[0])
+
+    assert asyncio.run(counter.try_increment()) == 1
+    assert asyncio.run(counter.try_increment()) is None
+    asyncio.run(counter.release())
+    assert asyncio.run(counter.try_increment()) == 1
+
+    day[0] = "2026-01-02"
+    assert asyncio.run(counter.get()) == 0
+    assert asyncio.run(counter.try_increment()) == 1
+
+
+def test_supabase_counter_uses_one_rpc_per_upload():
+    fake = FakeSupabase({"daily_scan_counts": []})
+
+    # Mirrors the increment_daily_scans SQL function: no row is returned once the limit is reached
+    def increment_daily_scans(p_limit: int) -> int | None:
+        rows = fake.tables["daily_scan_counts"]
+        row = next((row for row in rows if row["day"] == utc_today()), None)
+        if row is None:
+            rows.append({"day": utc_today(), "count": 1})
+            return 1
+        if row["count"] >= p_limit:
+            return None
+        row["count"] += 1
+        return row["count"]
+
+    fake.functions["increment_daily_scans"] = increment_daily_scans
+
+    async def get_supabase():
+        return fake
+
+    counter = SupabaseScanCounter(get_supabase, limit=2)
+    results = [asyncio.run(counter.try_increment()) for _ in range(3)]
+
+    assert results == [1, 2, None]
+    assert asyncio.run(counter.get()) == 2
+    assert [call for call in fake.calls if call[0] == "rpc"] == [("rpc", "increment_daily_scans", None)] * 3
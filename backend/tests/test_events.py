@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+import main
+from events import ScanEventHub
+from tests.fake_supabase import FakeSupabase
+
+
+def _fetch_from(fake: FakeSupabase):
+    async def fetch(scan_id: str) -> dict | None:
+        result = await fake.table("scans").select("status, progress").eq("id", scan_id).execute()
+        return result.data[0] if result.data else None
+    return fetch
+
+
+def test_watcher_is_shared_between_subscribers():
+    fake = FakeSupabase({"scans": [{"id": "scan-1", "status": "processing", "progress": None}]})
+    hub = ScanEventHub(_fetch_from(fake), poll_interval=0.01)
+
+    async def collect() -> list[dict]:
+        events = []
+        async for event in hub.subscribe("scan-1"):
+            events.append(event)
+        return events
+
+    async def scenario():
+        consumers = [asyncio.create_task(collect()) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        assert len(hub.watchers) == 1
+
+        row = fake.tables["scans"][0]
+        row.update({"status": "in_flight", "progress": {"analyze_image": "running"}})
+        await asyncio.sleep(0.05)
+        row.update({"progress": {"analyze_image": "done", "analyze_playroom": "running"}})
+        await asyncio.sleep(0.05)
+        row.update({"status": "done"})
+        return await asyncio.gather(*consumers)
+
+    results = asyncio.run(scenario())
+
+    for events in results:
+        assert [e["status"] for e in events] == ["processing", "in_flight", "in_flight", "done"]
+        assert events[2]["progress"] == {"analyze_image": "done", "analyze_playroom": "running"}
+    assert hub.watchers == {}
+    # All five clients were served by polls from the single shared watcher
+    assert len(fake.calls) < 5 * 4
+
+
+def test_events_endpoint_streams_until_done(monkeypatch):
+    fake = FakeSupabase({"scans": [{"id": "scan-1", "status": "in_flight", "progress": {}}]})
+    polls = []
+
+    async def fetch(scan_id: str) -> dict | None:
+        polls.append(scan_id)
+        if len(polls) == 2:
+            fake.tables["scans"][0]["status"] = "done"
+        return await _fetch_from(fake)(scan_id)
+
+    monkeypatch.setattr(main, "event_hub", ScanEventHub(fetch, poll_interval=0.01))
+    client = TestClient(main.app)
+    with client.stream("GET", "/api/scan/scan-1/events") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = "".join(response.iter_text())
+
+    events = [json.loads(line[len("data: "):]) for line in body.splitlines() if line.startswith("data: ")]
+    assert [e["status"] for e in events] == ["in_flight", "done"]
+
+
+def test_watcher_stops_when_the_scan_failed():
+    fake = FakeSupabase({"scans": [{"id": "scan-1", "status": "failed", "progress": {"analyze_image": "running"}}]})
+    hub = ScanEventHub(_fetch_from(fake), poll_interval=0.01)
+
+    async def collect() -> list[dict]:
+        return [event async for event in hub.subscribe("scan-1")]
+
+    events = asyncio.run(asyncio.wait_for(collect(), timeout=1))
+
+    assert [e["status"] for e in events] == ["failed"]
+    assert hub.watchers == {}
+
+
+def test_events_endpoint_reports_unknown_scan(monkeypatch):
+    monkeypatch.setattr(main, "event_hub", ScanEventHub(_fetch_from(FakeSupabase()), poll_interval=0.01))
+    client = TestClient(main.app)
+    with client.stream("GET", "/api/scan/missing/events") as response:
+        body = "".join(response.iter_text())
+
+    assert "event: not_found" in body
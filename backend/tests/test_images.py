@@ -0,0 +1,40 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from images import normalize_image
+
+
+def _phone_photo() -> bytes:
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90 degrees when displayed
+    exif[0x010F] = "Test Phone"
+
+    buffer = BytesIO()
+    Image.new("RGB", (4000, 3000), "orange").save(buffer, "JPEG", quality=95, exif=exif)
+    return buffer.getvalue()
+
+
+def test_normalize_rotates_downscales_and_strips_metadata():
+    normalized, content_type, extension, _ = normalize_image(_phone_photo(), max_edge=1024)
+
+    with Image.open(BytesIO(normalized)) as image:
+        assert image.format == "JPEG"
+        # Portrait after applying the EXIF orientation, longest edge capped
+        assert image.size == (768, 1024)
+        assert not image.getexif()
+    assert (content_type, extension) == ("image/jpeg", "jpg")
+
+
+def test_normalize_webp():
+    normalized, content_type, extension, _ = normalize_image(_phone_photo(), max_edge=512, image_format="webp")
+
+    with Image.open(BytesIO(normalized)) as image:
+        assert image.format == "WEBP"
+    assert (content_type, extension) == ("image/webp", "webp")
+
+
+def test_normalize_rejects_non_images():
+    with pytest.raises(ValueError):
+        normalize_image(b"definitely not an image")
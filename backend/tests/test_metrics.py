@@ -0,0 +1,83 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+import main
+from metrics import Histogram, ScanMetricsCollector
+from tests.fake_supabase import FakeSupabase
+
+
+def _stage(seconds: float, requests: int = 1) -> dict:
+    return {"seconds": seconds, "model": "gemini-3-flash", "requests": requests, "input_tokens": 1200,
+            "output_tokens": 300, "thinking_tokens": 800, "tool_calls": 2, "throttled": 1}
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency", (1, 5))
+    for value in (0.5, 3, 3, 10):
+        histogram.observe(value, stage="vision")
+
+    assert histogram.render() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{stage="vision",le="1"} 1',
+        'latency_seconds_bucket{stage="vision",le="5"} 3',
+        'latency_seconds_bucket{stage="vision",le="+Inf"} 4',
+        'latency_seconds_sum{stage="vision"} 16.5',
+        'latency_seconds_count{stage="vision"} 4',
+    ]
+
+
+def test_collector_reads_each_completed_scan_once():
+    fake = FakeSupabase({"scans": [
+        {"id": "old", "completed_at": "2000-01-01T00:00:00+00:00", "metrics": {"analyze_image": _stage(9)}},
+        {"id": "a", "completed_at": "2999-01-01T00:00:01+00:00", "metrics": {"analyze_image": _stage(12), "safety_check": _stage(4, requests=0)}},
+        {"id": "pending", "completed_at": None, "metrics": None},
+    ]})
+
+    async def get_supabase():
+        return fake
+
+    now = [0.0]
+    collector = ScanMetricsCollector(get_supabase, refresh_seconds=10, page_size=1, clock=lambda: now[0])
+    asyncio.run(collector.refresh())
+    fake.tables["scans"].append({"id": "b", "completed_at": "2999-01-01T00:00:02+00:00", "metrics": {"analyze_image": _stage(14)}})
+    # Throttled: scrapes within the refresh interval don't query
+    asyncio.run(collector.refresh())
+    assert collector.scans == 1
+    now[0] = 11
+    asyncio.run(collector.refresh())
+
+    assert collector.scans == 2
+    assert collector.requests == {("analyze_image", "gemini-3-flash"): 2, ("safety_check", "gemini-3-flash"): 0}
+    assert collector.tool_calls == {"analyze_image": 4, "safety_check": 2}
+    assert collector.throttled == {"analyze_image": 2, "safety_check": 1}
+    # The cached safety check has a duration but no token observations
+    lines = collector.render()
+    assert 'playroom_stage_duration_seconds_count{model="gemini-3-flash",stage="safety_check"} 1' in lines
+    assert not any('stage="safety_check"' in line for line in lines if line.startswith("playroom_stage_tokens"))
+
+
+def test_collector_counts_tiered_analyses():
+    collector = ScanMetricsCollector(None)
+    collector.observe({"analyze_playroom": {**_stage(8), "tier": "flash", "escalation": None}})
+    collector.observe({"analyze_playroom": {**_stage(40, requests=2), "tier": "pro", "escalation": "validation"}})
+    # Without tiering, or answered from the agent result cache
+    collector.observe({"analyze_playroom": _stage(25)})
+
+    assert collector.tiers == {("flash", "none"): 1, ("pro", "validation"): 1}
+    lines = collector.render()
+    assert 'playroom_analysis_tier_total{tier="pro",escalation="validation"} 1' in lines
+    assert 'playroom_analysis_tier_duration_seconds_sum{escalation="none",tier="flash"} 8' in lines
+
+
+def test_metrics_endpoint_serves_prometheus_text(monkeypatch):
+    async def get_supabase():
+        return FakeSupabase({"scans": []})
+
+    monkeypatch.setattr(main, "scan_metrics", ScanMetricsCollector(get_supabase))
+    response = TestClient(main.app).get("/api/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE playroom_scan_cache_hits_total counter" in response.text
+    assert "playroom_scans_completed_total 0" in response.text
@@ -0,0 +1,79 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw
+
+from images import normalize_image
+from phash import PerceptualHashIndex
+
+
+def _playroom_jpeg(size: tuple[int, int], quality: int) -> bytes:
+    image = Image.new("RGB", (800, 600), "beige")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((50, 300, 250, 550), fill="red")
+    draw.ellipse((400, 100, 600, 300), fill="blue")
+    draw.rectangle((650, 400, 780, 580), fill="green")
+
+    buffer = BytesIO()
+    image.resize(size).save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def _phash(data: bytes) -> int | None:
+    # Uploads are hashed while they are normalized
+    return normalize_image(data)[3]
+
+
+def test_dhash_survives_reencoding_and_resizing():
+    original = _phash(_playroom_jpeg((800, 600), quality=95))
+    reencoded = _phash(_playroom_jpeg((400, 300), quality=60))
+
+    assert (original ^ reencoded).bit_count() <= 6
+
+
+def _encoded(image: Image.Image, image_format: str) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def _near_uniform() -> Image.Image:
+    # A covered lens: dark, with a little sensor noise
+    image = Image.new("L", (400, 300))
+    image.putdata([20 + (i * 7919) % 5 for i in range(400 * 300)])
+    return image
+
+
+@pytest.mark.parametrize("data", [
+    _encoded(Image.new("RGB", (800, 600)), "JPEG"),
+    _encoded(Image.new("RGB", (800, 600), "white"), "PNG"),
+    _encoded(_near_uniform(), "JPEG"),
+    _encoded(Image.new("CMYK", (800, 600), (0, 50, 100, 0)), "JPEG"),
+    _encoded(Image.new("RGBA", (800, 600), (10, 200, 30, 0)), "PNG"),
+    _encoded(Image.new("I;16", (800, 600), 40000), "PNG"),
+    _encoded(Image.new("P", (80, 60), 3), "GIF"),
+    _encoded(Image.new("RGB", (1, 1), "red"), "PNG"),
+    # Every column darker than the one on its left, all bits set
+    _encoded(Image.linear_gradient("L").rotate(-90).resize((800, 600)), "JPEG"),
+], ids=["black", "white", "near-uniform", "cmyk", "transparent", "16-bit", "gif", "1x1", "gradient"])
+def test_low_information_images_have_no_hash(data):
+    assert _phash(data) is None
+
+
+def test_index_finds_nearest_within_distance():
+    index = PerceptualHashIndex(max_distance=4)
+    index.add("a", 0b1111_0000)
+    index.add("b", 0xFFFF_0000_FFFF_0000)
+
+    assert index.find(0b1111_0011) == ("a", 2)
+    assert index.find(0xFFFF_0000_FFFF_0000 ^ 0b111) == ("b", 3)
+    assert index.find(0x0F0F_0F0F_0F0F_0F0F) is None
+
+
+def test_index_remove():
+    index = PerceptualHashIndex(max_distance=2)
+    index.add("a", 42)
+    index.remove("a")
+
+    assert index.find(42) is None
+    assert len(index) == 0
@@ -0,0 +1,84 @@
+from fastapi.testclient import TestClient
+
+import main
+from results import compact_result, section_status
+from scan_cache import ScanCache
+from tests.fake_supabase import FakeSupabase
+
+
+def _result(toys: int) -> dict:
+    return {
+        "status_quo": "Lots of blocks.",
+        "toy_inventory": [
+            {"category": "blocks", "item_name": f"block {i}", "play_mode": "build", "count": 1,
+             "bbox": {"x": 0.1, "y": 0.2, "w": 0.05, "h": 0.05}}
+            for i in range(toys)
+        ],
+        "roadmap": [{"timeframe": "now", "recommended_toy": "puzzle", "reasoning": "Because puzzles."}],
+    }
+
+
+def test_compact_result_drops_bboxes_and_reasoning():
+    compact = compact_result(_result(2))
+
+    assert compact["toy_inventory"][0] == {"category": "blocks", "item_name": "block 0", "play_mode": "build", "count": 1}
+    assert compact["roadmap"] == [{"timeframe": "now", "recommended_toy": "puzzle"}]
+    assert compact["status_quo"] == "Lots of blocks."
+    assert compact_result(None) is None
+
+
+def test_section_status_follows_the_agent_stages():
+    assert section_status("in_flight", {"analyze_image": "done", "analyze_playroom": "running"}) == {
+        "toy_inventory": "done", "play_quest": "pending", "analysis": "running", "safety": "pending",
+    }
+    assert section_status("processing", None) == dict.fromkeys(["toy_inventory", "play_quest", "analysis", "safety"], "pending")
+    assert set(section_status("done", None).values()) == {"done"}
+
+
+def test_pending_scan_returns_the_sections_done_so_far(monkeypatch):
+    fake = FakeSupabase({"scans": [{
+        "id": "pending-1", "status": "in_flight", "image_path": "scans/pending-1.jpg", "child_age": 4,
+        "results_json": {"toy_inventory": _result(3)["toy_inventory"]}, "progress": {"analyze_image": "done"},
+    }]})
+
+    async def get_supabase():
+        return fake
+
+    monkeypatch.setattr(main, "get_supabase", get_supabase)
+    monkeypatch.setattr(main, "scan_cache", ScanCache())
+    client = TestClient(main.app)
+
+    response = client.get("/api/scan/pending-1?view=compact")
+    assert response.headers["cache-control"] == "no-cache"
+    body = response.json()
+    assert body["sections"]["toy_inventory"] == "done" and body["sections"]["analysis"] == "pending"
+    assert len(body["result"]["toy_inventory"]) == 3
+    assert "bbox" not in body["result"]["toy_inventory"][0]
+
+
+def test_scan_endpoint_projects_columns_and_compresses(monkeypatch):
+    fake = FakeSupabase({"scans": [
+        {"id": "done-1", "status": "done", "image_path": "scans/done-1.jpg", "image_hash": "abc", "child_age": 4, "results_json": _result(200)},
+        {"id": "pending-1", "status": "processing", "image_path": "scans/pending-1.jpg", "child_age": 4},
+    ]})
+
+    async def get_supabase():
+        return fake
+
+    monkeypatch.setattr(main, "get_supabase", get_supabase)
+    monkeypatch.setattr(main, "scan_cache", ScanCache())
+    client = TestClient(main.app)
+
+    assert client.get("/api/scan/pending-1?fields=status").json() == {"scan_id": "pending-1", "status": "processing"}
+    assert fake.calls[-1] == ("scans", "select", "status")
+
+    full = client.get("/api/scan/done-1", headers={"Accept-Encoding": "gzip"})
+    assert fake.calls[-1] == ("scans", "select", main.SCAN_COLUMNS)
+    assert "image_hash" not in full.json()
+    assert full.headers["content-encoding"] == "gzip"
+    assert int(full.headers["content-length"]) < len(full.content) / 4
+
+    compact = client.get("/api/scan/done-1?view=compact")
+    assert "bbox" not in compact.json()["result"]["toy_inventory"][0]
+    assert compact.headers["etag"] != full.headers["etag"]
+    assert client.get("/api/scan/done-1?view=compact", headers={"If-None-Match": compact.headers["etag"]}).status_code == 304
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+import main
+from cleanup import DataCleaner
+from scan_cache import ScanCache
+from tests.fake_supabase import FakeSupabase
+
+
+def test_cache_evicts_least_recently_used_and_expired_entries():
+    now = [0.0]
+    cache = ScanCache(max_entries=2, ttl_seconds=10, clock=lambda: now[0])
+    cache.put("a", {"scan_id": "a"})
+    cache.put("b", {"scan_id": "b"})
+    assert cache.get("a") is not None
+    cache.put("c", {"scan_id": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a").payload == {"scan_id": "a"}
+
+    now[0] = 11
+    assert cache.get("c") is None
+    assert cache.stats() == {"entries": 1, "max_entries": 2, "hits": 2, "misses": 2, "hit_rate": 0.5}
+
+
+def test_repeat_views_of_a_done_scan_skip_the_database(monkeypatch):
+    fake = FakeSupabase({"scans": [
+        {"id": "done-1", "status": "done", "image_path": "scans/done-1.jpg", "child_age": 4, "results_json": {"roadmap": []}},
+        {"id": "pending-1", "status": "in_flight", "image_path": "scans/pending-1.jpg", "child_age": 4},
+    ]})
+
+    async def get_supabase():
+        return fake
+
+    monkeypatch.setattr(main, "get_supabase", get_supabase)
+    monkeypatch.setattr(main, "scan_cache", ScanCache())
+    client = TestClient(main.app)
+
+    first = client.get("/api/scan/done-1")
+    assert first.json()["result"] == {"roadmap": []}
+    assert "immutable" in first.headers["cache-control"]
+    etag = first.headers["etag"]
+
+    assert client.get("/api/scan/done-1").json() == first.json()
+    revalidated = client.get("/api/scan/done-1", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    # Only the first view queried the database
+    assert len([call for call in fake.calls if call[0] == "scans"]) == 1
+
+    # Unfinished scans are neither cached nor marked cacheable
+    for _ in range(2):
+        pending = client.get("/api/scan/pending-1")
+        assert pending.headers["cache-control"] == "no-cache"
+        assert "etag" not in pending.headers
+    assert len([call for call in fake.calls if call[0] == "scans"]) == 3
+    assert client.get("/api/cache/stats").json()["scan_cache"]["hits"] == 2
+
+
+def test_cleanup_invalidates_deleted_scans():
+    created_at = (datetime.now() - timedelta(days=5)).isoformat()
+    fake = FakeSupabase({"scans": [{"id": "old", "image_path": "scans/old.jpg", "created_at": created_at}]})
+    cache = ScanCache()
+    cache.put("old", {"scan_id": "old"})
+
+    async def get_supabase():
+        return fake
+
+    asyncio.run(DataCleaner(get_supabase, age_days=2, on_deleted=cache.invalidate).cleanup())
+
+    assert len(cache) == 0